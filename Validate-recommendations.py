@@ -1,11 +1,89 @@
+import argparse
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
 import random
+from itertools import islice
+from math import exp, floor, log
+
+# The enrichment only reads the frames it selects/joins, so let pandas share
+# buffers lazily instead of copying them (always on from pandas 3.0)
+if int(pd.__version__.split('.')[0]) < 3:
+    pd.options.mode.copy_on_write = True
+
+# Intermediate handoff between Step 1 and Steps 2/3
+ENRICHED_PATH = 'recommendations_with_names.parquet'
+
+# Column order of the enriched recommendations
+ENRICHED_COLUMNS = [
+    'customer_id', 'customer_name', 'city', 'state', 'end_use', 'customer_type',
+    'rank', 'score',
+    'recommended_product', 'recommended_product_name', 'recommended_brand', 
+    'recommended_category', 'recommended_subcategory', 'recommended_price',
+    'recommended_qty',
+    'trigger_product', 'trigger_product_name', 'trigger_brand',
+    'trigger_category', 'trigger_subcategory',
+    'support', 'confidence',
+    'readable_reason',
+    'cluster_id', 'segment'
+]
+
+# Categories a customer's end_use is expected to buy from
+EXPECTED_CATEGORIES = {
+    end_use: frozenset(categories) for end_use, categories in {
+        'General Construction': ['Power Tools', 'Hand Tools', 'Fasteners', 'Building Materials'],
+        'Residential Construction': ['Power Tools', 'Hand Tools', 'Fasteners', 'Building Materials'],
+        'Painting': ['Paints & Coatings', 'Painting Supplies', 'Hand Tools'],
+        'Plumbing': ['Plumbing', 'Hand Tools', 'Power Tools', 'Adhesives & Sealants'],
+        'Electrical': ['Electrical', 'Power Tools', 'Hand Tools'],
+        'HVAC': ['HVAC', 'Electrical', 'Hand Tools'],
+        'Flooring': ['Building Materials', 'Adhesives & Sealants', 'Power Tools'],
+        'Roofing': ['Building Materials', 'Fasteners', 'Power Tools', 'Safety Equipment'],
+    }.items()
+}
+
+# ============================================================
+# HELPERS
+# ============================================================
+
+def write_csv(df, path):
+    """
+    Writes a DataFrame to CSV with PyArrow's multi-threaded writer.
+    String values and headers are quoted and booleans are written as
+    true / false (see VALIDATION_GUIDE.md for samples)
+    """
+    pacsv.write_csv(
+        pa.Table.from_pandas(df, preserve_index=False), path,
+        write_options=pacsv.WriteOptions(quoting_style="needed"),
+    )
+
+
+def reservoir_sample(iterable, k, rng):
+    """
+    Uniformly samples up to k items in one pass (Algorithm L).
+    Keeps O(k) memory and skips ahead geometrically, so only about
+    k·log(N/k) random draws are needed instead of one per item.
+    """
+    it = iter(iterable)
+    reservoir = list(islice(it, k))
+    if len(reservoir) < k or k == 0:
+        return reservoir
+    
+    w = exp(log(rng.random()) / k)
+    while True:
+        skip = floor(log(rng.random()) / log(1 - w))
+        item = next(islice(it, skip, None), None)
+        if item is None:
+            return reservoir
+        reservoir[rng.randrange(k)] = item
+        w *= exp(log(rng.random()) / k)
 
 # ============================================================
 # STEP 1: ADD PRODUCT NAMES TO RECOMMENDATIONS
 # ============================================================
 
-def add_product_names_to_recommendations():
+def add_product_names_to_recommendations(export_csv=False):
     """
     Adds product names and details to make recommendations readable
     """
@@ -15,93 +93,136 @@ def add_product_names_to_recommendations():
     
     # Load the data
     print("\n📂 Loading data files...")
-    recommendations = pd.read_csv('recommendations.csv')
-    products = pd.read_csv('products.csv')
-    customers = pd.read_csv('customers.csv')
+    recommendations = pd.read_csv(
+        'recommendations.csv', engine='pyarrow',
+        dtype={'customer_id': 'string', 'recommended_product': 'string', 'trigger_product': 'string'}
+    )
+    products = pd.read_csv(
+        'products.csv', engine='pyarrow',
+        usecols=['product_id', 'product_name', 'brand', 'l2_category', 'l3_category', 'unit_price'],
+        dtype={'product_id': 'string', 'unit_price': 'float64'}
+    )
+    customers = pd.read_csv(
+        'customers.csv', engine='pyarrow',
+        usecols=['customer_id', 'customer_name', 'end_use', 'customer_type', 'city', 'state'],
+        dtype={'customer_id': 'string'}
+    )
     
     print(f"✅ Loaded {len(recommendations)} recommendations")
     print(f"✅ Loaded {len(products)} products")
     print(f"✅ Loaded {len(customers)} customers")
     
-    # Merge product details for recommended product
-    print("\n🔗 Adding product names for recommended products...")
-    recommendations_enriched = recommendations.merge(
-        products[['product_id', 'product_name', 'brand', 'l2_category', 'l3_category', 'unit_price']],
-        left_on='recommended_product',
-        right_on='product_id',
-        how='left'
+    # Drop recommendation columns the output never uses so they are not
+    # copied through every join
+    recommendations = recommendations.drop(
+        columns=[col for col in recommendations.columns if col not in ENRICHED_COLUMNS]
     )
     
-    # Rename columns for clarity
-    recommendations_enriched = recommendations_enriched.rename(columns={
+    # Share one categorical dtype per key so the joins compare integer
+    # codes instead of hashing Python strings. Categories cover ids from
+    # both sides so unmatched recommendation ids are kept, not nulled;
+    # null ids are left out of the categories and stay null.
+    product_dtype = pd.CategoricalDtype(pd.concat([
+        products['product_id'],
+        recommendations['recommended_product'],
+        recommendations['trigger_product']
+    ]).dropna().unique())
+    customer_dtype = pd.CategoricalDtype(pd.concat([
+        customers['customer_id'],
+        recommendations['customer_id']
+    ]).dropna().unique())
+    products['product_id'] = products['product_id'].astype(product_dtype)
+    recommendations['recommended_product'] = recommendations['recommended_product'].astype(product_dtype)
+    recommendations['trigger_product'] = recommendations['trigger_product'].astype(product_dtype)
+    customers['customer_id'] = customers['customer_id'].astype(customer_dtype)
+    recommendations['customer_id'] = recommendations['customer_id'].astype(customer_dtype)
+    
+    # Index lookup tables once so each join probes an existing index
+    # instead of re-hashing the right-hand frame
+    products_indexed = products.set_index('product_id')
+    customers_indexed = customers.set_index('customer_id')
+    
+    prod_rec = products_indexed[
+        ['product_name', 'brand', 'l2_category', 'l3_category', 'unit_price']
+    ].rename(columns={
         'product_name': 'recommended_product_name',
         'brand': 'recommended_brand',
         'l2_category': 'recommended_category',
         'l3_category': 'recommended_subcategory',
         'unit_price': 'recommended_price'
     })
-    
-    # Merge product details for trigger product
-    print("🔗 Adding product names for trigger products...")
-    recommendations_enriched = recommendations_enriched.merge(
-        products[['product_id', 'product_name', 'brand', 'l2_category', 'l3_category']],
-        left_on='trigger_product',
-        right_on='product_id',
-        how='left',
-        suffixes=('', '_trigger')
-    )
-    
-    # Rename trigger columns
-    recommendations_enriched = recommendations_enriched.rename(columns={
+    prod_trig = products_indexed[
+        ['product_name', 'brand', 'l2_category', 'l3_category']
+    ].rename(columns={
         'product_name': 'trigger_product_name',
         'brand': 'trigger_brand',
         'l2_category': 'trigger_category',
         'l3_category': 'trigger_subcategory'
     })
+    cust_details = customers_indexed[
+        ['customer_name', 'end_use', 'customer_type', 'city', 'state']
+    ]
+    
+    # Merge product details for recommended product
+    print("\n🔗 Adding product names for recommended products...")
+    recommendations_enriched = recommendations.join(
+        prod_rec, on='recommended_product', how='left', validate='m:1'
+    )
+    
+    # Merge product details for trigger product
+    print("🔗 Adding product names for trigger products...")
+    recommendations_enriched = recommendations_enriched.join(
+        prod_trig, on='trigger_product', how='left', validate='m:1'
+    )
     
     # Add customer details
     print("🔗 Adding customer names...")
-    recommendations_enriched = recommendations_enriched.merge(
-        customers[['customer_id', 'customer_name', 'end_use', 'customer_type', 'city', 'state']],
-        on='customer_id',
-        how='left'
+    recommendations_enriched = recommendations_enriched.join(
+        cust_details, on='customer_id', how='left', validate='m:1'
     )
     
-    # Create a human-readable reason
-    recommendations_enriched['readable_reason'] = (
-        recommendations_enriched['trigger_product_name'] + 
-        " → " + 
-        recommendations_enriched['recommended_product_name'] +
-        f" (confidence: " +
-        (recommendations_enriched['confidence'] * 100).round(0).astype(int).astype(str) + "%)"
+    # Create a human-readable reason in one pass over the raw arrays
+    trigger_names = recommendations_enriched['trigger_product_name']
+    recommended_names = recommendations_enriched['recommended_product_name']
+    confidence_pct = (recommendations_enriched['confidence'].to_numpy() * 100).round().astype(int)
+    readable_reason = pd.Series(
+        [
+            f"{trig} → {rec} (confidence: {conf}%)"
+            for trig, rec, conf in zip(trigger_names.to_numpy(), recommended_names.to_numpy(), confidence_pct)
+        ],
+        index=recommendations_enriched.index
+    )
+    # Rows with an unknown product name have no readable reason
+    recommendations_enriched['readable_reason'] = readable_reason.where(
+        trigger_names.notna() & recommended_names.notna()
     )
     
-    # Reorder columns for readability
-    columns_order = [
-        'customer_id', 'customer_name', 'city', 'state', 'end_use', 'customer_type',
-        'rank', 'score',
-        'recommended_product', 'recommended_product_name', 'recommended_brand', 
-        'recommended_category', 'recommended_subcategory', 'recommended_price',
-        'recommended_qty',
-        'trigger_product', 'trigger_product_name', 'trigger_brand',
-        'trigger_category', 'trigger_subcategory',
-        'support', 'confidence',
-        'readable_reason',
-        'cluster_id', 'segment'
-    ]
-    
-    # Keep only columns that exist
-    columns_order = [col for col in columns_order if col in recommendations_enriched.columns]
+    # Reorder columns for readability, keeping only columns that exist
+    columns_order = [col for col in ENRICHED_COLUMNS if col in recommendations_enriched.columns]
     recommendations_enriched = recommendations_enriched[columns_order]
     
-    # Save enriched recommendations
-    recommendations_enriched.to_csv('recommendations_with_names.csv', index=False)
-    print(f"\n✅ Enriched recommendations saved to: recommendations_with_names.csv")
+    # Save enriched recommendations — Parquet is the handoff to Steps 2/3,
+    # CSV is only written when a human-readable copy is requested
+    recommendations_enriched.to_parquet(ENRICHED_PATH, compression='snappy', index=False)
+    print(f"\n✅ Enriched recommendations saved to: {ENRICHED_PATH}")
+    if export_csv:
+        write_csv(recommendations_enriched, 'recommendations_with_names.csv')
+        print(f"✅ CSV export saved to: recommendations_with_names.csv")
     print(f"✅ Total rows: {len(recommendations_enriched)}")
     
     return recommendations_enriched
 
 
+def load_enriched_recommendations():
+    """
+    Loads the enriched recommendations saved by Step 1
+    """
+    print(f"\n📂 Loading enriched recommendations from {ENRICHED_PATH}...")
+    recommendations_enriched = pd.read_parquet(ENRICHED_PATH)
+    print(f"✅ Loaded {len(recommendations_enriched)} enriched recommendations")
+    return recommendations_enriched
+
+
 # ============================================================
 # STEP 2: ANALYZE 10 SAMPLE CUSTOMERS
 # ============================================================
@@ -116,18 +237,51 @@ def analyze_sample_customers(recommendations_enriched, num_samples=10):
     
     # Load market basket to see what customers actually bought
     print("\n📂 Loading customer purchase history...")
-    market_basket = pd.read_csv('market_basket.csv')
-    
-    # Get unique customers from recommendations
-    unique_customers = recommendations_enriched['customer_id'].unique()
+    market_basket = pd.read_csv(
+        'market_basket.csv', engine='pyarrow',
+        usecols=['customer_id', 'product_id', 'l2_category', 'l3_category', 'total_quantity', 'purchase_frequency'],
+        dtype={'customer_id': 'string', 'product_id': 'string'}
+    )
     
-    # Sample 10 random customers
-    random.seed(42)
-    sample_customers = random.sample(list(unique_customers), min(num_samples, len(unique_customers)))
+    # Sample 10 random customers in a single pass over the unique ids
+    sample_customers = reservoir_sample(
+        recommendations_enriched['customer_id'].drop_duplicates(), num_samples, random.Random(42)
+    )
     
     print(f"\n🎲 Randomly selected {len(sample_customers)} customers for validation\n")
     
-    validation_report = []
+    # Split both frames by customer once instead of masking per customer
+    rec_groups = dict(tuple(recommendations_enriched.groupby('customer_id', sort=False, observed=True)))
+    mb_groups = dict(tuple(market_basket.groupby('customer_id', sort=False)))
+    
+    # One profile row per customer, indexed for direct lookups
+    customer_meta = recommendations_enriched.drop_duplicates('customer_id').set_index('customer_id')[
+        ['customer_name', 'city', 'state', 'end_use', 'customer_type', 'segment', 'cluster_id']
+    ]
+    
+    # Recommended categories per customer, in first-seen order
+    rec_categories_by_customer = recommendations_enriched.groupby(
+        'customer_id', sort=False, observed=True
+    )['recommended_category'].unique()
+    empty_purchases = market_basket.iloc[0:0]
+    
+    # Category totals for every customer in one grouped aggregation
+    category_summary_all = market_basket.groupby(['customer_id', 'l2_category']).agg(
+        total_quantity=('total_quantity', 'sum'),
+        purchase_frequency=('purchase_frequency', 'sum')
+    )
+    
+    # Validation summary columns, filled in place per sampled customer
+    n = len(sample_customers)
+    customer_names = [None] * n
+    end_uses = [None] * n
+    segments = [None] * n
+    clusters = [None] * n
+    avg_scores = np.empty(n)
+    max_scores = np.empty(n)
+    avg_confidences = np.empty(n)
+    categories_match = np.empty(n, dtype=bool)
+    qualities = [None] * n
     
     for idx, customer_id in enumerate(sample_customers, 1):
         print("=" * 80)
@@ -135,9 +289,7 @@ def analyze_sample_customers(recommendations_enriched, num_samples=10):
         print("=" * 80)
         
         # Get customer info
-        cust_info = recommendations_enriched[
-            recommendations_enriched['customer_id'] == customer_id
-        ].iloc[0]
+        cust_info = customer_meta.loc[customer_id]
         
         print(f"\n📋 CUSTOMER PROFILE:")
         print(f"  • Name: {cust_info['customer_name']}")
@@ -148,66 +300,59 @@ def analyze_sample_customers(recommendations_enriched, num_samples=10):
         print(f"  • Cluster: {cust_info['cluster_id']}")
         
         # Get what they actually bought
-        customer_purchases = market_basket[market_basket['customer_id'] == customer_id]
+        customer_purchases = mb_groups.get(customer_id, empty_purchases)
         
         if len(customer_purchases) > 0:
             print(f"\n🛒 PURCHASE HISTORY (by Category):")
-            category_summary = customer_purchases.groupby('l2_category').agg({
-                'total_quantity': 'sum',
-                'purchase_frequency': 'sum'
-            }).sort_values('total_quantity', ascending=False)
+            category_summary = category_summary_all.loc[customer_id].sort_values(
+                'total_quantity', ascending=False
+            )
             
-            for cat, row in category_summary.head(5).iterrows():
-                print(f"  • {cat}: {int(row['total_quantity'])} units ({int(row['purchase_frequency'])} purchases)")
+            for cat, total_quantity, purchase_frequency in category_summary.head(5).itertuples(name=None):
+                print(f"  • {cat}: {int(total_quantity)} units ({int(purchase_frequency)} purchases)")
             
             # Show specific products
             print(f"\n🔍 TOP PRODUCTS PURCHASED:")
             top_products = customer_purchases.nlargest(5, 'total_quantity')[
                 ['product_id', 'l2_category', 'l3_category', 'total_quantity']
             ]
-            for _, prod in top_products.iterrows():
-                print(f"  • {prod['product_id']}: {prod['l3_category']} ({prod['l2_category']}) - {int(prod['total_quantity'])} units")
+            for product_id, l2_category, l3_category, total_quantity in top_products.itertuples(index=False, name=None):
+                print(f"  • {product_id}: {l3_category} ({l2_category}) - {int(total_quantity)} units")
         else:
             print("\n⚠️  No purchase history found in market basket")
         
         # Get recommendations for this customer
-        customer_recs = recommendations_enriched[
-            recommendations_enriched['customer_id'] == customer_id
-        ].sort_values('rank')
+        customer_recs = rec_groups[customer_id].sort_values('rank')
         
         print(f"\n🎯 TOP 5 RECOMMENDATIONS:")
-        for _, rec in customer_recs.iterrows():
-            print(f"\n  Rank {int(rec['rank'])}:")
-            print(f"    Product: {rec['recommended_product_name']}")
-            print(f"    Brand: {rec['recommended_brand']}")
-            print(f"    Category: {rec['recommended_subcategory']} ({rec['recommended_category']})")
-            print(f"    Price: ${rec['recommended_price']}")
-            print(f"    Qty: {rec['recommended_qty']} units")
-            print(f"    Score: {rec['score']:.3f}")
-            print(f"    Confidence: {rec['confidence']*100:.0f}%")
-            print(f"    Why: {rec['trigger_product_name']} → {rec['recommended_product_name']}")
+        rec_cols = [
+            'rank', 'recommended_product_name', 'recommended_brand', 'recommended_subcategory',
+            'recommended_category', 'recommended_price', 'recommended_qty', 'score', 'confidence',
+            'trigger_product_name'
+        ]
+        for rank, rec_name, brand, subcategory, category, price, qty, score, conf, trig_name in (
+            customer_recs[rec_cols].itertuples(index=False, name=None)
+        ):
+            print(f"\n  Rank {int(rank)}:")
+            print(f"    Product: {rec_name}")
+            print(f"    Brand: {brand}")
+            print(f"    Category: {subcategory} ({category})")
+            print(f"    Price: ${price}")
+            print(f"    Qty: {qty} units")
+            print(f"    Score: {score:.3f}")
+            print(f"    Confidence: {conf*100:.0f}%")
+            print(f"    Why: {trig_name} → {rec_name}")
         
         # Business sense validation
         print(f"\n✅ BUSINESS SENSE CHECK:")
         
         # Check 1: Do recommendations match customer's end_use?
-        rec_categories = customer_recs['recommended_category'].unique()
+        rec_categories = rec_categories_by_customer[customer_id]
         print(f"\n  1. Recommendation Categories: {', '.join(rec_categories)}")
         
         # Check 2: Are categories aligned with end_use?
         end_use = cust_info['end_use']
-        expected_categories = {
-            'General Construction': ['Power Tools', 'Hand Tools', 'Fasteners', 'Building Materials'],
-            'Residential Construction': ['Power Tools', 'Hand Tools', 'Fasteners', 'Building Materials'],
-            'Painting': ['Paints & Coatings', 'Painting Supplies', 'Hand Tools'],
-            'Plumbing': ['Plumbing', 'Hand Tools', 'Power Tools', 'Adhesives & Sealants'],
-            'Electrical': ['Electrical', 'Power Tools', 'Hand Tools'],
-            'HVAC': ['HVAC', 'Electrical', 'Hand Tools'],
-            'Flooring': ['Building Materials', 'Adhesives & Sealants', 'Power Tools'],
-            'Roofing': ['Building Materials', 'Fasteners', 'Power Tools', 'Safety Equipment'],
-        }
-        
-        expected = expected_categories.get(end_use, [])
+        expected = EXPECTED_CATEGORIES.get(end_use, frozenset())
         matches = [cat for cat in rec_categories if cat in expected]
         
         if matches:
@@ -240,18 +385,16 @@ def analyze_sample_customers(recommendations_enriched, num_samples=10):
             print(f"     ❌ Low confidence")
         
         # Store validation summary
-        validation_report.append({
-            'customer_id': customer_id,
-            'customer_name': cust_info['customer_name'],
-            'end_use': end_use,
-            'segment': cust_info['segment'],
-            'cluster': cust_info['cluster_id'],
-            'avg_score': avg_score,
-            'max_score': max_score,
-            'avg_confidence': avg_conf,
-            'categories_match': len(matches) > 0,
-            'quality': 'High' if max_score >= 0.4 else ('Medium' if max_score >= 0.3 else 'Low')
-        })
+        row = idx - 1
+        customer_names[row] = cust_info['customer_name']
+        end_uses[row] = end_use
+        segments[row] = cust_info['segment']
+        clusters[row] = cust_info['cluster_id']
+        avg_scores[row] = avg_score
+        max_scores[row] = max_score
+        avg_confidences[row] = avg_conf
+        categories_match[row] = len(matches) > 0
+        qualities[row] = 'High' if max_score >= 0.4 else ('Medium' if max_score >= 0.3 else 'Low')
         
         print("\n")
     
@@ -260,7 +403,18 @@ def analyze_sample_customers(recommendations_enriched, num_samples=10):
     print("VALIDATION SUMMARY")
     print("=" * 80)
     
-    validation_df = pd.DataFrame(validation_report)
+    validation_df = pd.DataFrame({
+        'customer_id': sample_customers,
+        'customer_name': customer_names,
+        'end_use': end_uses,
+        'segment': segments,
+        'cluster': clusters,
+        'avg_score': avg_scores,
+        'max_score': max_scores,
+        'avg_confidence': avg_confidences,
+        'categories_match': categories_match,
+        'quality': qualities
+    })
     
     print(f"\n📊 OVERALL STATISTICS:")
     print(f"  • Customers Analyzed: {len(validation_df)}")
@@ -275,56 +429,46 @@ def analyze_sample_customers(recommendations_enriched, num_samples=10):
         print(f"  • {quality}: {count}/{len(validation_df)} ({count/len(validation_df)*100:.0f}%)")
     
     # Save validation report
-    validation_df.to_csv('validation_report.csv', index=False)
+    write_csv(validation_df, 'validation_report.csv')
     print(f"\n✅ Validation report saved to: validation_report.csv")
     
-    return validation_df
+    return validation_df, sample_customers, rec_groups
 
 
 # ============================================================
 # STEP 3: CREATE SALESPERSON-FRIENDLY REPORT
 # ============================================================
 
-def create_salesperson_report(recommendations_enriched, num_samples=10):
+def create_salesperson_report(sample_customers, rec_groups):
     """
-    Creates a simple, readable report for salespeople
+    Creates a simple, readable report for salespeople, reusing the
+    customers sampled (and grouped) in Step 2
     """
     print("\n" + "=" * 80)
     print("STEP 3: CREATING SALESPERSON-FRIENDLY REPORT")
     print("=" * 80)
     
-    # Sample customers
-    unique_customers = recommendations_enriched['customer_id'].unique()
-    random.seed(42)
-    sample_customers = random.sample(list(unique_customers), min(num_samples, len(unique_customers)))
-    
-    # Create simple report
-    report_rows = []
+    # Collect each sampled customer's recommendations and concatenate once
+    sample_recs = pd.concat(
+        [rec_groups[customer_id].sort_values('rank') for customer_id in sample_customers],
+        ignore_index=True
+    )
     
-    for customer_id in sample_customers:
-        customer_recs = recommendations_enriched[
-            recommendations_enriched['customer_id'] == customer_id
-        ].sort_values('rank')
-        
-        cust_info = customer_recs.iloc[0]
-        
-        for _, rec in customer_recs.iterrows():
-            report_rows.append({
-                'Customer': cust_info['customer_name'],
-                'Location': f"{cust_info['city']}, {cust_info['state']}",
-                'Business Type': cust_info['end_use'],
-                'Rank': int(rec['rank']),
-                'Recommended Product': rec['recommended_product_name'],
-                'Brand': rec['recommended_brand'],
-                'Category': rec['recommended_subcategory'],
-                'Price': f"${rec['recommended_price']}",
-                'Suggested Qty': int(rec['recommended_qty']),
-                'Confidence': f"{rec['confidence']*100:.0f}%",
-                'Why': f"Similar to {rec['trigger_product_name']}"
-            })
-    
-    report_df = pd.DataFrame(report_rows)
-    report_df.to_csv('salesperson_report.csv', index=False)
+    # Create simple report with column-wise formatting
+    report_df = pd.DataFrame({
+        'Customer': sample_recs['customer_name'],
+        'Location': sample_recs['city'].astype(str) + ", " + sample_recs['state'].astype(str),
+        'Business Type': sample_recs['end_use'],
+        'Rank': sample_recs['rank'].astype(int),
+        'Recommended Product': sample_recs['recommended_product_name'],
+        'Brand': sample_recs['recommended_brand'],
+        'Category': sample_recs['recommended_subcategory'],
+        'Price': "$" + sample_recs['recommended_price'].astype(str),
+        'Suggested Qty': sample_recs['recommended_qty'].astype(int),
+        'Confidence': (sample_recs['confidence'] * 100).map("{:.0f}%".format),
+        'Why': "Similar to " + sample_recs['trigger_product_name'].astype(str)
+    })
+    write_csv(report_df, 'salesperson_report.csv')
     
     print(f"\n✅ Salesperson report created: salesperson_report.csv")
     print(f"✅ Contains {len(report_df)} recommendations for {len(sample_customers)} customers")
@@ -341,6 +485,13 @@ def create_salesperson_report(recommendations_enriched, num_samples=10):
 # ============================================================
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recommendation validation & enrichment tool")
+    parser.add_argument("--export-csv", action="store_true",
+                        help="also write recommendations_with_names.csv")
+    parser.add_argument("--reuse-enriched", action="store_true",
+                        help=f"skip Step 1 and reuse {ENRICHED_PATH} from a previous run")
+    args = parser.parse_args()
+    
     print("\n")
     print("*" * 80)
     print("RECOMMENDATION VALIDATION & ENRICHMENT TOOL")
@@ -351,20 +502,24 @@ if __name__ == "__main__":
     print("  3. Create a salesperson-friendly report")
     print("\n")
     
-    # Step 1: Add product names
-    recommendations_enriched = add_product_names_to_recommendations()
+    # Step 1: Add product names (or reuse the cached Parquet)
+    if args.reuse_enriched:
+        recommendations_enriched = load_enriched_recommendations()
+    else:
+        recommendations_enriched = add_product_names_to_recommendations(export_csv=args.export_csv)
     
     # Step 2: Analyze sample customers
-    validation_df = analyze_sample_customers(recommendations_enriched, num_samples=10)
+    validation_df, sample_customers, rec_groups = analyze_sample_customers(recommendations_enriched, num_samples=10)
     
-    # Step 3: Create salesperson report
-    salesperson_report = create_salesperson_report(recommendations_enriched, num_samples=10)
+    # Step 3: Create salesperson report for the same customers
+    salesperson_report = create_salesperson_report(sample_customers, rec_groups)
     
     print("\n" + "=" * 80)
     print("✅ ALL TASKS COMPLETED SUCCESSFULLY!")
     print("=" * 80)
     print("\nGenerated Files:")
-    print("  1. recommendations_with_names.csv - Full enriched recommendations")
+    print(f"  1. {ENRICHED_PATH} - Full enriched recommendations"
+          + (" (+ CSV export)" if args.export_csv else ""))
     print("  2. validation_report.csv - Quality analysis for 10 customers")
     print("  3. salesperson_report.csv - Simple report for sales team")
     print("\nNext Steps:")
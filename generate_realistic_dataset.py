@@ -1,33 +1,17 @@
-import csv
+import os
 import random
+from contextlib import ExitStack
 from datetime import date, timedelta
+from itertools import islice
+from multiprocessing import Pool
 
-random.seed(42)
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pacsv
 
-# =========================================================
-# HELPERS
-# =========================================================
-
-def money(x):
-    return f"{x:.2f}"
-
-def rand_date(start, end, month_weights):
-    """Generate random date with seasonal bias"""
-    days = (end - start).days
-    while True:
-        d = start + timedelta(days=random.randint(0, days))
-        if random.random() < month_weights[d.month]:
-            return d
-
-def weighted_choice(mapping):
-    """Choose item based on weights"""
-    r = random.random()
-    cum = 0
-    for k, w in mapping.items():
-        cum += w
-        if r <= cum:
-            return k
-    return list(mapping.keys())[-1]
+SEED = 42
+random.seed(SEED)
+np_rng = np.random.default_rng(SEED)
 
 # =========================================================
 # REGIONS / CITIES
@@ -90,40 +74,64 @@ SUFFIX = ["LLC","Inc","Group","Services","Contractors","Solutions","Pros",
 OWNER_NAMES = ["Johnson","Smith","Martinez","Brown","Lee","Garcia","Clark",
                "Davis","Rodriguez","Wilson","Anderson","Taylor","Thomas","Moore"]
 
+TRADE_SUFFIX = ["Works","Specialists","Supply","Experts","Pros","Masters"]
+
+# Trade label per end use, e.g. "General Construction" -> "General"
+TRADE_NAMES = {
+    end_use: end_use.replace(" Construction", "").replace("General ", "")
+    for end_use in set(END_USE_LIST)
+}
+
+# Name styles are built once; each call picks one and only formats that one
+NAME_STYLES = (
+    lambda city, trade: f"{random.choice(ADJ)} {trade} {random.choice(SUFFIX)}",
+    lambda city, trade: f"{city} {trade} {random.choice(SUFFIX)}",
+    lambda city, trade: f"{random.choice(OWNER_NAMES)} & Sons {trade}",
+    lambda city, trade: f"{random.choice(OWNER_NAMES)} {trade} {random.choice(SUFFIX)}",
+    lambda city, trade: f"{trade} {random.choice(TRADE_SUFFIX)}"
+)
+
 def make_business_name(city, end_use):
     """Generate realistic business name"""
-    trade = end_use.replace(" Construction", "").replace("General ", "")
-    
-    styles = [
-        lambda: f"{random.choice(ADJ)} {trade} {random.choice(SUFFIX)}",
-        lambda: f"{city} {trade} {random.choice(SUFFIX)}",
-        lambda: f"{random.choice(OWNER_NAMES)} & Sons {trade}",
-        lambda: f"{random.choice(OWNER_NAMES)} {trade} {random.choice(SUFFIX)}",
-        lambda: f"{trade} {random.choice(['Works','Specialists','Supply','Experts','Pros','Masters'])}"
-    ]
-    return random.choice(styles)()
-
-def credit_for_type(customer_type):
-    """Assign realistic credit limit"""
-    if customer_type == "Large Commercial":
-        return random.randrange(100000, 500001, 5000)
-    if customer_type == "Small Commercial":
-        return random.randrange(50000, 200001, 5000)
-    if customer_type == "Small Business":
-        return random.randrange(20000, 100001, 5000)
-    return random.randrange(5000, 40001, 5000)
-
-def generate_customers():
+    return random.choice(NAME_STYLES)(city, TRADE_NAMES[end_use])
+
+# Credit limit range (inclusive, in steps of CREDIT_STEP) per customer type
+CREDIT_STEP = 5000
+CREDIT_RANGES = {
+    "Large Commercial": (100000, 500000),
+    "Small Commercial": (50000, 200000),
+    "Small Business": (20000, 100000),
+    "Independent Contractor": (5000, 40000)
+}
+
+def credit_limits_for_types(customer_types):
+    """Assign realistic credit limits, one vectorized draw per customer type"""
+    types = np.asarray(customer_types)
+    limits = np.empty(len(types), dtype=np.int64)
+    for cust_type, (low, high) in CREDIT_RANGES.items():
+        mask = types == cust_type
+        limits[mask] = np_rng.integers(
+            low // CREDIT_STEP, high // CREDIT_STEP + 1, size=mask.sum()
+        ) * CREDIT_STEP
+    return limits.tolist()
+
+def generate_customers(n=5000):
     """Generate 5000 unique customers"""
     customers = []
     used_names = set()
 
-    for i in range(1, 5001):
+    # Draw region / end use / type for every customer up front
+    regions = random.choices(list(REGION_WEIGHTS), weights=list(REGION_WEIGHTS.values()), k=n)
+    end_uses = random.choices(END_USE_LIST, k=n)
+    cust_types = random.choices(CUSTOMER_TYPE_LIST, k=n)
+    credit_limits = credit_limits_for_types(cust_types)
+
+    # Bound once; these are called for every customer below
+    choice, randint = random.choice, random.randint
+
+    for i, (region, end_use, cust_type) in enumerate(zip(regions, end_uses, cust_types), 1):
         cid = f"C{i:05d}"
-        region = weighted_choice(REGION_WEIGHTS)
-        city, state = random.choice(REGION_MAP[region])
-        end_use = random.choice(END_USE_LIST)
-        cust_type = random.choice(CUSTOMER_TYPE_LIST)
+        city, state = choice(REGION_MAP[region])
         
         name = make_business_name(city, end_use)
         counter = 1
@@ -140,8 +148,8 @@ def generate_customers():
             cust_type,
             city,
             state,
-            random.randint(1, 15),
-            credit_for_type(cust_type)
+            randint(1, 15),
+            credit_limits[i - 1]
         ])
     
     return customers
@@ -351,73 +359,98 @@ PRODUCT_CATALOG = {
     }
 }
 
+# Size spec templates, matched by substring against L3 then L2 category
+SIZE_SPECS = {
+    "Cordless Drills": ("{} MAX", ['18V', '20V', '24V']),
+    "Circular Saws": ("{} inch", ['7-1/4', '6-1/2', '10']),
+    "Paint": ("{}", ['1 Gallon', '5 Gallon', '1 Quart']),
+    "Wire": ("{}", ['250ft', '500ft', '1000ft']),
+    "Lumber": ("{}", ['8ft', '10ft', '12ft', '16ft']),
+    "Nails": ("{} Box", ['1lb', '5lb', '25lb', '50lb'])
+}
+
+MAX_PRODUCTS = 5500
+
+def _size_spec(l2_category, l3_category):
+    """First SIZE_SPECS entry matching the L3 or L2 category, or None"""
+    for key, spec_def in SIZE_SPECS.items():
+        if key in l3_category or key in l2_category:
+            return spec_def
+    return None
+
+def _unit_of_measure(l2_category):
+    if l2_category == "Paints & Coatings":
+        return "Gallon"
+    if l2_category in ("Fasteners", "Adhesives & Sealants"):
+        return "Box"
+    return "Each"
+
+# PRODUCT_CATALOG flattened to one entry per L3 category, in catalog order:
+# the string fields in L3_ROWS and the numeric fields as parallel arrays,
+# so every product attribute can be drawn in a single batch
+L3_ROWS = [
+    (l2_category, l3_category, functionality, _unit_of_measure(l2_category),
+     specs["brands"], _size_spec(l2_category, l3_category))
+    for l2_category, specs in PRODUCT_CATALOG.items()
+    for l3_category, (functionality, _, _) in specs["l3_categories"].items()
+]
+L3_MIN_PRICE = np.array([
+    min_price for specs in PRODUCT_CATALOG.values()
+    for _, min_price, _ in specs["l3_categories"].values()
+], dtype=np.float64)
+L3_MAX_PRICE = np.array([
+    max_price for specs in PRODUCT_CATALOG.values()
+    for _, _, max_price in specs["l3_categories"].values()
+], dtype=np.float64)
+L3_BRAND_COUNT = np.array([len(row[4]) for row in L3_ROWS])
+L3_SPEC_COUNT = np.array([len(row[5][1]) if row[5] else 0 for row in L3_ROWS])
+
+# Products per L3 category, truncated so the catalog stops at MAX_PRODUCTS
+L3_PRODUCT_COUNT = np.diff(np.minimum(np.cumsum([
+    max(1, specs["count"] // len(specs["l3_categories"]))
+    for specs in PRODUCT_CATALOG.values()
+    for _ in specs["l3_categories"]
+]), MAX_PRODUCTS), prepend=0)
+
 def generate_products():
     """Generate 5000+ products with proper L2/L3 categories"""
-    products = []
-    pid = 1
+    # One entry per product, pointing at its L3 row
+    l3_idx = np.repeat(np.arange(len(L3_ROWS)), L3_PRODUCT_COUNT)
+    n = len(l3_idx)
+    
+    # Draw every random attribute of every product in one batch
+    brand_idx = (np_rng.random(n) * L3_BRAND_COUNT[l3_idx]).astype(np.int64)
+    prices = np.round(np_rng.uniform(L3_MIN_PRICE[l3_idx], L3_MAX_PRICE[l3_idx]), 2)
+    in_stock = np_rng.random(n) < 0.95
+    spec_idx = (np_rng.random(n) * L3_SPEC_COUNT[l3_idx]).astype(np.int64)
+    model_nums = np_rng.integers(100, 1000, n)
     
-    for l2_category, specs in PRODUCT_CATALOG.items():
-        l3_cats = specs["l3_categories"]
-        brands = specs["brands"]
-        target_count = specs["count"]
+    products = []
+    for pid, (i, b, price, stocked, s, model) in enumerate(zip(
+        l3_idx.tolist(), brand_idx.tolist(), prices.tolist(),
+        in_stock.tolist(), spec_idx.tolist(), model_nums.tolist()
+    ), start=1):
+        l2_category, l3_category, functionality, uom, brands, spec_def = L3_ROWS[i]
+        brand = brands[b]
         
-        products_per_l3 = max(1, target_count // len(l3_cats))
+        # Generate product names with specs
+        if spec_def:
+            template, options = spec_def
+            spec = template.format(options[s])
+        else:
+            spec = f"Model {model}"
         
-        for l3_category, (functionality, min_price, max_price) in l3_cats.items():
-            for _ in range(products_per_l3):
-                brand = random.choice(brands)
-                
-                # Generate product name with specs
-                size_specs = {
-                    "Cordless Drills": f"{random.choice(['18V', '20V', '24V'])} MAX",
-                    "Circular Saws": f"{random.choice(['7-1/4', '6-1/2', '10'])} inch",
-                    "Paint": f"{random.choice(['1 Gallon', '5 Gallon', '1 Quart'])}",
-                    "Wire": f"{random.choice(['250ft', '500ft', '1000ft'])}",
-                    "Lumber": f"{random.choice(['8ft', '10ft', '12ft', '16ft'])}",
-                    "Nails": f"{random.choice(['1lb', '5lb', '25lb', '50lb'])} Box"
-                }
-                
-                # Find matching spec
-                spec = ""
-                for key in size_specs:
-                    if key in l3_category or key in l2_category:
-                        spec = size_specs[key]
-                        break
-                
-                if not spec:
-                    spec = f"Model {random.randint(100, 999)}"
-                
-                product_name = f"{brand} {spec} {l3_category}"
-                
-                price = round(random.uniform(min_price, max_price), 2)
-                
-                # Unit of measure based on category
-                if l2_category in ["Paints & Coatings"]:
-                    uom = "Gallon"
-                elif l2_category in ["Fasteners", "Adhesives & Sealants"]:
-                    uom = "Box"
-                elif "Wire" in l3_category or "Lumber" in l2_category:
-                    uom = "Each"
-                else:
-                    uom = "Each"
-                
-                in_stock = "TRUE" if random.random() < 0.95 else "FALSE"
-                
-                products.append([
-                    f"P{pid:05d}",
-                    product_name,
-                    brand,
-                    l2_category,
-                    l3_category,
-                    functionality,
-                    money(price),
-                    uom,
-                    in_stock
-                ])
-                pid += 1
-                
-                if pid > 5500:
-                    return products
+        products.append([
+            f"P{pid:05d}",
+            f"{brand} {spec} {l3_category}",
+            brand,
+            l2_category,
+            l3_category,
+            functionality,
+            f"{price:.2f}",
+            uom,
+            "TRUE" if stocked else "FALSE"
+        ])
     
     return products
 
@@ -516,144 +549,292 @@ PURCHASE_PATTERNS = {
     }
 }
 
+# Purchasing patterns as row-aligned arrays, one row per end use: the L2
+# category code of each pattern entry and its cumulative probability
+# (padded with inf), so categories can be drawn for many rows at once
+L2_CODES = {l2_category: code for code, l2_category in enumerate(PRODUCT_CATALOG)}
+PATTERN_INDEX = {end_use: i for i, end_use in enumerate(PURCHASE_PATTERNS)}
+_pattern_width = max(len(pattern) for pattern in PURCHASE_PATTERNS.values())
+PATTERN_CODES = np.zeros((len(PURCHASE_PATTERNS), _pattern_width), dtype=np.int64)
+PATTERN_CDF = np.full((len(PURCHASE_PATTERNS), _pattern_width), np.inf)
+for _i, _pattern in enumerate(PURCHASE_PATTERNS.values()):
+    PATTERN_CODES[_i, :len(_pattern)] = [L2_CODES[category] for category in _pattern]
+    PATTERN_CDF[_i, :len(_pattern)] = np.cumsum(list(_pattern.values())) / sum(_pattern.values())
+
+# Purchases per customer (inclusive range) by customer type
+PURCHASES_RANGE = {
+    "Large Commercial": (50, 100),
+    "Small Commercial": (20, 50),
+    "Small Business": (10, 30),
+    "Independent Contractor": (5, 20)
+}
+
+# Quantity range per L2 category; anything else buys DEFAULT_QTY_RANGE
+QTY_RANGE = {
+    "Paints & Coatings": (5, 50),
+    "Building Materials": (5, 50),
+    "Fasteners": (10, 100),
+    "Power Tools": (1, 5),
+    "HVAC": (1, 5),
+    "Ladders & Scaffolding": (1, 5)
+}
+DEFAULT_QTY_RANGE = (2, 25)
+
+# Quantity range per catalog L3 category, resolved once so the wire check
+# never runs per product: wire is sold by the spool, everything else by
+# its L2 category's range
+QTY_RANGE_BY_L3 = {
+    l3_category: (
+        (1, 10) if l2_category == "Electrical" and "Wire" in l3_category
+        else QTY_RANGE.get(l2_category, DEFAULT_QTY_RANGE)
+    )
+    for l2_category, specs in PRODUCT_CATALOG.items()
+    for l3_category in specs["l3_categories"]
+}
+
 # Seasonal patterns (higher in construction season)
 MONTH_WEIGHTS = {
     1: 0.4, 2: 0.5, 3: 0.8, 4: 0.95, 5: 1.0, 6: 1.0,
     7: 1.0, 8: 1.0, 9: 0.95, 10: 0.8, 11: 0.6, 12: 0.5
 }
 
-def generate_invoices(customers, products):
-    """Generate 50,000 invoices with realistic purchasing patterns"""
+INVOICE_START_DATE = date(2023, 1, 1)
+INVOICE_END_DATE = date(2025, 12, 31)
+
+# Every invoice day weighted by its month's seasonality, so dates can be
+# drawn in batches instead of by rejection sampling
+INVOICE_DAYS = [
+    INVOICE_START_DATE + timedelta(days=i)
+    for i in range((INVOICE_END_DATE - INVOICE_START_DATE).days + 1)
+]
+# ISO date strings for INVOICE_DAYS, formatted once instead of per invoice
+INVOICE_DAY_STRS = [d.isoformat() for d in INVOICE_DAYS]
+INVOICE_DAY_WEIGHTS = [MONTH_WEIGHTS[d.month] for d in INVOICE_DAYS]
+INVOICE_DAY_CDF = np.cumsum(INVOICE_DAY_WEIGHTS) / sum(INVOICE_DAY_WEIGHTS)
+
+def _build_product_index(products):
+    """
+    Index products for invoice sampling: product rows sorted by L2 category
+    code, with each category's start offset and size, and the per-product
+    quantity range and base price as arrays in the same order.
+    Every L2 category used by a purchasing pattern must have products.
+    """
+    codes = np.array([L2_CODES.get(product[3], -1) for product in products], dtype=np.int64)
+    order = [i for i in np.argsort(codes, kind="stable").tolist() if codes[i] >= 0]
+    counts = np.bincount(codes[order], minlength=len(L2_CODES))
+    starts = np.cumsum(counts) - counts
+    
+    missing = sorted(
+        l2_category for l2_category, code in L2_CODES.items()
+        if counts[code] == 0 and (PATTERN_CODES == code).any()
+    )
+    if missing:
+        raise ValueError(
+            f"No products in categories used by purchasing patterns: {', '.join(missing)}"
+        )
+    
+    pids = [products[i][0] for i in order]
+    qty_lo, qty_hi = np.array([
+        QTY_RANGE_BY_L3.get(products[i][4]) or QTY_RANGE.get(products[i][3], DEFAULT_QTY_RANGE)
+        for i in order
+    ], dtype=np.int64).reshape(-1, 2).T
+    base_prices = np.array([float(products[i][6]) for i in order])
+    return pids, starts, counts, qty_lo, qty_hi, base_prices
+
+def _draw_lines(rng, pattern_rows, product_index):
+    """
+    Draw one invoice line per entry of `pattern_rows` (a PATTERN_INDEX row
+    each). Returns product positions into the index, quantities, day
+    indexes into INVOICE_DAYS, unit prices and line totals as arrays.
+    """
+    _, starts, counts, qty_lo, qty_hi, base_prices = product_index
+    n = len(pattern_rows)
+    
+    # Category from the customer's purchasing pattern, date with seasonal pattern
+    choice = (PATTERN_CDF[pattern_rows] <= rng.random(n)[:, None]).sum(axis=1)
+    categories = PATTERN_CODES[pattern_rows, choice]
+    day_idx = np.searchsorted(INVOICE_DAY_CDF, rng.random(n), side="right")
+    
+    # Product within the category, quantity by product type, and some price
+    # variation (promotions, bulk discounts)
+    products = starts[categories] + (rng.random(n) * counts[categories]).astype(np.int64)
+    qtys = rng.integers(qty_lo[products], qty_hi[products] + 1)
+    prices = np.round(base_prices[products] * rng.uniform(0.90, 1.05, n), 2)
+    totals = np.round(prices * qtys, 2)
+    return products, qtys, day_idx, prices, totals
+
+MASK64 = (1 << 64) - 1
+PCG64_INCREMENT = 0xDA3E39CB94B95BDB  # any odd constant; PCG64's stream selector
+
+def _splitmix64(x):
+    """One SplitMix64 step: a well-mixed 64-bit value from any 64-bit input"""
+    z = (x + 0x9E3779B97F4A7C15) & MASK64
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK64
+    return z ^ (z >> 31)
+
+def _reseed(rng, idx):
+    """
+    Reset `rng` (a PCG64-backed Generator) to customer `idx`'s stream.
+    The 128-bit state comes from two SplitMix64 steps on (SEED, idx), which
+    is far cheaper than building a fresh seeded Generator per customer.
+    """
+    hi = _splitmix64((SEED << 32) | idx)
+    lo = _splitmix64(hi)
+    rng.bit_generator.state = {
+        "bit_generator": "PCG64",
+        "state": {"state": (hi << 64) | lo, "inc": PCG64_INCREMENT},
+        "has_uint32": 0,
+        "uinteger": 0
+    }
+
+# Read-only product index and a reusable generator, set once per invoice
+# worker process
+_product_index = None
+_worker_rng = None
+
+def _init_invoice_worker(product_index):
+    global _product_index, _worker_rng
+    _product_index = product_index
+    _worker_rng = np.random.Generator(np.random.PCG64())
+
+def _customer_invoice_lines(task):
+    """
+    Generate one customer's invoice lines (everything but the invoice id).
+    Each customer draws from its own seeded stream, so results do not
+    depend on which worker process handles the customer.
+    """
+    idx, cid, cust_type, pattern_row = task
+    rng = _worker_rng
+    _reseed(rng, idx)
+    pids = _product_index[0]
     
-    # Group products by L2 category for fast lookup
-    products_by_category = {}
-    for product in products:
-        l2_cat = product[3]
-        if l2_cat not in products_by_category:
-            products_by_category[l2_cat] = []
-        products_by_category[l2_cat].append(product)
+    # Determine number of purchases based on customer type
+    lo, hi = PURCHASES_RANGE.get(cust_type, PURCHASES_RANGE["Independent Contractor"])
+    num_purchases = int(rng.integers(lo, hi + 1))
     
-    start_date = date(2023, 1, 1)
-    end_date = date(2025, 12, 31)
+    products, qtys, day_idx, prices, totals = _draw_lines(
+        rng, np.full(num_purchases, pattern_row), _product_index
+    )
+    return [
+        [cid, pids[p], qty, INVOICE_DAY_STRS[day], f"{price:.2f}", f"{total:.2f}"]
+        for p, qty, day, price, total in zip(
+            products.tolist(), qtys.tolist(), day_idx.tolist(), prices.tolist(), totals.tolist()
+        )
+    ]
+
+def generate_invoices(customers, products, num_invoices=50000, workers=None):
+    """
+    Yield 50,000 invoices with realistic purchasing patterns.
+    Rows are streamed, so customers past the point where the target is
+    reached are never generated and the full list is never held in memory.
+    Customers are generated in parallel across `workers` processes
+    (default: one per CPU); invoice ids are assigned here, in order.
+    """
+    
+    # Index products by L2 category for vectorized lookup
+    product_index = _build_product_index(products)
+    pids = product_index[0]
+    
+    # Resolve each customer's purchasing pattern once, aligned with customers
+    customer_patterns = np.array([
+        PATTERN_INDEX.get(cust[3], PATTERN_INDEX["General Construction"]) for cust in customers
+    ], dtype=np.int64)
     
-    invoices = []
+    workers = workers or os.cpu_count() or 1
     inv_id = 1
     
     print("Generating invoices with realistic purchasing patterns...")
     
-    for idx, cust in enumerate(customers):
-        if (idx + 1) % 1000 == 0:
-            print(f"  Processing customer {idx + 1}/5000...")
-        
-        cid = cust[0]
-        end_use = cust[3]
-        cust_type = cust[4]
-        
-        # Get purchasing pattern for this customer type
-        pattern = PURCHASE_PATTERNS.get(end_use, PURCHASE_PATTERNS["General Construction"])
+    with ExitStack() as stack:
+        tasks = (
+            (idx, cust[0], cust[4], pattern_row)
+            for idx, (cust, pattern_row) in enumerate(zip(customers, customer_patterns.tolist()))
+        )
+        if workers == 1:
+            _init_invoice_worker(product_index)
+            lines_per_customer = map(_customer_invoice_lines, tasks)
+        else:
+            pool = stack.enter_context(Pool(
+                workers, initializer=_init_invoice_worker, initargs=(product_index,)
+            ))
+            lines_per_customer = pool.imap(_customer_invoice_lines, tasks, chunksize=250)
         
-        # Determine number of purchases based on customer type
-        if cust_type == "Large Commercial":
-            num_purchases = random.randint(50, 100)
-        elif cust_type == "Small Commercial":
-            num_purchases = random.randint(20, 50)
-        elif cust_type == "Small Business":
-            num_purchases = random.randint(10, 30)
-        else:  # Independent Contractor
-            num_purchases = random.randint(5, 20)
-        
-        for _ in range(num_purchases):
-            # Choose category based on customer's purchasing pattern
-            category = weighted_choice(pattern)
+        for idx, lines in enumerate(lines_per_customer):
+            if (idx + 1) % 1000 == 0:
+                print(f"  Processing customer {idx + 1}/5000...")
             
-            # Get products in this category
-            if category in products_by_category and products_by_category[category]:
-                product = random.choice(products_by_category[category])
-                
-                pid = product[0]
-                base_price = float(product[6])
-                
-                # Quantity varies by product type
-                if category in ["Paints & Coatings", "Building Materials"]:
-                    qty = random.randint(5, 50)
-                elif category == "Fasteners":
-                    qty = random.randint(10, 100)
-                elif category in ["Power Tools", "HVAC", "Ladders & Scaffolding"]:
-                    qty = random.randint(1, 5)
-                elif category == "Electrical" and "Wire" in product[4]:
-                    qty = random.randint(1, 10)
-                else:
-                    qty = random.randint(2, 25)
-                
-                # Add some price variation (promotions, bulk discounts)
-                price = round(base_price * random.uniform(0.90, 1.05), 2)
-                total = round(qty * price, 2)
-                
-                # Generate date with seasonal pattern
-                invoice_date = rand_date(start_date, end_date, MONTH_WEIGHTS)
-                
-                invoices.append([
-                    f"INV{inv_id:06d}",
-                    cid,
-                    pid,
-                    qty,
-                    invoice_date.isoformat(),
-                    money(price),
-                    money(total)
-                ])
+            for line in lines:
+                yield [f"INV{inv_id:06d}", *line]
                 inv_id += 1
+                
+                if inv_id > num_invoices:
+                    return
     
     # Pad to exactly 50,000 if needed
-    print(f"  Generated {len(invoices)} invoices, padding to 50,000...")
-    while len(invoices) < 50000:
-        cust = random.choice(customers)
-        end_use = cust[3]
-        pattern = PURCHASE_PATTERNS.get(end_use, PURCHASE_PATTERNS["General Construction"])
-        category = weighted_choice(pattern)
-        
-        if category in products_by_category and products_by_category[category]:
-            product = random.choice(products_by_category[category])
-            
-            pid = product[0]
-            base_price = float(product[6])
-            
-            if category in ["Paints & Coatings", "Building Materials"]:
-                qty = random.randint(5, 50)
-            elif category == "Fasteners":
-                qty = random.randint(10, 100)
-            elif category in ["Power Tools", "HVAC"]:
-                qty = random.randint(1, 5)
-            else:
-                qty = random.randint(2, 25)
-            
-            price = round(base_price * random.uniform(0.90, 1.05), 2)
-            total = round(qty * price, 2)
-            invoice_date = rand_date(start_date, end_date, MONTH_WEIGHTS)
-            
-            invoices.append([
-                f"INV{inv_id:06d}",
-                cust[0],
-                pid,
-                qty,
-                invoice_date.isoformat(),
-                money(price),
-                money(total)
-            ])
-            inv_id += 1
+    print(f"  Generated {inv_id - 1} invoices, padding to {num_invoices:,}...")
+    deficit = num_invoices - inv_id + 1
+    
+    # Draw every missing row for a random customer at once
+    cust_idx = np_rng.integers(0, len(customers), deficit)
+    products, qtys, day_idx, prices, totals = _draw_lines(
+        np_rng, customer_patterns[cust_idx], product_index
+    )
     
-    return invoices[:50000]
+    for i, p, qty, day, price, total in zip(
+        cust_idx.tolist(), products.tolist(), qtys.tolist(),
+        day_idx.tolist(), prices.tolist(), totals.tolist()
+    ):
+        yield [
+            f"INV{inv_id:06d}",
+            customers[i][0],
+            pids[p],
+            qty,
+            INVOICE_DAY_STRS[day],
+            f"{price:.2f}",
+            f"{total:.2f}"
+        ]
+        inv_id += 1
 
 # =========================================================
 # CSV WRITING
 # =========================================================
 
+CSV_BATCH_ROWS = 10000
+
 def write_csv(filename, header, rows):
-    """Write data to CSV file"""
-    with open(filename, "w", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow(header)
-        writer.writerows(rows)
-    print(f"✅ Written {filename} ({len(rows)} rows)")
+    """
+    Write data to CSV file; rows may be any iterable, including a generator.
+    Rows are transposed into Arrow columns in batches and written by
+    pyarrow, with the column types fixed by the first batch.
+    """
+    rows = iter(rows)
+    count = 0
+    schema = None
+    writer = None
+    try:
+        while batch := list(islice(rows, CSV_BATCH_ROWS)):
+            columns = list(zip(*batch))
+            if writer is None:
+                table = pa.Table.from_arrays([pa.array(col) for col in columns], names=header)
+                schema = table.schema
+                writer = pacsv.CSVWriter(filename, schema)
+            else:
+                table = pa.Table.from_arrays(
+                    [pa.array(col, type=field.type) for col, field in zip(columns, schema)],
+                    schema=schema
+                )
+            writer.write_table(table)
+            count += len(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+    
+    # No rows: still write the header
+    if writer is None:
+        pacsv.write_csv(pa.table({name: pa.array([], pa.string()) for name in header}), filename)
+    print(f"✅ Written {filename} ({count} rows)")
+    return count
 
 # =========================================================
 # MAIN EXECUTION
@@ -670,9 +851,6 @@ if __name__ == "__main__":
     print("\n📦 Generating products...")
     products = generate_products()
     
-    print(f"\n🛒 Generating invoices...")
-    invoices = generate_invoices(customers, products)
-    
     print("\n💾 Writing CSV files...")
     write_csv(
         "customers.csv",
@@ -688,11 +866,13 @@ if __name__ == "__main__":
         products
     )
     
-    write_csv(
+    # Invoices are generated while they are written
+    print(f"\n🛒 Generating invoices...")
+    num_invoices = write_csv(
         "invoices.csv",
         ["invoice_id", "customer_id", "product_id", "quantity", "invoice_date",
          "unit_price", "line_total"],
-        invoices
+        generate_invoices(customers, products)
     )
     
     print("\n" + "=" * 60)
@@ -701,7 +881,7 @@ if __name__ == "__main__":
     print(f"\nGenerated:")
     print(f"  • {len(customers)} customers")
     print(f"  • {len(products)} products")
-    print(f"  • {len(invoices)} invoices")
+    print(f"  • {num_invoices} invoices")
     print("\nFiles created:")
     print("  • customers.csv")
     print("  • products.csv")
@@ -0,0 +1,101 @@
+"""
+migrate_feedback.py — Convert feedback.csv into the partitioned feedback store.
+
+Run once before deploying a pipeline that reads the partitioned store, and
+again after any bulk re-export of feedback.csv:
+  python migrate_feedback.py
+
+What it does:
+  1. Downloads s3://ipre-prod-poc/feedback/feedback.csv
+  2. Parses feedback_date and derives year / month partition columns
+     (undated rows go to the null partition, __HIVE_DEFAULT_PARTITION__)
+  3. Writes Hive-partitioned Parquet to
+       s3://ipre-prod-poc/feedback/dataset/year=YYYY/month=MM/part-0.parquet
+     replacing any partition it writes, so re-runs are idempotent
+
+scripts/feedback.py reads this store with a pushdown filter, fetching only
+the months inside FEEDBACK_RECENCY_DAYS. Until the store has data, and
+whenever feedback.csv has been modified since the last migration, it reads
+feedback.csv instead.
+"""
+
+import argparse
+import io
+
+import boto3
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+
+
+# --------------------------------------------------
+# Config
+# --------------------------------------------------
+BUCKET         = "ipre-prod-poc"
+FEEDBACK_KEY   = "feedback/feedback.csv"
+DATASET_PREFIX = "feedback/dataset"
+
+PARTITIONING = ds.partitioning(
+    pa.schema([("year", pa.int16()), ("month", pa.int8())]),
+    flavor="hive",
+)
+
+
+# --------------------------------------------------
+# Helpers
+# --------------------------------------------------
+def to_partitioned_table(feedback: pd.DataFrame) -> pa.Table:
+    """
+    Feedback rows with a parsed feedback_date and year / month columns.
+    A missing feedback_date column becomes all-null, so every row lands
+    in the null partition and is always read.
+    """
+    feedback = feedback.copy()
+    dates    = feedback["feedback_date"] if "feedback_date" in feedback.columns else pd.Series(pd.NaT, index=feedback.index)
+    feedback["feedback_date"] = pd.to_datetime(dates, errors="coerce").astype("datetime64[us]")
+    feedback["year"]  = feedback["feedback_date"].dt.year.astype("Int16")
+    feedback["month"] = feedback["feedback_date"].dt.month.astype("Int8")
+    return pa.Table.from_pandas(feedback, preserve_index=False)
+
+
+# --------------------------------------------------
+# Main
+# --------------------------------------------------
+def main(dry_run: bool = False):
+    s3  = boto3.client("s3")
+    obj = s3.get_object(Bucket=BUCKET, Key=FEEDBACK_KEY)
+    feedback = pd.read_csv(io.BytesIO(obj["Body"].read()), engine="pyarrow")
+    print(f"Read {len(feedback)} feedback rows from s3://{BUCKET}/{FEEDBACK_KEY}")
+
+    table  = to_partitioned_table(feedback)
+    counts = table.group_by(["year", "month"]).aggregate([([], "count_all")]).to_pandas()
+    print(f"Partitions: {len(counts)}")
+    print(counts.sort_values(["year", "month"]).to_string(index=False))
+
+    if dry_run:
+        print(f"\n[dry-run] Would write to s3://{BUCKET}/{DATASET_PREFIX}/")
+        return
+
+    ds.write_dataset(
+        table,
+        f"{BUCKET}/{DATASET_PREFIX}",
+        filesystem=pafs.S3FileSystem(),
+        format="parquet",
+        partitioning=PARTITIONING,
+        basename_template="part-{i}.parquet",
+        existing_data_behavior="delete_matching",
+    )
+    print(f"\nWrote s3://{BUCKET}/{DATASET_PREFIX}/")
+
+
+# --------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Show the partition layout without writing to S3",
+    )
+    args = parser.parse_args()
+    main(dry_run=args.dry_run)
@@ -1,16 +1,19 @@
 """
-pipeline.py — IPRE SageMaker Pipeline (6 steps, fully parameterised)
+pipeline.py — IPRE SageMaker Pipeline (6 stages in 4 steps, fully parameterised)
 
 Every tunable value in the pipeline is exposed as a SageMaker Pipeline
 Parameter so it can be changed per-run from the Studio UI, AWS CLI, or
 EventBridge schedule without touching code.
 
 Execution order:
-  1. MarketBasket        ProcessingStep  — builds enriched market_basket.csv
-  2. ClusteringTrain     TrainingStep    — trains KMeans with elbow k selection
+  1. ClusteringTrain     TrainingStep    — builds enriched market_basket,
+  2.                                       then trains KMeans with elbow k selection
+                                           (market_basket.py + train_clustering.py in one job)
   3. ClusteringRegister  ModelStep       — registers model in Model Registry
-  4. Associations        ProcessingStep  — mines rules with lift + time decay
-  5. Ranking             ProcessingStep  — scores recs with lift-aware formula
+                                           (runs in parallel with step 4)
+  4. MineAndRank         ProcessingStep  — mines rules with lift + time decay,
+  5.                                       then scores recs with lift-aware formula
+                                           (associations.py + ranking.py in one job)
   6. FeedbackCalibration ProcessingStep  — applies feedback, publishes final CSV
 
 Parameter groups:
@@ -25,14 +28,18 @@ Parameter groups:
 Endpoint deployment is handled separately by deploy_endpoint.py.
 """
 
+import hashlib
+
+import boto3
 import sagemaker
+from botocore.exceptions import ClientError
 from sagemaker.sklearn.estimator import SKLearn
 from sagemaker.workflow.pipeline import Pipeline
-from sagemaker.workflow.steps import ProcessingStep, TrainingStep
+from sagemaker.workflow.steps import CacheConfig, ProcessingStep, TrainingStep
 from sagemaker.workflow.model_step import ModelStep
 from sagemaker.workflow.parameters import ParameterString
 from sagemaker.workflow.pipeline_context import PipelineSession
-from sagemaker.processing import ScriptProcessor, ProcessingInput, ProcessingOutput
+from sagemaker.processing import FrameworkProcessor, ProcessingInput, ProcessingOutput
 from sagemaker.model import Model
 
 # --------------------------------------------------
@@ -53,16 +60,19 @@ sklearn_image = sagemaker.image_uris.retrieve(
 )
 
 
-def make_processor(instance_type: str = "ml.t3.xlarge", env: dict = None) -> ScriptProcessor:
+def make_processor(instance_type: str = "ml.t3.xlarge", env: dict = None) -> FrameworkProcessor:
     """
-    Each step gets its own independent ScriptProcessor instance.
-    env vars passed to ScriptProcessor(env=...) — the correct way to inject
+    Each step gets its own independent FrameworkProcessor instance on the
+    same SKLearn 1.2-1 framework image as the training job. Steps call
+    .run(code=..., source_dir=SCRIPTS_SOURCE_DIR), so the scripts/ folder
+    is packaged once and every job can import sibling modules.
+    env vars passed to FrameworkProcessor(env=...) — the correct way to inject
     runtime config into Processing containers. ProcessingStep does NOT accept
     an environment kwarg directly.
     """
-    return ScriptProcessor(
-        image_uri=sklearn_image,
-        command=["python3"],
+    return FrameworkProcessor(
+        estimator_cls=SKLearn,
+        framework_version="1.2-1",
         role=role,
         instance_type=instance_type,
         instance_count=1,
@@ -71,6 +81,79 @@ def make_processor(instance_type: str = "ml.t3.xlarge", env: dict = None) -> Scr
     )
 
 
+# Uploaded as the source_dir of every Processing job (see make_processor)
+# and of the clustering training job
+SCRIPTS_SOURCE_DIR = "scripts"
+
+
+# --------------------------------------------------
+# Step caching
+# A cached step is skipped when its arguments (inputs, env, code hash)
+# match a successful run within the expiry window, so unchanged
+# ClusteringTrain / MineAndRank return in seconds on reruns. Those
+# arguments are S3 URIs, not contents — a raw file overwritten in place
+# would still hit — so both steps also carry the raw inputs' ETags (see
+# raw_inputs_etag). FeedbackCalibration reads feedback.csv via boto3 at
+# runtime, which the cache key cannot see — it gets a one-day expiry plus
+# the feedback files' ETags as an env var (see feedback_etag), so changed
+# feedback changes the cache key and the step re-runs at least daily.
+# --------------------------------------------------
+cache_30d = CacheConfig(enable_caching=True, expire_after="P30D")
+cache_1d  = CacheConfig(enable_caching=True, expire_after="P1D")
+
+
+def feedback_etag(key: str = "feedback/feedback.csv", dataset_prefix: str = "feedback/dataset") -> str:
+    """
+    Fingerprint of the feedback inputs at pipeline-definition time: the
+    ETag of feedback.csv ("missing" if absent) plus a digest of the ETags
+    of every file in the partitioned feedback store (if any).
+
+    Resolved when this script builds the definition, not per execution —
+    an upsert after feedback changes picks up the new ETag immediately;
+    otherwise the P1D expiry bounds how stale a cached run can be.
+    """
+    s3 = boto3.client("s3", region_name=region)
+    try:
+        csv_etag = s3.head_object(Bucket=bucket, Key=key)["ETag"].strip('"')
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+            raise
+        csv_etag = "missing"
+
+    parts = sorted(
+        (obj["Key"], obj["ETag"])
+        for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=f"{dataset_prefix}/")
+        for obj in page.get("Contents", [])
+    )
+    if not parts:
+        return csv_etag
+    return f"{csv_etag}-{hashlib.md5(repr(parts).encode()).hexdigest()}"
+
+
+def raw_inputs_etag(*uris: str) -> str:
+    """
+    Digest of the ETags of the given S3 objects ("missing" for an absent
+    one), so a raw file overwritten at the same URI changes the cache key
+    of every step that reads it.
+
+    Resolved at pipeline-definition time from the parameters' default
+    URIs, like feedback_etag — upsert the pipeline after replacing the raw
+    files. An execution that overrides an input URI already changes the
+    key through the URI itself.
+    """
+    s3    = boto3.client("s3", region_name=region)
+    etags = []
+    for uri in uris:
+        uri_bucket, key = uri.replace("s3://", "", 1).split("/", 1)
+        try:
+            etags.append(s3.head_object(Bucket=uri_bucket, Key=key)["ETag"].strip('"'))
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                raise
+            etags.append("missing")
+    return hashlib.md5(repr(etags).encode()).hexdigest()
+
+
 # ══════════════════════════════════════════════════════════════════════
 # PIPELINE PARAMETERS
 # All values configurable per-run from Studio UI or CLI.
@@ -90,6 +173,11 @@ invoices_input = ParameterString(
     name="InputInvoices",
     default_value=f"s3://{bucket}/raw/invoices/invoice.csv",
 )
+raw_etag = raw_inputs_etag(
+    customers_input.default_value,
+    products_input.default_value,
+    invoices_input.default_value,
+)
 model_approval_status = ParameterString(
     name="ModelApprovalStatus",
     default_value="Approved",
@@ -138,8 +226,9 @@ random_state = ParameterString(
 )
 n_init = ParameterString(
     name="NInit",
-    default_value="15",
-    # KMeans n_init. Higher = more stable results, slower training.
+    default_value="1",
+    # KMeans n_init. With k-means++ seeding extra restarts barely move
+    # inertia but multiply fit time; raise it only if seeding is changed.
 )
 
 # ── D. ASSOCIATION MINING ─────────────────────────────────────────────
@@ -246,39 +335,24 @@ feedback_recency_days = ParameterString(
 
 
 # ══════════════════════════════════════════════════════════════════════
-# STEP 1 — MARKET BASKET
-# ══════════════════════════════════════════════════════════════════════
-
-market_basket = ProcessingStep(
-    name="MarketBasket",
-    processor=make_processor("ml.t3.xlarge", env={
-        "MIN_ORDER_COUNT":     min_order_count,
-        "RECENCY_CUTOFF_DAYS": recency_cutoff_days,
-    }),
-    code="scripts/market_basket.py",
-    inputs=[
-        ProcessingInput(source=customers_input, destination="/opt/ml/processing/input/customers"),
-        ProcessingInput(source=products_input,  destination="/opt/ml/processing/input/products"),
-        ProcessingInput(source=invoices_input,  destination="/opt/ml/processing/input/invoices"),
-    ],
-    outputs=[
-        ProcessingOutput(output_name="output", source="/opt/ml/processing/output"),
-    ],
-)
-
-
-# ══════════════════════════════════════════════════════════════════════
-# STEP 2 — CLUSTERING TRAINING JOB
+# STEPS 1 + 2 — MARKET BASKET & CLUSTERING TRAINING JOB
+#
+# The raw customers / products / invoices go straight to the training
+# container; train_clustering.py builds the market basket in memory with
+# market_basket.py (shipped alongside via source_dir) before clustering.
+# One container launch instead of a Processing job plus a Training job,
+# and no market_basket CSV round-trip through S3.
 #
 # Uses SageMaker hyperparameters (passed as SM_HP_* env vars in container).
 # Elbow method selects k per segment. Writes model.tar.gz containing:
 #   - {segment}_kmeans.pkl, _scaler.pkl, _columns.json (per segment)
 #   - model_registry.json (manifest)
-#   - customer_clusters.csv (consumed by Steps 4 and 5)
+#   - customer_clusters.csv, market_basket.parquet (consumed by Steps 4 and 5)
 # ══════════════════════════════════════════════════════════════════════
 
 clustering_estimator = SKLearn(
-    entry_point="scripts/train_clustering.py",
+    entry_point="train_clustering.py",
+    source_dir=SCRIPTS_SOURCE_DIR,
     framework_version="1.2-1",
     instance_type="ml.m5.xlarge",
     instance_count=1,
@@ -287,12 +361,17 @@ clustering_estimator = SKLearn(
     output_path=f"s3://{bucket}/models/clustering",
     base_job_name="ipre-clustering",
     hyperparameters={
+        "MIN_ORDER_COUNT":        min_order_count,
+        "RECENCY_CUTOFF_DAYS":    recency_cutoff_days,
         "MAX_K":                  max_k,
         "MIN_CLUSTER_CUSTOMERS":  min_cluster_customers,
         "ELBOW_THRESHOLD":        elbow_threshold,
         "FEATURE_GROUPS":         feature_groups,
         "RANDOM_STATE":           random_state,
         "N_INIT":                 n_init,
+        # Not read by train_clustering.py — keys the step cache on the
+        # raw files' contents (see raw_inputs_etag)
+        "RAW_INPUTS_ETAG":        raw_etag,
     },
 )
 
@@ -300,12 +379,11 @@ clustering_train = TrainingStep(
     name="ClusteringTrain",
     estimator=clustering_estimator,
     inputs={
-        "market_basket": sagemaker.inputs.TrainingInput(
-            s3_data=market_basket.properties.ProcessingOutputConfig.Outputs["output"].S3Output.S3Uri,
-            content_type="text/csv",
-        )
+        "customers": sagemaker.inputs.TrainingInput(s3_data=customers_input, content_type="text/csv"),
+        "products":  sagemaker.inputs.TrainingInput(s3_data=products_input,  content_type="text/csv"),
+        "invoices":  sagemaker.inputs.TrainingInput(s3_data=invoices_input,  content_type="text/csv"),
     },
-    depends_on=[market_basket],
+    cache_config=cache_30d,
 )
 
 
@@ -315,6 +393,13 @@ clustering_train = TrainingStep(
 # Every pipeline run creates a new versioned Model Package entry.
 # Enables rollback, A/B comparison, and full audit trail.
 # deploy_endpoint.py reads the latest Approved version from here.
+#
+# Off the critical path: this step depends on ClusteringTrain only, and
+# no other step depends on it, so the DAG scheduler runs it (including
+# the repack job ModelStep adds for entry_point) alongside MineAndRank.
+# Keep it that way — nothing downstream should list register_model in
+# depends_on. ModelStep takes no cache_config, so registration cannot be
+# skipped on cached reruns; each run still records a new version.
 # ══════════════════════════════════════════════════════════════════════
 
 clustering_model = Model(
@@ -325,7 +410,7 @@ clustering_model = Model(
     entry_point="scripts/inference.py",
     env={
         "RECO_BUCKET": bucket,
-        "RECO_KEY":    "final/recommendations.csv",
+        "RECO_KEY":    "final/recommendations.parquet",
     },
 )
 
@@ -345,54 +430,40 @@ register_model = ModelStep(
 
 
 # ══════════════════════════════════════════════════════════════════════
-# STEP 4 — ASSOCIATION MINING
+# STEPS 4 + 5 — ASSOCIATION MINING & RANKING
 #
-# Clustering input uses ModelArtifacts.S3ModelArtifacts (model.tar.gz)
-# because customer_clusters.csv is written to /opt/ml/model/ in
-# train_clustering.py and travels inside model.tar.gz.
-# ══════════════════════════════════════════════════════════════════════
-
-associations = ProcessingStep(
-    name="Associations",
-    processor=make_processor("ml.m5.xlarge", env={
-        "WINDOW_DAYS":    window_days,
-        "MIN_LIFT":       min_lift,
-        "MIN_ABS_FREQ":   min_abs_freq,
-        "MIN_FREQ_RATIO": min_freq_ratio,
-        "DECAY_LAMBDA":   decay_lambda,
-    }),
-    code="scripts/associations.py",
-    inputs=[
-        ProcessingInput(
-            source=market_basket.properties.ProcessingOutputConfig.Outputs["output"].S3Output.S3Uri,
-            destination="/opt/ml/processing/input/market_basket",
-        ),
-        ProcessingInput(
-            source=clustering_train.properties.ModelArtifacts.S3ModelArtifacts,
-            destination="/opt/ml/processing/input/clustering",
-        ),
-        ProcessingInput(
-            source=invoices_input,
-            destination="/opt/ml/processing/input/invoices",
-        ),
-    ],
-    outputs=[
-        ProcessingOutput(output_name="output", source="/opt/ml/processing/output"),
-    ],
-    depends_on=[market_basket, clustering_train],
-)
-
-
-# ══════════════════════════════════════════════════════════════════════
-# STEP 5 — RANKING
+# Both scripts run in one container via scripts/run_mining.py, which
+# passes the mined rules to ranking in memory — one container launch and
+# no associations round-trip through S3. run_mining.py imports them from
+# the shared source_dir.
+#
+# customer_clusters.csv and market_basket.parquet are written to
+# /opt/ml/model/ in train_clustering.py and travel inside model.tar.gz. Its S3 URI
+# (ModelArtifacts.S3ModelArtifacts) is passed as MODEL_S3_URI rather than
+# a ProcessingInput, so the job streams the tarball with ranged GETs and
+# extracts while downloading instead of waiting for the full copy.
+#
+# recommendations.parquet is streamed to s3://{bucket}/ranking/<run-id>/
+# by multipart upload while it is being encoded, so the ProcessingOutput
+# only carries recommendations.json pointing at it. The per-run key keeps
+# a cached MineAndRank pointing at its own output.
 # ══════════════════════════════════════════════════════════════════════
 
-ranking = ProcessingStep(
-    name="Ranking",
-    processor=make_processor("ml.m5.large", env={
+mine_and_rank = ProcessingStep(
+    name="MineAndRank",
+    step_args=make_processor("ml.m5.large", env={
+        # Association mining
+        "WINDOW_DAYS":        window_days,
+        "MIN_LIFT":           min_lift,
+        "MIN_ABS_FREQ":       min_abs_freq,
+        "MIN_FREQ_RATIO":     min_freq_ratio,
+        "DECAY_LAMBDA":       decay_lambda,
+        "INVOICES_S3_URI":    invoices_input,
+        "WINDOW_DAYS_CACHE_KEY": "associations/window_days.json",
+        "RAW_INPUTS_ETAG":    raw_etag,      # cache key only (see raw_inputs_etag)
+        # Ranking
         "MIN_SUPPORT":        min_support,
         "MIN_CONFIDENCE":     min_confidence,
-        "MIN_LIFT":           min_lift,
         "TOP_K":              top_k,
         "W_CONF":             w_conf,
         "W_SUPP":             w_supp,
@@ -400,26 +471,25 @@ ranking = ProcessingStep(
         "W_RECENCY":          w_recency,
         "MAX_LIFT_NORMALISE": max_lift_normalise,
         "L3_TIEBREAK_MARGIN": l3_tiebreak_margin,
-    }),
-    code="scripts/ranking.py",
-    inputs=[
-        ProcessingInput(
-            source=market_basket.properties.ProcessingOutputConfig.Outputs["output"].S3Output.S3Uri,
-            destination="/opt/ml/processing/input/market_basket",
-        ),
-        ProcessingInput(
-            source=clustering_train.properties.ModelArtifacts.S3ModelArtifacts,
-            destination="/opt/ml/processing/input/clustering",
-        ),
-        ProcessingInput(
-            source=associations.properties.ProcessingOutputConfig.Outputs["output"].S3Output.S3Uri,
-            destination="/opt/ml/processing/input/associations",
-        ),
-    ],
-    outputs=[
-        ProcessingOutput(output_name="output", source="/opt/ml/processing/output"),
-    ],
-    depends_on=[market_basket, clustering_train, associations],
+        # Clustering artifacts
+        "MODEL_S3_URI":       clustering_train.properties.ModelArtifacts.S3ModelArtifacts,
+        # Output — streamed to S3, only a pointer file in the ProcessingOutput
+        "RECOMMENDATIONS_S3_PREFIX": f"s3://{bucket}/ranking",
+    }).run(
+        code="run_mining.py",
+        source_dir=SCRIPTS_SOURCE_DIR,
+        inputs=[
+            ProcessingInput(
+                source=invoices_input,
+                destination="/opt/ml/processing/input/invoices",
+            ),
+        ],
+        outputs=[
+            ProcessingOutput(output_name="output", source="/opt/ml/processing/output"),
+        ],
+    ),
+    depends_on=[clustering_train],
+    cache_config=cache_30d,
 )
 
 
@@ -430,16 +500,21 @@ ranking = ProcessingStep(
 # SageMaker validates ProcessingInput S3 paths at job creation time —
 # crashing the pipeline if the feedback file doesn't exist yet.
 # Reading via boto3 at runtime handles the missing-file case gracefully.
+# FEEDBACK_ETAG is not read by feedback.py — it is there so the step's
+# cache key changes whenever feedback.csv does.
 # ══════════════════════════════════════════════════════════════════════
 
 feedback = ProcessingStep(
     name="FeedbackCalibration",
-    processor=make_processor("ml.t3.xlarge", env={
+    step_args=make_processor("ml.t3.large", env={
         "OUTPUT_BUCKET":         bucket,
         "OUTPUT_KEY":            "final/recommendations.csv",
+        "OUTPUT_PARQUET_KEY":    "final/recommendations.parquet",
         "SUMMARY_KEY":           "feedback/feedback_summary.json",
         "FEEDBACK_BUCKET":       bucket,
         "FEEDBACK_KEY":          "feedback/feedback.csv",
+        "FEEDBACK_DATASET_PREFIX": "feedback/dataset",
+        "FEEDBACK_ETAG":         feedback_etag("feedback/feedback.csv", "feedback/dataset"),
         "WEIGHT_HIGH":           weight_high,
         "WEIGHT_MED_POS":        weight_med_pos,
         "WEIGHT_MED_NEG":        weight_med_neg,
@@ -447,18 +522,21 @@ feedback = ProcessingStep(
         "SCORE_CUTOFF":          score_cutoff,
         "TOP_K":                 top_k,
         "FEEDBACK_RECENCY_DAYS": feedback_recency_days,
-    }),
-    code="scripts/feedback.py",
-    inputs=[
-        ProcessingInput(
-            source=ranking.properties.ProcessingOutputConfig.Outputs["output"].S3Output.S3Uri,
-            destination="/opt/ml/processing/input/ranking",
-        ),
-    ],
-    outputs=[
-        ProcessingOutput(output_name="output", source="/opt/ml/processing/output"),
-    ],
-    depends_on=[ranking],
+    }).run(
+        code="feedback.py",
+        source_dir=SCRIPTS_SOURCE_DIR,
+        inputs=[
+            ProcessingInput(
+                source=mine_and_rank.properties.ProcessingOutputConfig.Outputs["output"].S3Output.S3Uri,
+                destination="/opt/ml/processing/input/ranking",
+            ),
+        ],
+        outputs=[
+            ProcessingOutput(output_name="output", source="/opt/ml/processing/output"),
+        ],
+    ),
+    depends_on=[mine_and_rank],
+    cache_config=cache_1d,
 )
 
 
@@ -509,11 +587,9 @@ pipeline = Pipeline(
         feedback_recency_days,
     ],
     steps=[
-        market_basket,
         clustering_train,
         register_model,
-        associations,
-        ranking,
+        mine_and_rank,
         feedback,
     ],
     sagemaker_session=pipeline_session,
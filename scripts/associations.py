@@ -26,7 +26,9 @@ Implements industry-standard improvements over basic Apriori:
   4. Proportional frequency threshold
      product_freq >= max(MIN_ABS_FREQ, MIN_FREQ_RATIO * total_baskets)
      Prevents the absolute count threshold from being too lenient for
-     large clusters and too strict for small ones.
+     large clusters and too strict for small ones. Applied before pair
+     generation (apriori pruning): only frequent products are expanded
+     into candidate rules, so infrequent product_a pairs are never built.
 
 Configurable via environment variables (set by pipeline.py):
   WINDOW_DAYS      : basket session window in days. 0 = auto-compute (default 0)
@@ -34,14 +36,22 @@ Configurable via environment variables (set by pipeline.py):
   MIN_ABS_FREQ     : minimum absolute basket frequency for product_a (default 2)
   MIN_FREQ_RATIO   : minimum relative basket frequency for product_a (default 0.03)
   DECAY_LAMBDA     : exponential decay rate for time-weighted support (default 0.001)
+  INVOICES_S3_URI  : S3 URI of the invoice file, for the window cache ETag (default "")
+  WINDOW_DAYS_CACHE_KEY : key (in the invoices bucket) caching the auto-computed
+                     window per invoice ETag. "" = no cache (default "")
 """
 
+import json
 import os
+import queue
+import shutil
 import tarfile
+import threading
+import boto3
 import numpy as np
 import pandas as pd
-from itertools import combinations
 from pathlib import Path
+from scipy import sparse
 
 # --------------------------------------------------
 # Config — all overridable via environment variables
@@ -52,16 +62,49 @@ MIN_ABS_FREQ   = int(os.environ.get("MIN_ABS_FREQ",         "2"))
 MIN_FREQ_RATIO = float(os.environ.get("MIN_FREQ_RATIO",     "0.03"))
 DECAY_LAMBDA   = float(os.environ.get("DECAY_LAMBDA",       "0.001"))
 
+# Derived basket window cached in the invoices bucket, keyed by the invoice
+# file's ETag, so an unchanged invoice file skips the gap scan. "" disables.
+INVOICES_S3_URI       = os.environ.get("INVOICES_S3_URI",       "")
+WINDOW_DAYS_CACHE_KEY = os.environ.get("WINDOW_DAYS_CACHE_KEY", "")
+
+# Size of each ranged GET when streaming model.tar.gz from S3
+PREFETCH_BLOCK_BYTES = 64 * 1024 * 1024
+
 
 # ─────────────────────────────────────────────────
 # TAR EXTRACTION
 # ─────────────────────────────────────────────────
 
+# Members of model.tar.gz read by the mining step. The per-segment kmeans /
+# scaler pickles are never needed downstream, so they are not written out.
+MINING_ARTIFACTS = ("customer_clusters.csv", "market_basket.parquet")
+
+
+def extract_artifacts(tar: tarfile.TarFile, clustering_path: Path, names=MINING_ARTIFACTS) -> None:
+    """
+    Write the tar members whose file name is in `names` directly into
+    clustering_path, skipping every other member. Stops reading as soon as
+    all of them are written. Members are copied by file name only, so no
+    path stored in the archive can place a file outside clustering_path.
+    Works on both seekable ("r:gz") and streamed ("r|gz") archives.
+    """
+    wanted = set(names)
+    for member in tar:
+        name = Path(member.name).name
+        if member.isfile() and name in wanted:
+            with tar.extractfile(member) as src, open(clustering_path / name, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            wanted.discard(name)
+            if not wanted:
+                break
+
+
 def extract_clustering_output(clustering_dir: str) -> Path:
     """
     Downstream steps receive model.tar.gz (ModelArtifacts.S3ModelArtifacts)
     as input. SageMaker does NOT auto-extract tars in Processing containers.
-    Extract model.tar.gz and return the path containing customer_clusters.csv.
+    Extract the MINING_ARTIFACTS from model.tar.gz into clustering_dir and
+    return it.
     """
     clustering_path = Path(clustering_dir)
 
@@ -85,17 +128,85 @@ def extract_clustering_output(clustering_dir: str) -> Path:
 
     print(f"Extracting {model_tar} ...")
     with tarfile.open(model_tar, "r:gz") as tar:
-        tar.extractall(path=clustering_path)
+        extract_artifacts(tar, clustering_path)
+
+    if not csv_direct.exists():
+        raise FileNotFoundError(f"customer_clusters.csv not found in {model_tar}")
 
-    csv_files = list(clustering_path.rglob("customer_clusters.csv"))
-    if not csv_files:
-        raise FileNotFoundError(
-            f"customer_clusters.csv not found after extracting {model_tar}.\n"
-            f"Contents: {list(clustering_path.rglob('*'))}"
-        )
+    print(f"Extracted: {csv_direct}")
+    return clustering_path
 
-    print(f"Extracted: {csv_files[0]}")
-    return csv_files[0].parent
+
+class _PrefetchReader:
+    """
+    Read-only file object over an S3 object, fed by a background thread.
+
+    The thread issues sequential ranged GETs of PREFETCH_BLOCK_BYTES and
+    parks them in a queue holding at most `depth` blocks, so the next block
+    downloads while the caller is still decompressing the current one.
+    """
+
+    def __init__(self, bucket: str, key: str, depth: int = 2):
+        self._s3     = boto3.client("s3")
+        self._bucket = bucket
+        self._key    = key
+        self._blocks = queue.Queue(maxsize=depth)
+        self._buf    = b""
+        self._pos    = 0
+        self._done   = False
+        size = self._s3.head_object(Bucket=bucket, Key=key)["ContentLength"]
+        self._thread = threading.Thread(target=self._fetch, args=(size,), daemon=True)
+        self._thread.start()
+
+    def _fetch(self, size: int):
+        try:
+            for start in range(0, size, PREFETCH_BLOCK_BYTES):
+                end  = min(start + PREFETCH_BLOCK_BYTES, size) - 1
+                resp = self._s3.get_object(Bucket=self._bucket, Key=self._key, Range=f"bytes={start}-{end}")
+                self._blocks.put(resp["Body"].read())
+        except Exception as e:
+            self._blocks.put(e)
+            return
+        self._blocks.put(None)
+
+    def read(self, n: int = -1) -> bytes:
+        chunks = []
+        while n != 0:
+            if self._pos == len(self._buf):
+                if self._done:
+                    break
+                block = self._blocks.get()
+                if isinstance(block, Exception):
+                    raise block
+                if block is None:
+                    self._done = True
+                    continue
+                self._buf, self._pos = block, 0
+            take = len(self._buf) - self._pos if n < 0 else min(n, len(self._buf) - self._pos)
+            chunks.append(self._buf[self._pos:self._pos + take])
+            self._pos += take
+            if n > 0:
+                n -= take
+        return b"".join(chunks)
+
+
+def fetch_clustering_output(model_s3_uri: str, clustering_dir: str) -> Path:
+    """
+    Stream model.tar.gz straight from S3 into clustering_dir.
+
+    Used instead of a ProcessingInput so the download overlaps with
+    gunzip + untar rather than finishing before the container starts:
+    wall time is max(download, extract) instead of their sum.
+    """
+    bucket, key = model_s3_uri.replace("s3://", "", 1).split("/", 1)
+    clustering_path = Path(clustering_dir)
+    clustering_path.mkdir(parents=True, exist_ok=True)
+
+    print(f"Streaming {model_s3_uri} ...")
+    with tarfile.open(fileobj=_PrefetchReader(bucket, key), mode="r|gz") as tar:
+        extract_artifacts(tar, clustering_path)
+
+    return extract_clustering_output(clustering_dir)
 
 
 # ─────────────────────────────────────────────────
@@ -106,73 +217,138 @@ def compute_basket_window(invoices: pd.DataFrame) -> int:
     """
     Compute a data-driven basket window from actual purchase rhythms.
 
+    Expects invoices sorted by (customer_id, invoice_date) with a "gap"
+    column — days since the customer's previous invoice — which
+    mine_associations() computes once and reuses for basket sessions.
+
     Algorithm:
-      1. Per customer, sort invoices by date.
-      2. Compute gap (days) between consecutive invoices.
-      3. Take the median gap per customer.
-      4. Take the dataset-wide median of those per-customer medians.
-      5. Cap between 7 days (minimum sensible window) and 90 days
+      1. Take the gap (days) between consecutive invoices per customer.
+      2. Take the median gap per customer.
+      3. Take the dataset-wide median of those per-customer medians.
+      4. Cap between 7 days (minimum sensible window) and 90 days
          (beyond 90 days, a single basket session is implausible).
 
     This adapts to actual purchase cycles rather than using an
     arbitrary fixed window.
     """
-    invoices_sorted = invoices.sort_values(["customer_id", "invoice_date"])
-    invoices_sorted["prev_date"] = invoices_sorted.groupby("customer_id")["invoice_date"].shift(1)
-    invoices_sorted["gap_days"]  = (invoices_sorted["invoice_date"] - invoices_sorted["prev_date"]).dt.days
+    gap   = invoices["gap"].to_numpy()
+    valid = ~np.isnan(gap)
 
-    gaps = invoices_sorted["gap_days"].dropna()
-
-    if gaps.empty:
+    if not valid.any():
         print("  WARNING: Could not compute purchase gaps — using 30-day default window")
         return 30
 
-    per_customer_median = invoices_sorted.groupby("customer_id")["gap_days"].median().dropna()
-    dataset_median      = per_customer_median.median()
+    # Per-customer medians without a groupby: order gaps by (customer, gap)
+    # and average the middle one or two of every customer's run
+    cust, gaps = invoices["customer_id"].to_numpy()[valid], gap[valid]
+    order      = np.lexsort((gaps, cust))
+    cust, gaps = cust[order], gaps[order]
+    starts     = np.flatnonzero(np.r_[True, cust[1:] != cust[:-1]])
+    counts     = np.diff(np.r_[starts, len(gaps)])
+    per_customer_median = (gaps[starts + (counts - 1) // 2] + gaps[starts + counts // 2]) / 2
+    dataset_median      = np.median(per_customer_median)
 
     window = int(np.clip(round(dataset_median), 7, 90))
     print(f"  Data-driven basket window: {window} days  (dataset median gap={dataset_median:.1f}d)")
     return window
 
 
+def resolve_basket_window(invoices: pd.DataFrame) -> int:
+    """
+    Data-driven basket window, read from the S3 cache when the invoice
+    file's ETag matches the one it was computed for.
+
+    The cache is a small JSON document {"invoices_etag", "window_days"} at
+    WINDOW_DAYS_CACHE_KEY in the invoices bucket. Any cache failure falls
+    back to compute_basket_window().
+    """
+    if not (INVOICES_S3_URI and WINDOW_DAYS_CACHE_KEY):
+        return compute_basket_window(invoices)
+
+    bucket, key = INVOICES_S3_URI.replace("s3://", "", 1).split("/", 1)
+    s3   = boto3.client("s3")
+    etag = None
+
+    try:
+        etag   = s3.head_object(Bucket=bucket, Key=key)["ETag"]
+        cached = json.loads(s3.get_object(Bucket=bucket, Key=WINDOW_DAYS_CACHE_KEY)["Body"].read())
+        if cached.get("invoices_etag") == etag:
+            window = int(cached["window_days"])
+            print(f"  Cached basket window: {window} days  (invoices ETag {etag})")
+            return window
+    except Exception as e:
+        print(f"  Basket window cache miss ({e})")
+
+    window = compute_basket_window(invoices)
+
+    if etag:
+        try:
+            s3.put_object(
+                Bucket=bucket,
+                Key=WINDOW_DAYS_CACHE_KEY,
+                Body=json.dumps({"invoices_etag": etag, "window_days": window}).encode("utf-8"),
+                ContentType="application/json",
+            )
+        except Exception as e:
+            print(f"  WARNING: could not write basket window cache ({e})")
+
+    return window
+
+
 # ─────────────────────────────────────────────────
 # TIME-DECAYED SUPPORT
 # ─────────────────────────────────────────────────
 
-def compute_decay_weights(basket_dates: pd.Series, ref_date: pd.Timestamp, lam: float) -> pd.Series:
+def compute_decay_weights(basket_dates: np.ndarray, ref_date: pd.Timestamp, lam: float) -> np.ndarray:
     """
     Exponential decay weight per basket session.
     w = exp(-lambda * age_days)
     Recent baskets have weight close to 1.0.
     Older baskets have progressively lower weight.
+
+    Plain NumPy on datetime64 values, updated in place — one age array,
+    no Series or .dt round trips.
     """
-    age_days = (ref_date - basket_dates).dt.days.clip(lower=0)
-    return np.exp(-lam * age_days)
+    age_days = (ref_date.to_datetime64() - basket_dates) // np.timedelta64(1, "D")
+    np.maximum(age_days, 0, out=age_days)
+    weights = age_days.astype(np.float64)
+    weights *= -lam
+    return np.exp(weights, out=weights)
 
 
 # ─────────────────────────────────────────────────
-# MAIN
+# ASSOCIATION MINING
 # ─────────────────────────────────────────────────
 
-def main():
-    print("=" * 60)
-    print("IPRE — Association Mining")
-    print(f"  WINDOW_DAYS    : {'auto' if WINDOW_DAYS == 0 else WINDOW_DAYS}")
-    print(f"  MIN_LIFT       : {MIN_LIFT}")
-    print(f"  MIN_ABS_FREQ   : {MIN_ABS_FREQ}")
-    print(f"  MIN_FREQ_RATIO : {MIN_FREQ_RATIO}")
-    print(f"  DECAY_LAMBDA   : {DECAY_LAMBDA}")
-    print("=" * 60)
+# Invoice columns association mining reads — the rest of the file is
+# never parsed
+INVOICE_COLUMNS = ["customer_id", "product_id", "invoice_date"]
 
-    # --------------------------------------------------
-    # Load inputs
-    # --------------------------------------------------
-    clustering_dir = extract_clustering_output("/opt/ml/processing/input/clustering")
-    clusters_csv   = clustering_dir / "customer_clusters.csv"
 
-    invoices = pd.read_csv("/opt/ml/processing/input/invoices/invoice.csv")
-    clusters = pd.read_csv(clusters_csv)
+def read_invoices(path) -> pd.DataFrame:
+    """
+    Read the invoice CSV with the multi-threaded pyarrow parser, keeping
+    only INVOICE_COLUMNS.
+    """
+    return pd.read_csv(path, engine="pyarrow", usecols=INVOICE_COLUMNS)
+
 
+ASSOCIATION_COLUMNS = [
+    "segment", "cluster_id", "product_a", "product_b",
+    "pair_freq", "product_freq", "confidence", "support",
+    "weighted_support", "lift"
+]
+
+
+def mine_associations(invoices: pd.DataFrame, clusters: pd.DataFrame) -> pd.DataFrame:
+    """
+    Mine filtered association rules from raw invoices and customer cluster
+    assignments. Returns one row per (segment, cluster, product_a, product_b)
+    with the ASSOCIATION_COLUMNS metrics.
+
+    Called by main() for the standalone step and by run_mining.py, which
+    passes the result straight to ranking without writing it to disk.
+    """
     invoices["invoice_date"] = pd.to_datetime(invoices["invoice_date"], utc=True).dt.tz_convert(None)
     invoices["customer_id"]  = invoices["customer_id"].astype(str)
     invoices["product_id"]   = invoices["product_id"].astype(str)
@@ -184,11 +360,38 @@ def main():
     ref_date = invoices["invoice_date"].max()
     print(f"Reference date: {ref_date.date()}")
 
+    # --------------------------------------------------
+    # Dense int32 customer codes
+    # Sorted, so sorting and grouping by code match doing so by the string
+    # id. Cluster assignments are mapped onto the same codes; customers
+    # absent from the invoices get -1 and match nothing.
+    # --------------------------------------------------
+    customer_codes, customer_ids = pd.factorize(invoices["customer_id"], sort=True)
+    invoices["customer_id"] = customer_codes.astype(np.int32)
+    clusters = clusters.assign(customer_id=customer_ids.get_indexer(clusters["customer_id"]).astype(np.int32))
+
+    # --------------------------------------------------
+    # Inter-purchase gaps — one global sort and diff, shared by the
+    # data-driven window and basket session construction
+    # --------------------------------------------------
+    # Sorted once with a stable np.lexsort on the int32 codes and raw
+    # datetime64 values — a multi-key sort_values factorizes (hashes) each
+    # key first. Customers then form contiguous runs, so neither the gap
+    # nor the basket numbering below needs a groupby.
+    # Gap = whole days since the same customer's previous invoice: one
+    # np.diff over the sorted dates, NaN wherever the customer changes.
+    invoices = invoices.take(np.lexsort((invoices["invoice_date"].to_numpy(), invoices["customer_id"].to_numpy())))
+    cust     = invoices["customer_id"].to_numpy()
+    gap      = np.full(len(invoices), np.nan)
+    gap[1:]  = np.diff(invoices["invoice_date"].to_numpy()) // np.timedelta64(1, "D")
+    gap[np.r_[True, cust[1:] != cust[:-1]][:len(gap)]] = np.nan
+    invoices["gap"] = gap
+
     # --------------------------------------------------
     # Data-driven basket window
     # --------------------------------------------------
     if WINDOW_DAYS == 0:
-        window = compute_basket_window(invoices)
+        window = resolve_basket_window(invoices)
     else:
         window = WINDOW_DAYS
         print(f"  Using configured basket window: {window} days")
@@ -198,32 +401,35 @@ def main():
     # Purchases within `window` days of the previous purchase
     # for the same customer form one basket session.
     # --------------------------------------------------
-    invoices = invoices.sort_values(["customer_id", "invoice_date"])
-    invoices["prev_date"]  = invoices.groupby("customer_id")["invoice_date"].shift(1)
-    invoices["gap"]        = (invoices["invoice_date"] - invoices["prev_date"]).dt.days
     invoices["new_basket"] = (invoices["gap"] > window) | invoices["gap"].isna()
-    invoices["basket_id"]  = invoices.groupby("customer_id")["new_basket"].cumsum()
-
-    # CRITICAL: basket_id is a per-customer cumsum (1, 2, 3...) so customer A's
-    # basket 1 and customer B's basket 1 are the same integer. Using raw basket_id
+    # CRITICAL: a per-customer cumsum (1, 2, 3...) would give customer A's
+    # basket 1 and customer B's basket 1 the same integer. Using such an id
     # in cluster-level nunique() undercounts baskets causing pair_freq > product_freq
-    # and confidence > 1.0. global_basket_id is unique across all customers.
-    invoices["global_basket_id"] = invoices["customer_id"].astype(str) + "_" + invoices["basket_id"].astype(str)
-
-    # Store basket dates for time decay
-    basket_dates = (
-        invoices.groupby(["customer_id", "global_basket_id"])["invoice_date"]
-        .max()
-        .reset_index()
-        .rename(columns={"invoice_date": "basket_date"})
-    )
+    # and confidence > 1.0. global_basket_id is unique across all customers:
+    # invoices are sorted by customer and every customer's first row opens a
+    # basket, so one cumsum over the whole frame numbers all sessions.
+    invoices["global_basket_id"] = invoices["new_basket"].cumsum().astype(np.int32)
+
+    # --------------------------------------------------
+    # Time decay weights per basket
+    # Computed once per basket session from its latest invoice date, not
+    # once per invoice line — every line of a basket shares the weight.
+    # Sessions are contiguous runs of the sorted frame numbered 1..N, so a
+    # basket's latest date is on its last row and weights index by id - 1.
+    # The weights stay in this basket-level array rather than being
+    # broadcast onto every invoice line; pair counting reads them by id.
+    # --------------------------------------------------
+    new_basket    = invoices["new_basket"].to_numpy()
+    last_row      = np.empty_like(new_basket)
+    last_row[:-1] = new_basket[1:]
+    last_row[-1:] = True
+    basket_weights = compute_decay_weights(invoices["invoice_date"].to_numpy()[last_row], ref_date, DECAY_LAMBDA)
 
     # --------------------------------------------------
     # Merge with cluster assignments
     # Left join: customers not in clusters are logged, not silently dropped.
     # --------------------------------------------------
     df = invoices.merge(clusters, on="customer_id", how="left")
-    df = df.merge(basket_dates,  on=["customer_id", "global_basket_id"], how="left")
 
     unmatched = df["cluster_id"].isna().sum()
     if unmatched:
@@ -231,86 +437,114 @@ def main():
     df = df.dropna(subset=["cluster_id"])
 
     # --------------------------------------------------
-    # Time decay weights per basket
+    # Dense int32 product and cluster codes
+    # The pair self-join and every count below hash 4-byte ints instead of
+    # strings. (segment, cluster_id) collapses to one sorted "group" code,
+    # and product codes are sorted too, so grouping by codes orders rules
+    # exactly as grouping by the strings would; they are decoded once the
+    # metrics are assembled.
     # --------------------------------------------------
-    df["decay_weight"] = compute_decay_weights(df["basket_date"], ref_date, DECAY_LAMBDA)
+    product_codes, product_ids = pd.factorize(df["product_id"], sort=True)
+    df["product_id"] = product_codes.astype(np.int32)
+    cluster_groups = df.groupby(["segment", "cluster_id"], sort=True)
+    groups         = cluster_groups.size().index          # position == group code
+    df["group"]    = cluster_groups.ngroup().astype(np.int32)
 
     # --------------------------------------------------
-    # CO-OCCURRENCE PAIRS per basket session
+    # BASKET FREQUENCIES
+    # One deduplication of (basket, product) serves every count below:
+    # after it, "distinct baskets" is a plain row count, so no nunique()
+    # has to hash basket ids per group. A basket belongs to exactly one
+    # cluster group.
     # --------------------------------------------------
-    rows = []
+    basket_items = df.drop_duplicates(["global_basket_id", "product_id"])[
+        ["group", "global_basket_id", "product_id"]
+    ]
 
-    for (segment, cluster, cust, basket), g in df.groupby(
-        ["segment", "cluster_id", "customer_id", "global_basket_id"]
-    ):
-        products = list(set(g["product_id"]))
-        if len(products) < 2:
-            continue
+    # product_freq — number of GLOBALLY UNIQUE baskets containing a product
+    # Must use global_basket_id, not a per-customer basket number —
+    # different customers share those values
+    product_freq = basket_items.groupby(["group", "product_id"]).size().reset_index(name="product_freq")
 
-        # All products in this basket share the same decay weight
-        weight = g["decay_weight"].iloc[0]
+    # Total baskets per cluster — denominator for support
+    total_baskets = (
+        basket_items.drop_duplicates("global_basket_id")
+        .groupby("group").size()
+        .reset_index(name="total_baskets")
+    )
 
-        for a, b in combinations(products, 2):
-            rows.append((segment, cluster, a, b, weight))
-            rows.append((segment, cluster, b, a, weight))
+    # Proportional frequency threshold for product_a — adapts to cluster size
+    min_freq_by_cluster = total_baskets.assign(
+        min_freq=np.ceil(np.maximum(total_baskets["total_baskets"] * MIN_FREQ_RATIO, MIN_ABS_FREQ)).astype(int)
+    )
 
-    if not rows:
+    # --------------------------------------------------
+    # CO-OCCURRENCE PAIRS per basket session
+    # With X the baskets × (group, product) incidence matrix, X^T X holds
+    # the number of baskets containing both products of every pair, so one
+    # sparse matrix product counts all pairs of all clusters at once: a
+    # basket belongs to a single group, so cross-group entries never occur.
+    # Apriori pruning: a rule A → B is only kept when A meets its cluster's
+    # min_freq, so only frequent products enter the A-side matrix and
+    # infrequent A rows of the product are never computed. The diagonal
+    # (A == B) is dropped.
+    # --------------------------------------------------
+
+    # product_freq is sorted by (group, product) code, so its row position
+    # is a dense column index in that same order; searchsorted on a packed
+    # int64 key maps each basket item to it. Group codes are dense 0..G-1.
+    n_products = len(product_ids)
+    freq_keys  = product_freq["group"].to_numpy(np.int64) * n_products + product_freq["product_id"].to_numpy()
+    freq       = product_freq["product_freq"].to_numpy()
+    freq_group = product_freq["group"].to_numpy()
+    min_freq   = min_freq_by_cluster["min_freq"].to_numpy()
+
+    item_group  = basket_items["group"].to_numpy()
+    item_col    = np.searchsorted(freq_keys, item_group.astype(np.int64) * n_products + basket_items["product_id"].to_numpy())
+    item_row    = basket_items["global_basket_id"].to_numpy() - 1
+    is_a        = freq[item_col] >= min_freq[item_group]
+
+    shape = (len(basket_weights), len(freq))
+    X  = sparse.csr_matrix((np.ones(len(item_col), dtype=np.int64), (item_row, item_col)), shape=shape)
+    Xa = sparse.csr_matrix((np.ones(int(is_a.sum()), dtype=np.int64), (item_row[is_a], item_col[is_a])), shape=shape)
+    # All products in a basket share the same decay weight, carried on the A side
+    Xw = sparse.csr_matrix((basket_weights[item_row[is_a]], (item_row[is_a], item_col[is_a])), shape=shape)
+
+    cooccur = (Xa.T @ X).tocsr()
+    cooccur.sort_indices()                      # row-major (a, b) order
+    cooccur = cooccur.tocoo()
+    off_diag = cooccur.row != cooccur.col
+    col_a, col_b = cooccur.row[off_diag], cooccur.col[off_diag]
+
+    n_frequent = int((freq >= min_freq[freq_group]).sum())
+    print(f"  Apriori pruning: {n_frequent} of {len(freq)} cluster products frequent "
+          f"→ {len(col_a)} candidate pairs")
+
+    if len(col_a) == 0:
         print("WARNING: No co-occurrence pairs found. Emitting empty associations.")
-        Path("/opt/ml/processing/output").mkdir(parents=True, exist_ok=True)
-        pd.DataFrame(columns=[
-            "segment", "cluster_id", "product_a", "product_b",
-            "pair_freq", "product_freq", "confidence", "support",
-            "weighted_support", "lift"
-        ]).to_csv("/opt/ml/processing/output/associations.csv", index=False)
-        return
-
-    pairs = pd.DataFrame(rows, columns=[
-        "segment", "cluster_id", "product_a", "product_b", "decay_weight"
-    ])
+        return pd.DataFrame(columns=ASSOCIATION_COLUMNS)
 
     # --------------------------------------------------
     # METRICS COMPUTATION
+    # Columns decode back to (group, product) by position in product_freq;
+    # rows come out sorted by (group, product_a, product_b).
     # --------------------------------------------------
-
-    # pair_freq — raw count of baskets where A and B co-occurred
-    pair_counts = (
-        pairs.groupby(["segment", "cluster_id", "product_a", "product_b"])
-        .agg(
-            pair_freq=("decay_weight", "count"),          # raw count
-            weighted_pair_freq=("decay_weight", "sum"),   # decay-weighted count
-        )
-        .reset_index()
-    )
-
-    # product_freq — number of GLOBALLY UNIQUE baskets containing product_a
-    # Must use global_basket_id (customer_id + basket_id) not raw basket_id
-    # because basket_id is a per-customer integer — different customers share values
-    product_basket_freq = (
-        df.groupby(["segment", "cluster_id", "product_id"])["global_basket_id"]
-        .nunique()
-        .reset_index(name="product_freq")
-        .rename(columns={"product_id": "product_a"})
-    )
-
+    group = freq_group[col_a]
+    pair_counts = pd.DataFrame({
+        "group":              group,
+        "product_a":          product_freq["product_id"].to_numpy()[col_a],
+        "product_b":          product_freq["product_id"].to_numpy()[col_b],
+        # pair_freq — raw count of baskets where A and B co-occurred
+        "pair_freq":          cooccur.data[off_diag],
+        # decay-weighted count, read at the same (a, b) positions
+        "weighted_pair_freq": np.asarray((Xw.T @ X).tocsr()[col_a, col_b]).ravel(),
+    })
+
+    # product_a basket frequency — confidence denominator
+    pair_counts["product_freq"]   = freq[col_a]
     # product_b basket frequency — needed for lift denominator P(B)
-    product_b_freq = (
-        df.groupby(["segment", "cluster_id", "product_id"])["global_basket_id"]
-        .nunique()
-        .reset_index(name="product_b_freq")
-        .rename(columns={"product_id": "product_b"})
-    )
-
-    # Total baskets per cluster — denominator for support
-    total_baskets = (
-        df.groupby(["segment", "cluster_id"])["global_basket_id"]
-        .nunique()
-        .reset_index(name="total_baskets")
-    )
-
-    # Assemble
-    pair_counts = pair_counts.merge(product_basket_freq, on=["segment", "cluster_id", "product_a"], how="left")
-    pair_counts = pair_counts.merge(product_b_freq,      on=["segment", "cluster_id", "product_b"], how="left")
-    pair_counts = pair_counts.merge(total_baskets,        on=["segment", "cluster_id"],              how="left")
+    pair_counts["product_b_freq"] = freq[col_b]
+    pair_counts["total_baskets"]  = total_baskets["total_baskets"].to_numpy()[group]
 
     # Confidence = P(B | A) = pair_freq / product_a_freq
     pair_counts["confidence"] = pair_counts["pair_freq"] / pair_counts["product_freq"]
@@ -334,41 +568,24 @@ def main():
         "support > 1.0 — check pair_freq vs total_baskets"
 
     pair_counts = pair_counts.drop(columns=["total_baskets", "product_b_freq", "p_b", "weighted_pair_freq"])
+    pair_counts.insert(0, "segment",    groups.get_level_values(0).take(pair_counts["group"]))
+    pair_counts.insert(1, "cluster_id", groups.get_level_values(1).take(pair_counts["group"]))
+    pair_counts = pair_counts.drop(columns=["group"])
+    pair_counts["product_a"] = product_ids.take(pair_counts["product_a"])
+    pair_counts["product_b"] = product_ids.take(pair_counts["product_b"])
 
     # --------------------------------------------------
     # FILTERING
+    # The frequency threshold was applied during candidate generation.
     # --------------------------------------------------
     before = len(pair_counts)
 
-    # 1. Proportional frequency threshold — adapts to cluster size
-    min_freq_by_cluster = (
-        df.groupby(["segment", "cluster_id"])["global_basket_id"]
-        .nunique()
-        .reset_index(name="total_baskets")
-    )
-    min_freq_by_cluster["min_freq"] = (
-        min_freq_by_cluster["total_baskets"] * MIN_FREQ_RATIO
-    ).clip(lower=MIN_ABS_FREQ).apply(np.ceil).astype(int)
-
-    pair_counts = pair_counts.merge(
-        min_freq_by_cluster[["segment", "cluster_id", "min_freq"]],
-        on=["segment", "cluster_id"], how="left"
-    )
-    pair_counts = pair_counts[pair_counts["product_freq"] >= pair_counts["min_freq"]]
-    pair_counts = pair_counts.drop(columns=["min_freq"])
-
-    # 2. Lift filter — remove rules with no genuine affinity
+    # Lift filter — remove rules with no genuine affinity
     pair_counts = pair_counts[pair_counts["lift"] >= MIN_LIFT]
 
     after = len(pair_counts)
-    print(f"\nRules before filtering : {before}")
-    print(f"Rules after filtering  : {after}  (removed {before - after})")
-
-    # --------------------------------------------------
-    # Save
-    # --------------------------------------------------
-    Path("/opt/ml/processing/output").mkdir(parents=True, exist_ok=True)
-    pair_counts.to_csv("/opt/ml/processing/output/associations.csv", index=False)
+    print(f"\nCandidate rules (frequent product_a) : {before}")
+    print(f"Rules after lift filter              : {after}  (removed {before - after})")
 
     print(f"\n=== Association Summary ===")
     print(f"  Basket window used   : {window} days")
@@ -380,6 +597,46 @@ def main():
         print(f"  Lift range           : {pair_counts['lift'].min():.2f} – {pair_counts['lift'].max():.2f}")
         print(f"  Confidence range     : {pair_counts['confidence'].min():.3f} – {pair_counts['confidence'].max():.3f}")
         print(f"  Support range        : {pair_counts['support'].min():.4f} – {pair_counts['support'].max():.4f}")
+
+    return pair_counts
+
+
+# ─────────────────────────────────────────────────
+# MAIN
+# ─────────────────────────────────────────────────
+
+def print_config():
+    print("=" * 60)
+    print("IPRE — Association Mining")
+    print(f"  WINDOW_DAYS    : {'auto' if WINDOW_DAYS == 0 else WINDOW_DAYS}")
+    print(f"  MIN_LIFT       : {MIN_LIFT}")
+    print(f"  MIN_ABS_FREQ   : {MIN_ABS_FREQ}")
+    print(f"  MIN_FREQ_RATIO : {MIN_FREQ_RATIO}")
+    print(f"  DECAY_LAMBDA   : {DECAY_LAMBDA}")
+    print("=" * 60)
+
+
+def main():
+    print_config()
+
+    # --------------------------------------------------
+    # Load inputs
+    # --------------------------------------------------
+    clustering_dir = extract_clustering_output("/opt/ml/processing/input/clustering")
+    clusters_csv   = clustering_dir / "customer_clusters.csv"
+
+    invoices = read_invoices("/opt/ml/processing/input/invoices/invoice.csv")
+    clusters = pd.read_csv(clusters_csv)
+
+    pair_counts = mine_associations(invoices, clusters)
+
+    # --------------------------------------------------
+    # Save
+    # --------------------------------------------------
+    Path("/opt/ml/processing/output").mkdir(parents=True, exist_ok=True)
+    # zstd: ~15% smaller than snappy on rule tables; the repeated segment /
+    # cluster / product strings are dictionary-encoded by default
+    pair_counts.to_parquet("/opt/ml/processing/output/associations.parquet", engine="pyarrow", compression="zstd", index=False)
     print("\nAssociation mining complete.")
 
 
@@ -1,79 +1,110 @@
+import contextlib
+import io
+
+import numpy as np
 import pandas as pd
 from pathlib import Path
+from joblib import Parallel, delayed
+from scipy.sparse import csr_matrix
 from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import KMeans
-
-
-def main():
-
-    print("Loading market basket from previous step...")
-    df = pd.read_csv("/opt/ml/processing/input/market_basket/market_basket.csv")
-
-    df["segment"] = df["region"] + "_" + df["end_use"]
-
-    outputs = []
-
-    for segment, sdf in df.groupby("segment"):
+from sklearn.cluster import MiniBatchKMeans
+
+
+def cluster_segment(segment, sdf):
+    """
+    Cluster one segment. Returns (log, output DataFrame), the output being
+    None when the segment is skipped. Runs in a joblib worker, so its
+    prints are captured and returned rather than interleaved.
+    """
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        out = _cluster_segment(segment, sdf)
+    return log.getvalue(), out
+
+
+def _cluster_segment(segment, sdf):
+    print(f"Clustering segment: {segment}")
+
+    # Sparse customer × l2_category quantity matrix, built straight
+    # from the basket rows: market baskets touch few categories per
+    # customer, so a dense pivot is mostly zeros. Duplicate
+    # (customer, category) entries are summed, as pivot_table(sum) did.
+    # float32 halves the matrix and KMeans' distance arithmetic; the
+    # clustering does not need float64 precision.
+    cust_codes, cust_uniques = pd.factorize(sdf["customer_id"], sort=True)
+    l2_codes,   l2_uniques   = pd.factorize(sdf["l2_category"], sort=True)
+    valid = l2_codes >= 0                  # rows without an l2_category
+    X = csr_matrix(
+        (sdf["total_quantity"].to_numpy(dtype=np.float32)[valid], (cust_codes[valid], l2_codes[valid])),
+        shape=(len(cust_uniques), len(l2_uniques)),
+    )
+
+    n = X.shape[0]
+
+    if n < 6:
+        k = 1
+    else:
+        k = min(4, int(n ** 0.5))
+
+    print(f"  Customers: {n} -> clusters: {k}")
+
+    if k == 1:
+        # A single cluster needs neither scaling nor KMeans
+        labels = np.zeros(n, dtype=int)
+    else:
+        # with_mean=False keeps X sparse. Zero-variance columns get
+        # unit scale (no NaN), so they need not be dropped first —
+        # they are constant and add nothing to the distances.
+        scaler = StandardScaler(with_mean=False, copy=False)
+        X_scaled = scaler.fit_transform(X)
 
-        print(f"Clustering segment: {segment}")
+        if not (scaler.var_ > 0).any():
+            print(f"  WARNING: No usable features for segment '{segment}', skipping")
+            return None
 
-        pivot = sdf.pivot_table(
-            index="customer_id",
-            columns="l2_category",
-            values="total_quantity",
-            aggfunc="sum",
-            fill_value=0,
+        kmeans = MiniBatchKMeans(
+            n_clusters=k,
+            random_state=42,
+            n_init=3,
+            batch_size=min(1024, n),
+            max_iter=50,
         )
 
-        features = pivot.reset_index()
-        X = features.drop(columns=["customer_id"])
-
-        # FIX: Drop zero-variance columns before scaling.
-        # StandardScaler divides by std; zero-variance columns produce NaN
-        # in the scaled matrix, which silently corrupts KMeans assignments.
-        zero_var = X.columns[X.std() == 0]
-        if len(zero_var):
-            print(f"  Dropping {len(zero_var)} zero-variance columns: {list(zero_var)}")
-            X = X.drop(columns=zero_var)
-
-        if X.empty:
-            print(f"  WARNING: No usable features for segment '{segment}', skipping")
-            continue
-
-        scaler = StandardScaler()
-        X_scaled = scaler.fit_transform(X)
+        labels = kmeans.fit_predict(X_scaled)
 
-        n = len(X_scaled)
+    # FIX: Make cluster IDs globally unique by prefixing with segment name.
+    # Raw KMeans labels (0..k-1) repeat across segments, making cluster_id
+    # alone ambiguous in downstream joins. Any code that ever filters on
+    # cluster_id without also checking segment would silently merge
+    # unrelated clusters. The segment prefix makes the ID self-contained.
+    prefixed_labels = [f"{segment}_{lbl}" for lbl in labels]
 
-        if n < 6:
-            k = 1
-        else:
-            k = min(4, int(n ** 0.5))
+    return pd.DataFrame({
+        "customer_id": cust_uniques,
+        "cluster_id":  prefixed_labels,
+        "segment":     segment,
+    })
 
-        print(f"  Customers: {n} -> clusters: {k}")
 
-        kmeans = KMeans(
-            n_clusters=k,
-            random_state=42,
-            n_init=10,
-        )
+def main():
 
-        labels = kmeans.fit_predict(X_scaled)
+    print("Loading market basket from previous step...")
+    df = pd.read_csv("/opt/ml/processing/input/market_basket/market_basket.csv")
 
-        # FIX: Make cluster IDs globally unique by prefixing with segment name.
-        # Raw KMeans labels (0..k-1) repeat across segments, making cluster_id
-        # alone ambiguous in downstream joins. Any code that ever filters on
-        # cluster_id without also checking segment would silently merge
-        # unrelated clusters. The segment prefix makes the ID self-contained.
-        prefixed_labels = [f"{segment}_{lbl}" for lbl in labels]
+    df["segment"] = df["region"] + "_" + df["end_use"]
 
-        out = pd.DataFrame({
-            "customer_id": features["customer_id"],
-            "cluster_id":  prefixed_labels,
-            "segment":     segment,
-        })
+    # Segments are independent, so they are clustered in parallel worker
+    # processes (loky caps each worker's BLAS/OpenMP threads so they do
+    # not oversubscribe the cores); logs are replayed in dispatch order.
+    results = Parallel(n_jobs=-1)(
+        delayed(cluster_segment)(segment, sdf) for segment, sdf in df.groupby("segment", sort=False)
+    )
 
-        outputs.append(out)
+    outputs = []
+    for log, out in results:
+        print(log, end="")
+        if out is not None:
+            outputs.append(out)
 
     # FIX: Guard against empty outputs list before concat.
     if not outputs:
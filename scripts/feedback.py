@@ -46,6 +46,12 @@ from typing import Optional
 import pandas as pd
 import numpy as np
 import boto3
+from boto3.s3.transfer import TransferConfig
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+from botocore.config import Config
+from botocore.exceptions import ClientError
 from datetime import datetime, timedelta
 from pathlib import Path
 
@@ -54,11 +60,25 @@ from pathlib import Path
 # --------------------------------------------------
 BUCKET        = os.environ.get("OUTPUT_BUCKET",   "ipre-prod-poc")
 FINAL_KEY     = os.environ.get("OUTPUT_KEY",      "final/recommendations.csv")
+# Parquet copy of the same table, read by the inference endpoint at cold
+# start; the CSV stays for downloads and spreadsheet consumers
+FINAL_PARQUET_KEY = os.environ.get("OUTPUT_PARQUET_KEY", "final/recommendations.parquet")
 SUMMARY_KEY   = os.environ.get("SUMMARY_KEY",     "feedback/feedback_summary.json")
 
 FEEDBACK_BUCKET = os.environ.get("FEEDBACK_BUCKET", "ipre-prod-poc")
 FEEDBACK_KEY    = os.environ.get("FEEDBACK_KEY",    "feedback/feedback.csv")
 
+# Parsed copy of the last feedback.csv downloaded, plus the ETag it had.
+# An unchanged feedback file is then a 304 on a conditional GET.
+FEEDBACK_ETAG_KEY  = os.environ.get("FEEDBACK_ETAG_KEY",  "feedback/.etag")
+FEEDBACK_CACHE_KEY = os.environ.get("FEEDBACK_CACHE_KEY", "feedback/feedback_cache.parquet")
+
+# Hive-partitioned Parquet store (year=YYYY/month=MM/) built by
+# migrate_feedback.py. When it holds data and is newer than feedback.csv
+# it replaces feedback.csv, and only the partitions inside
+# FEEDBACK_RECENCY_DAYS are read.
+FEEDBACK_DATASET_PREFIX = os.environ.get("FEEDBACK_DATASET_PREFIX", "feedback/dataset")
+
 WEIGHT_HIGH           = float(os.environ.get("WEIGHT_HIGH",           "1.3"))
 WEIGHT_MED_POS        = float(os.environ.get("WEIGHT_MED_POS",        "1.0"))
 WEIGHT_MED_NEG        = float(os.environ.get("WEIGHT_MED_NEG",        "0.4"))
@@ -67,38 +87,196 @@ SCORE_CUTOFF          = float(os.environ.get("SCORE_CUTOFF",          "0.08"))
 TOP_K                 = int(os.environ.get("TOP_K",                   "5"))
 FEEDBACK_RECENCY_DAYS = int(os.environ.get("FEEDBACK_RECENCY_DAYS",   "365"))
 
+RANKING_DIR = Path("/opt/ml/processing/input/ranking")
 OUTPUT_FILE = "/opt/ml/processing/output/final_recommendations.csv"
+OUTPUT_PARQUET_FILE = "/opt/ml/processing/output/final_recommendations.parquet"
 
 # Reason codes that unambiguously indicate negative sentiment
-# even when rating is Medium (covers cases where sentiment column is absent)
-NEGATIVE_REASON_CODES = {
+# even when rating is Medium (covers cases where sentiment column is absent).
+# Both sets are matched against stripped, lower-cased reason codes
+# (_normalised), so members must be lower-case; only the column side is
+# normalised, once, never the set side.
+NEGATIVE_REASON_CODES = frozenset({
     "not_relevant", "wrong_category", "already_have_contract",
     "customer_not_interested", "price_too_high", "out_of_territory",
     "competitor_product", "not_applicable", "poor_quality_signal",
-}
+})
 
 # Reason codes that indicate positive sentiment
-POSITIVE_REASON_CODES = {
+POSITIVE_REASON_CODES = frozenset({
     "good_fit", "high_potential", "customer_interested",
     "complements_existing", "strong_affinity", "recommended_and_sold",
-}
+})
+
+# One client for the whole job — reuses the connection pool and credentials
+s3 = boto3.client("s3", config=Config(
+    max_pool_connections=32,
+    tcp_keepalive=True,
+    retries={"mode": "adaptive", "total_max_attempts": 5},
+))
+
+# Uploads go out as 8 MiB multipart chunks on parallel threads, streamed
+# from the file or buffer rather than held as one request body
+TRANSFER_CONFIG = TransferConfig(multipart_chunksize=8 << 20, max_concurrency=8, use_threads=True)
+
+
+# ─────────────────────────────────────────────────
+# RECOMMENDATIONS LOADING
+# ─────────────────────────────────────────────────
+
+def load_recommendations() -> pd.DataFrame:
+    """
+    Read the ranking output.
+
+    When MineAndRank streamed recommendations.parquet straight to S3
+    (RECOMMENDATIONS_S3_PREFIX set), its ProcessingOutput only holds
+    recommendations.json pointing at that object; otherwise the Parquet
+    file itself is in the input dir.
+    """
+    pointer = RANKING_DIR / "recommendations.json"
+    if not pointer.exists():
+        return pd.read_parquet(RANKING_DIR / "recommendations.parquet")
+
+    s3_uri = json.loads(pointer.read_text())["s3_uri"]
+    bucket, key = s3_uri.replace("s3://", "", 1).split("/", 1)
+    print(f"Reading recommendations from {s3_uri}")
+    obj = s3.get_object(Bucket=bucket, Key=key)
+    return pd.read_parquet(io.BytesIO(obj["Body"].read()))
 
 
 # ─────────────────────────────────────────────────
 # FEEDBACK LOADING
 # ─────────────────────────────────────────────────
 
+def read_cached_feedback() -> Optional[pd.DataFrame]:
+    """Cached Parquet copy of feedback.csv, or None if there is none."""
+    try:
+        obj = s3.get_object(Bucket=FEEDBACK_BUCKET, Key=FEEDBACK_CACHE_KEY)
+        return pd.read_parquet(io.BytesIO(obj["Body"].read()))
+    except Exception as e:
+        print(f"  Feedback cache unreadable ({e}) — downloading feedback.csv")
+        return None
+
+
+def fetch_feedback() -> pd.DataFrame:
+    """
+    Download feedback.csv unless it is unchanged since the last run.
+
+    The previous run's ETag is sent as IfNoneMatch; a 304 means the file
+    has not changed and the cached Parquet copy is used instead. After a
+    full download the Parquet copy and ETag are refreshed for next time.
+    Raises ClientError (e.g. NoSuchKey) if feedback.csv cannot be read.
+    """
+    try:
+        last_etag = s3.get_object(Bucket=FEEDBACK_BUCKET, Key=FEEDBACK_ETAG_KEY)["Body"].read().decode()
+    except ClientError:
+        last_etag = ""
+
+    if last_etag:
+        try:
+            obj = s3.get_object(Bucket=FEEDBACK_BUCKET, Key=FEEDBACK_KEY, IfNoneMatch=last_etag)
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("304", "NotModified"):
+                raise
+            cached = read_cached_feedback()
+            if cached is not None:
+                print(f"  Feedback unchanged (ETag {last_etag}) — using cached copy")
+                return cached
+            obj = s3.get_object(Bucket=FEEDBACK_BUCKET, Key=FEEDBACK_KEY)
+    else:
+        obj = s3.get_object(Bucket=FEEDBACK_BUCKET, Key=FEEDBACK_KEY)
+
+    # pyarrow's multi-threaded parser, on the fully downloaded body
+    feedback = pd.read_csv(io.BytesIO(obj["Body"].read()), engine="pyarrow")
+
+    try:
+        buf = io.BytesIO()
+        feedback.to_parquet(buf, index=False, compression="zstd")
+        buf.seek(0)
+        s3.upload_fileobj(buf, FEEDBACK_BUCKET, FEEDBACK_CACHE_KEY, Config=TRANSFER_CONFIG)
+        s3.put_object(Bucket=FEEDBACK_BUCKET, Key=FEEDBACK_ETAG_KEY, Body=obj["ETag"].encode())
+    except Exception as e:
+        print(f"  WARNING: could not refresh feedback cache ({e})")
+
+    return feedback
+
+
+def recent_feedback_filter(cutoff: pd.Timestamp) -> ds.Expression:
+    """
+    Recency filter over the partitioned store. The year/month terms are
+    evaluated against partition paths, so older month folders are pruned
+    before any file is opened; feedback_date then trims the boundary
+    month. Undated rows sit in the null partition and are always kept,
+    as on the CSV path.
+    """
+    year, month, date = ds.field("year"), ds.field("month"), ds.field("feedback_date")
+    recent_partition = (
+        year.is_null()
+        | (year > cutoff.year)
+        | ((year == cutoff.year) & (month >= cutoff.month))
+    )
+    return recent_partition & (date.is_null() | (date >= pa.scalar(cutoff.to_pydatetime(), pa.timestamp("us"))))
+
+
+def read_feedback_dataset() -> Optional[pd.DataFrame]:
+    """
+    Recent rows of the partitioned feedback store, or None if it is empty
+    or older than feedback.csv. Bytes read from S3 scale with
+    FEEDBACK_RECENCY_DAYS, not total history.
+
+    The store is only rebuilt by migrate_feedback.py, which re-exports all
+    of feedback.csv. Feedback appended to the CSV after the last migration
+    is not in the store, so the CSV is read instead until it is re-run.
+    """
+    prefix = FEEDBACK_DATASET_PREFIX.rstrip("/")
+    store_modified = max(
+        (
+            obj["LastModified"]
+            for page in s3.get_paginator("list_objects_v2").paginate(Bucket=FEEDBACK_BUCKET, Prefix=f"{prefix}/")
+            for obj in page.get("Contents", [])
+        ),
+        default=None,
+    )
+    if store_modified is None:
+        return None
+
+    try:
+        csv_modified = s3.head_object(Bucket=FEEDBACK_BUCKET, Key=FEEDBACK_KEY)["LastModified"]
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+            raise
+        csv_modified = None
+    if csv_modified is not None and csv_modified > store_modified:
+        print(
+            f"  WARNING: {FEEDBACK_KEY} (modified {csv_modified}) is newer than the feedback store "
+            f"(last written {store_modified}) — reading the CSV; re-run migrate_feedback.py"
+        )
+        return None
+
+    cutoff  = pd.Timestamp.now() - pd.Timedelta(days=FEEDBACK_RECENCY_DAYS)
+    dataset = ds.dataset(
+        f"{FEEDBACK_BUCKET}/{prefix}",
+        filesystem=pafs.S3FileSystem(),
+        format="parquet",
+        partitioning="hive",
+    )
+    table = dataset.to_table(filter=recent_feedback_filter(cutoff))
+    return table.to_pandas().drop(columns=["year", "month"])
+
+
 def load_feedback() -> Optional[pd.DataFrame]:
     """
-    Load feedback CSV from S3. Returns None gracefully if missing or empty.
+    Load feedback from S3 — the partitioned store when it has data and is
+    up to date with feedback.csv, else feedback.csv. Returns None gracefully if missing or empty.
     Validates required columns and applies recency filter.
     """
-    s3 = boto3.client("s3")
-
     try:
-        obj      = s3.get_object(Bucket=FEEDBACK_BUCKET, Key=FEEDBACK_KEY)
-        feedback = pd.read_csv(io.BytesIO(obj["Body"].read()))
-        print(f"Feedback loaded: {len(feedback)} rows from s3://{FEEDBACK_BUCKET}/{FEEDBACK_KEY}")
+        feedback = read_feedback_dataset()
+        source   = f"s3://{FEEDBACK_BUCKET}/{FEEDBACK_DATASET_PREFIX}"
+        if feedback is None:
+            feedback = fetch_feedback()
+            source   = f"s3://{FEEDBACK_BUCKET}/{FEEDBACK_KEY}"
+        print(f"Feedback loaded: {len(feedback)} rows from {source}")
     except Exception as e:
         print(f"No feedback available ({e}) — publishing recommendations unchanged")
         return None
@@ -135,46 +313,89 @@ def load_feedback() -> Optional[pd.DataFrame]:
 # WEIGHT RESOLUTION
 # ─────────────────────────────────────────────────
 
-def resolve_weight(rating: str, reason_code: str, sentiment: str) -> float:
+def _normalised(feedback: pd.DataFrame, col: Optional[str]) -> pd.Series:
+    """Stripped, lower-cased string column; missing column or NaN → ""."""
+    if col is None:
+        return pd.Series("", index=feedback.index)
+    return feedback[col].astype("string").fillna("").str.strip().str.lower()
+
+
+def resolve_weights(feedback: pd.DataFrame, reason_col: Optional[str], sentiment_col: Optional[str]) -> np.ndarray:
     """
-    Resolve the score multiplier for a single feedback row.
+    Resolve the score multiplier for every feedback row at once.
 
-    Priority order:
+    Priority order (first matching condition wins):
       1. High → always boost regardless of reason/sentiment
       2. Low  → always suppress regardless of reason/sentiment
       3. Medium + explicit sentiment column → use sentiment
       4. Medium + reason_code in known sets → infer sentiment
       5. Medium with no signal → neutral (WEIGHT_MED_POS)
+      6. Unknown rating → neutral (1.0)
 
     This implements PRD 5.8: "Medium positive retained, Medium negative filtered"
     with full reason code support.
     """
-    rating   = str(rating).strip().lower() if pd.notna(rating) else ""
-    reason   = str(reason_code).strip().lower() if pd.notna(reason_code) else ""
-    sent     = str(sentiment).strip().lower() if pd.notna(sentiment) else ""
-
-    if rating == "high":
-        return WEIGHT_HIGH
-
-    if rating == "low":
-        return WEIGHT_LOW
-
-    if rating == "medium":
-        # Explicit sentiment column takes priority
-        if sent == "positive":
-            return WEIGHT_MED_POS
-        if sent == "negative":
-            return WEIGHT_MED_NEG
-        # Infer from reason code
-        if reason in NEGATIVE_REASON_CODES:
-            return WEIGHT_MED_NEG
-        if reason in POSITIVE_REASON_CODES:
-            return WEIGHT_MED_POS
-        # Default Medium → neutral
-        return WEIGHT_MED_POS
-
-    # Unknown rating → neutral
-    return 1.0
+    rating = _normalised(feedback, "rating")
+    reason = _normalised(feedback, reason_col)
+    sent   = _normalised(feedback, sentiment_col)
+    medium = rating == "medium"
+
+    return np.select(
+        [
+            rating == "high",
+            rating == "low",
+            medium & (sent == "positive"),
+            medium & (sent == "negative"),
+            medium & reason.isin(NEGATIVE_REASON_CODES),
+            medium & reason.isin(POSITIVE_REASON_CODES),
+            medium,
+        ],
+        [
+            WEIGHT_HIGH,
+            WEIGHT_LOW,
+            WEIGHT_MED_POS,
+            WEIGHT_MED_NEG,
+            WEIGHT_MED_NEG,
+            WEIGHT_MED_POS,
+            WEIGHT_MED_POS,
+        ],
+        default=1.0,
+    )
+
+
+def with_weights(feedback: pd.DataFrame) -> pd.DataFrame:
+    """
+    feedback with a resolved "weight" column. main() resolves it once and
+    both the summary and the calibration reuse it; callers passing raw
+    feedback get it resolved here.
+    """
+    if "weight" in feedback.columns:
+        return feedback
+    reason_col    = "reason_code" if "reason_code" in feedback.columns else None
+    sentiment_col = "sentiment"   if "sentiment"   in feedback.columns else None
+    return feedback.assign(weight=resolve_weights(feedback, reason_col, sentiment_col))
+
+
+def pair_positions(left_cust: pd.Series, left_prod: pd.Series,
+                   right_cust: pd.Series, right_prod: pd.Series) -> np.ndarray:
+    """
+    Row position in the right frame of each left (customer, product) pair,
+    -1 where the pair is absent; the first match wins if the right side
+    repeats a pair. Both sides' ids are factorized together into one
+    packed int64 key, so the join compares integers instead of hashing
+    string pairs. Missing ids match each other, as they do in merge().
+    """
+    n = len(left_cust)
+    cust_codes, _            = pd.factorize(pd.concat([left_cust, right_cust], ignore_index=True), use_na_sentinel=False)
+    prod_codes, prod_uniques = pd.factorize(pd.concat([left_prod, right_prod], ignore_index=True), use_na_sentinel=False)
+    keys = cust_codes.astype(np.int64) * len(prod_uniques) + prod_codes
+    if len(keys) == n:
+        return np.full(n, -1)
+
+    order      = np.argsort(keys[n:], kind="stable")
+    right_keys = keys[n:][order]
+    pos        = np.minimum(np.searchsorted(right_keys, keys[:n]), len(right_keys) - 1)
+    return np.where(right_keys[pos] == keys[:n], order[pos], -1)
 
 
 # ─────────────────────────────────────────────────
@@ -209,20 +430,10 @@ def build_feedback_summary(feedback: pd.DataFrame, reco: pd.DataFrame) -> dict:
     if feedback is None or feedback.empty:
         return {}
 
-    rating_col   = "rating"
-    reason_col   = "reason_code" if "reason_code" in feedback.columns else None
-    sentiment_col = "sentiment"  if "sentiment"   in feedback.columns else None
+    reason_col = "reason_code" if "reason_code" in feedback.columns else None
 
     # Map each row to a resolved weight
-    feedback = feedback.copy()
-    feedback["weight"] = feedback.apply(
-        lambda r: resolve_weight(
-            r[rating_col],
-            r[reason_col] if reason_col else "",
-            r[sentiment_col] if sentiment_col else "",
-        ),
-        axis=1,
-    )
+    feedback = with_weights(feedback)
 
     total = len(feedback)
 
@@ -237,45 +448,38 @@ def build_feedback_summary(feedback: pd.DataFrame, reco: pd.DataFrame) -> dict:
         "low_rate":              rate(feedback["rating"].str.lower() == "low"),
     }
 
+    # Each feedback row's recommendation, looked up once for both breakdowns
+    # (-1 → no matching recommendation; reindex turns it into NaN, which
+    # groupby drops)
+    reco_pos = pair_positions(
+        feedback["customer_id"], feedback["product_id"],
+        reco["customer_id"], reco["recommended_product"],
+    )
+    accepted = (feedback["weight"] >= WEIGHT_MED_POS).to_numpy()
+
+    def acceptance_by(col: str) -> dict:
+        """{value of reco[col]: {"n", "acceptance_rate"}} in one grouped aggregation."""
+        keys  = reco[col].reset_index(drop=True).reindex(reco_pos).to_numpy()
+        stats = pd.Series(accepted).groupby(keys, sort=False).agg(n="size", acceptance_rate="mean")
+        stats["acceptance_rate"] = stats["acceptance_rate"].round(4)
+        return stats.to_dict("index")
+
     # Per-segment acceptance rates
-    by_segment = {}
-    if "segment" in reco.columns:
-        merged = feedback.merge(
-            reco[["customer_id", "recommended_product", "segment"]].rename(
-                columns={"recommended_product": "product_id"}
-            ),
-            on=["customer_id", "product_id"], how="left"
-        )
-        for seg, grp in merged.groupby("segment"):
-            by_segment[seg] = {
-                "n": len(grp),
-                "acceptance_rate": round((grp["weight"] >= WEIGHT_MED_POS).mean(), 4)
-            }
+    by_segment = acceptance_by("segment") if "segment" in reco.columns else {}
 
     # Per-L2 category acceptance rates
     by_l2 = {}
     if "l2_category" in reco.columns:
-        merged_l2 = feedback.merge(
-            reco[["customer_id", "recommended_product", "l2_category"]].rename(
-                columns={"recommended_product": "product_id"}
-            ),
-            on=["customer_id", "product_id"], how="left"
-        )
-        for l2, grp in merged_l2.groupby("l2_category"):
-            by_l2[str(l2)] = {
-                "n": len(grp),
-                "acceptance_rate": round((grp["weight"] >= WEIGHT_MED_POS).mean(), 4)
-            }
+        by_l2 = {str(l2): stats for l2, stats in acceptance_by("l2_category").items()}
 
     # Reason code distribution
+    # Counted with missing codes included, then relabelled, rather than
+    # filling a copy of the whole column first
     reason_dist = {}
     if reason_col:
-        reason_dist = (
-            feedback[reason_col]
-            .fillna("not_provided")
-            .value_counts()
-            .to_dict()
-        )
+        for code, count in feedback[reason_col].value_counts(dropna=False).items():
+            code = "not_provided" if pd.isna(code) else code
+            reason_dist[code] = reason_dist.get(code, 0) + int(count)
 
     # Threshold suggestions
     # If overall acceptance rate is below 0.5, suggest tightening MIN_CONFIDENCE
@@ -325,19 +529,8 @@ def apply_calibration(reco: pd.DataFrame, feedback: pd.DataFrame) -> pd.DataFram
     feedback["customer_id"] = feedback["customer_id"].astype(str)
     feedback["product_id"]  = feedback["product_id"].astype(str)
 
-    rating_col    = "rating"
-    reason_col    = "reason_code" if "reason_code" in feedback.columns else None
-    sentiment_col = "sentiment"   if "sentiment"   in feedback.columns else None
-
-    # Resolve weight per feedback row
-    feedback["weight"] = feedback.apply(
-        lambda r: resolve_weight(
-            r[rating_col],
-            r[reason_col] if reason_col else "",
-            r[sentiment_col] if sentiment_col else "",
-        ),
-        axis=1,
-    )
+    # Resolve weight per feedback row (already done once by main())
+    feedback = with_weights(feedback)
 
     # Deduplicate feedback: one row per customer × product
     # If multiple feedback rows exist for the same pair, take the most recent
@@ -350,16 +543,14 @@ def apply_calibration(reco: pd.DataFrame, feedback: pd.DataFrame) -> pd.DataFram
     else:
         feedback = feedback.drop_duplicates(subset=["customer_id", "product_id"])
 
-    # Join weights onto recommendations
-    df = reco.merge(
-        feedback[["customer_id", "product_id", "weight", rating_col]
-                 + ([reason_col] if reason_col else [])
-                 + ([sentiment_col] if sentiment_col else [])],
-        how="left",
-        left_on=["customer_id", "recommended_product"],
-        right_on=["customer_id", "product_id"],
+    # Look up each recommendation's feedback weight — only the weight is
+    # carried over, so a code lookup replaces the two-key string merge
+    fb_pos = pair_positions(
+        reco["customer_id"], reco["recommended_product"],
+        feedback["customer_id"], feedback["product_id"],
     )
-
+    df = reco.reset_index(drop=True)
+    df["weight"] = feedback["weight"].reset_index(drop=True).reindex(fb_pos).to_numpy()
     df["weight"] = df["weight"].fillna(1.0)   # no feedback → unchanged
     df["score"]  = df["score"] * df["weight"]
 
@@ -370,19 +561,15 @@ def apply_calibration(reco: pd.DataFrame, feedback: pd.DataFrame) -> pd.DataFram
     if removed:
         print(f"  Removed {removed} recommendations below SCORE_CUTOFF={SCORE_CUTOFF} after calibration")
 
-    # Re-rank within each customer
-    df["rank"] = (
-        df.groupby("customer_id")["score"]
-        .rank(ascending=False, method="first")
-        .astype(int)
-    )
-    df = df[df["rank"] <= TOP_K]
+    # Re-rank within each customer — one stable global sort, then the
+    # first TOP_K rows of each customer run. Stable, so equal scores keep
+    # their incoming order, as rank(method="first") did. Output rows come
+    # out ordered by (customer_id, rank), like the ranking step's output.
+    df = df.sort_values(["customer_id", "score"], ascending=[True, False], kind="stable")
+    df = df.groupby("customer_id", sort=False).head(TOP_K)
+    df["rank"] = df.groupby("customer_id", sort=False).cumcount() + 1
 
-    # Clean up merge artifacts
-    drop_cols = ["product_id", "weight", rating_col]
-    if reason_col:    drop_cols.append(reason_col)
-    if sentiment_col: drop_cols.append(sentiment_col)
-    df = df.drop(columns=[c for c in drop_cols if c in df.columns], errors="ignore")
+    df = df.drop(columns=["weight"])
 
     return df
 
@@ -393,11 +580,12 @@ def apply_calibration(reco: pd.DataFrame, feedback: pd.DataFrame) -> pd.DataFram
 
 def save_and_publish(df: pd.DataFrame, summary: dict) -> None:
     """
-    Write final recommendations CSV and feedback summary JSON.
+    Write final recommendations (CSV and Parquet) and feedback summary JSON.
     Validates file size before publishing to prevent corrupt uploads.
     """
     Path("/opt/ml/processing/output").mkdir(parents=True, exist_ok=True)
     df.to_csv(OUTPUT_FILE, index=False)
+    df.to_parquet(OUTPUT_PARQUET_FILE, engine="pyarrow", compression="zstd", use_dictionary=True, index=False)
 
     file_size = os.path.getsize(OUTPUT_FILE)
     if file_size == 0:
@@ -407,12 +595,17 @@ def save_and_publish(df: pd.DataFrame, summary: dict) -> None:
 
     print(f"  Output file: {file_size:,} bytes")
 
-    s3 = boto3.client("s3")
-
     # Publish recommendations CSV
-    s3.upload_file(OUTPUT_FILE, BUCKET, FINAL_KEY)
+    s3.upload_file(
+        OUTPUT_FILE, BUCKET, FINAL_KEY,
+        ExtraArgs={"ContentType": "text/csv"},
+        Config=TRANSFER_CONFIG,
+    )
     print(f"  Published: s3://{BUCKET}/{FINAL_KEY}")
 
+    s3.upload_file(OUTPUT_PARQUET_FILE, BUCKET, FINAL_PARQUET_KEY, Config=TRANSFER_CONFIG)
+    print(f"  Published: s3://{BUCKET}/{FINAL_PARQUET_KEY}  ({os.path.getsize(OUTPUT_PARQUET_FILE):,} bytes)")
+
     # Publish feedback summary JSON — consumed by next pipeline run
     if summary:
         summary_bytes = json.dumps(summary, indent=2).encode("utf-8")
@@ -444,7 +637,7 @@ def main():
     print(f"  FEEDBACK_RECENCY : {FEEDBACK_RECENCY_DAYS} days")
     print("=" * 60)
 
-    reco = pd.read_csv("/opt/ml/processing/input/ranking/recommendations.csv")
+    reco = load_recommendations()
     print(f"Loaded {len(reco)} recommendations for {reco['customer_id'].nunique()} customers")
 
     feedback = load_feedback()
@@ -454,6 +647,9 @@ def main():
         save_and_publish(reco, {})
         return
 
+    # Resolve per-row weights once for both the summary and the calibration
+    feedback = with_weights(feedback)
+
     # Build summary BEFORE calibration (so it reflects raw feedback signal)
     summary = build_feedback_summary(feedback, reco)
 
@@ -2,14 +2,30 @@ import io
 import json
 import os
 import pickle
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import boto3
 import numpy as np
 import pandas as pd
+from botocore.config import Config
 
 RECO_BUCKET = os.environ.get("RECO_BUCKET", "ipre-prod-poc")
-RECO_KEY    = os.environ.get("RECO_KEY",    "final/recommendations.csv")
+RECO_KEY    = os.environ.get("RECO_KEY",    "final/recommendations.parquet")
+
+# Ranged-GET fan-out for the recommendations file at cold start — a
+# single S3 stream tops out well below the instance's network bandwidth
+S3_CHUNK_BYTES = 8 * 1024 * 1024
+S3_WORKERS     = 16
+
+# One client for the container's lifetime — created once at import, reused
+# by every load and thread (boto3 clients are thread-safe). The pool is
+# sized for the ranged-GET workers.
+s3 = boto3.client("s3", config=Config(
+    max_pool_connections=2 * S3_WORKERS,
+    tcp_keepalive=True,
+    retries={"mode": "adaptive", "total_max_attempts": 5},
+))
 
 
 # ==========================================================
@@ -27,8 +43,8 @@ def model_fn(model_dir: str) -> dict:
     with open(manifest_path) as f:
         registry = json.load(f)
 
-    models = {}
-    for segment, meta in registry.items():
+    def load_segment(item):
+        segment, meta = item
         with open(model_dir / meta["model_file"],  "rb") as f:
             kmeans = pickle.load(f)
         with open(model_dir / meta["scaler_file"], "rb") as f:
@@ -36,25 +52,53 @@ def model_fn(model_dir: str) -> dict:
         with open(model_dir / meta["cols_file"]) as f:
             cols = json.load(f)
 
-        models[segment] = {
+        return segment, {
             "kmeans": kmeans,
             "scaler": scaler,
             "feature_cols": cols,
         }
 
-    print(f"Loaded {len(models)} segment models")
+    # Segment files are read on a thread pool so their disk reads overlap,
+    # and the recommendations download runs alongside them
+    with ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4)) as pool:
+        reco_future = pool.submit(_load_recommendations)
+        models      = dict(pool.map(load_segment, registry.items()))
+        print(f"Loaded {len(models)} segment models")
+        reco_df     = reco_future.result()
+
+    reco_index = _index_recommendations(reco_df)
+
+    return {"models": models, "reco_df": reco_df, "reco_index": reco_index, "registry": registry}
+
+
+def _s3_get_parallel(bucket: str, key: str) -> bytes:
+    """
+    Download an S3 object as concurrent ranged GETs of S3_CHUNK_BYTES,
+    reassembled in order. Objects of one chunk or less take a single GET.
+    """
+    size   = s3.head_object(Bucket=bucket, Key=key)["ContentLength"]
+    ranges = [(start, min(start + S3_CHUNK_BYTES, size) - 1) for start in range(0, size, S3_CHUNK_BYTES)]
+    if len(ranges) <= 1:
+        return s3.get_object(Bucket=bucket, Key=key)["Body"].read()
 
-    reco_df = _load_recommendations()
+    def fetch(byte_range):
+        start, end = byte_range
+        return s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end}")["Body"].read()
 
-    return {"models": models, "reco_df": reco_df, "registry": registry}
+    with ThreadPoolExecutor(max_workers=S3_WORKERS) as pool:
+        return b"".join(pool.map(fetch, ranges))
 
 
 def _load_recommendations() -> pd.DataFrame:
     print(f"Loading recommendations from s3://{RECO_BUCKET}/{RECO_KEY}")
     try:
-        s3  = boto3.client("s3")
-        obj = s3.get_object(Bucket=RECO_BUCKET, Key=RECO_KEY)
-        df  = pd.read_csv(io.BytesIO(obj["Body"].read()))
+        # Parquet is decoded column-wise with no text parsing; a .csv key
+        # (endpoints configured before the Parquet copy existed) still works
+        body = io.BytesIO(_s3_get_parallel(RECO_BUCKET, RECO_KEY))
+        if RECO_KEY.endswith(".parquet"):
+            df = pd.read_parquet(body)
+        else:
+            df = pd.read_csv(body, engine="pyarrow")
         df["customer_id"] = df["customer_id"].astype(str)
         print(f"Recommendations loaded: {len(df)} rows, {df['customer_id'].nunique()} customers")
         return df
@@ -63,6 +107,39 @@ def _load_recommendations() -> pd.DataFrame:
         return pd.DataFrame()
 
 
+RECO_FIELDS = ["rank", "recommended_product", "trigger_product",
+               "score", "recommended_qty", "reason", "cluster_id", "segment"]
+
+
+def _index_recommendations(reco_df: pd.DataFrame) -> dict:
+    """
+    customer_id → precomputed response body (segment, cluster_id and the
+    rank-ordered recommendation records), built once at startup so a
+    request is a dict lookup rather than a scan of the whole frame.
+    Segment and cluster come from the customer's first row in file order.
+    """
+    if reco_df.empty:
+        return {}
+
+    first = reco_df.drop_duplicates("customer_id").set_index("customer_id")
+    ranked = (
+        reco_df
+        .sort_values("rank", kind="stable")
+        [["customer_id"] + RECO_FIELDS]
+        .rename(columns={"recommended_product": "product_id"})
+    )
+
+    index = {}
+    for customer_id, recs in ranked.groupby("customer_id", sort=False):
+        index[customer_id] = {
+            "segment":         first.at[customer_id, "segment"],
+            "cluster_id":      first.at[customer_id, "cluster_id"],
+            "recommendations": recs.drop(columns="customer_id").to_dict(orient="records"),
+        }
+    print(f"Indexed recommendations for {len(index)} customers")
+    return index
+
+
 # ==========================================================
 # input_fn — parse JSON
 # ==========================================================
@@ -86,27 +163,16 @@ def _predict_one(input_data: dict, model: dict) -> dict:
     if not customer_id:
         return {"error": "Missing customer_id"}
 
-    reco_df = model["reco_df"]
-
     # -------- PATH 1: Precomputed recommendations --------
-    if not reco_df.empty:
-        cust_recs = reco_df[reco_df["customer_id"] == customer_id]
-        if not cust_recs.empty:
-            recs = (
-                cust_recs
-                .sort_values("rank")
-                [["rank", "recommended_product", "trigger_product",
-                  "score", "recommended_qty", "reason", "cluster_id", "segment"]]
-                .rename(columns={"recommended_product": "product_id"})
-                .to_dict(orient="records")
-            )
-            return {
-                "customer_id":     customer_id,
-                "segment":         cust_recs["segment"].iloc[0],
-                "cluster_id":      cust_recs["cluster_id"].iloc[0],
-                "source":          "precomputed",
-                "recommendations": recs,
-            }
+    cust_recs = model["reco_index"].get(customer_id)
+    if cust_recs is not None:
+        return {
+            "customer_id":     customer_id,
+            "segment":         cust_recs["segment"],
+            "cluster_id":      cust_recs["cluster_id"],
+            "source":          "precomputed",
+            "recommendations": cust_recs["recommendations"],
+        }
 
     # -------- PATH 2: Real-time assignment --------
     if not segment:
@@ -23,7 +23,12 @@ customer × product with full purchase behaviour features:
   Category hierarchy (passed through for clustering and ranking):
     - brand, l2_category, l3_category, functionality
 
-Configurable via environment variables (set by pipeline.py as Processing env):
+Runs inside the ClusteringTrain job (train_clustering.py imports
+build_market_basket); main() keeps it runnable as a standalone Processing
+script for debugging.
+
+Configurable via environment variables (or SM_HP_* hyperparameters when
+run from train_clustering.py):
   MIN_ORDER_COUNT     : exclude customers with fewer invoices (default 1)
   RECENCY_CUTOFF_DAYS : ignore invoices older than N days (default 730 = 2 years)
 """
@@ -39,13 +44,15 @@ from pathlib import Path
 CUSTOMERS_PATH = "/opt/ml/processing/input/customers/customer.csv"
 PRODUCTS_PATH  = "/opt/ml/processing/input/products/product.csv"
 INVOICES_PATH  = "/opt/ml/processing/input/invoices/invoice.csv"
-OUTPUT_PATH    = "/opt/ml/processing/output/market_basket.csv"
+OUTPUT_PATH    = "/opt/ml/processing/output/market_basket.csv"       # ClusteringTrain (text/csv channel)
+PARQUET_PATH   = "/opt/ml/processing/output/market_basket.parquet"   # MineAndRank
 
 # --------------------------------------------------
 # Config — overridable via environment variables
 # --------------------------------------------------
-MIN_ORDER_COUNT     = int(os.environ.get("MIN_ORDER_COUNT",     "1"))
-RECENCY_CUTOFF_DAYS = int(os.environ.get("RECENCY_CUTOFF_DAYS", "730"))
+# Inside the clustering training job the same values arrive as SM_HP_* hyperparameters
+MIN_ORDER_COUNT     = int(os.environ.get("MIN_ORDER_COUNT",     os.environ.get("SM_HP_MIN_ORDER_COUNT",     "1")))
+RECENCY_CUTOFF_DAYS = int(os.environ.get("RECENCY_CUTOFF_DAYS", os.environ.get("SM_HP_RECENCY_CUTOFF_DAYS", "730")))
 
 
 # ─────────────────────────────────────────────────
@@ -78,24 +85,17 @@ def assign_price_band(prices: pd.Series) -> pd.Series:
 
 
 # ─────────────────────────────────────────────────
-# MAIN
+# MARKET BASKET
 # ─────────────────────────────────────────────────
 
-def main():
-
-    print("=" * 60)
-    print("IPRE — Market Basket Creation")
-    print(f"  MIN_ORDER_COUNT     : {MIN_ORDER_COUNT}")
-    print(f"  RECENCY_CUTOFF_DAYS : {RECENCY_CUTOFF_DAYS}")
-    print("=" * 60)
-
-    # --------------------------------------------------
-    # Load raw inputs
-    # --------------------------------------------------
-    customers = pd.read_csv(CUSTOMERS_PATH)
-    products  = pd.read_csv(PRODUCTS_PATH)
-    invoices  = pd.read_csv(INVOICES_PATH)
+def build_market_basket(customers: pd.DataFrame, products: pd.DataFrame, invoices: pd.DataFrame) -> pd.DataFrame:
+    """
+    Join, filter and aggregate the raw inputs into the market basket —
+    one row per customer × product with the features listed above.
 
+    Called by main() for the standalone step and by train_clustering.py,
+    which builds the basket in the training container before clustering.
+    """
     print(f"Raw counts — invoices:{len(invoices)}  products:{len(products)}  customers:{len(customers)}")
 
     # --------------------------------------------------
@@ -203,7 +203,7 @@ def main():
     # one-time buyers whose patterns are too thin for reliable
     # clustering and association mining.
     # --------------------------------------------------
-    invoice_counts = df.groupby("customer_id")["invoice_date"].nunique()
+    invoice_counts = df.groupby("customer_id", sort=False)["invoice_date"].nunique()
     valid_customers = invoice_counts[invoice_counts >= MIN_ORDER_COUNT].index
     before_filter   = df["customer_id"].nunique()
     df = df[df["customer_id"].isin(valid_customers)]
@@ -215,17 +215,12 @@ def main():
             "Try reducing the threshold."
         )
 
-    # --------------------------------------------------
-    # Segment derivation
-    # --------------------------------------------------
-    df["segment"] = df["region"] + "_" + df["end_use"]
-
     # --------------------------------------------------
     # CORE AGGREGATION — customer × product
     # --------------------------------------------------
     grouped = (
         df.groupby(
-            ["customer_id", "segment", "region", "end_use",
+            ["customer_id", "region", "end_use",
              "product_id", "brand", "l2_category", "l3_category", "functionality"]
             + (["in_stock"] if "in_stock" in df.columns else []),
             dropna=False,
@@ -239,6 +234,14 @@ def main():
         .reset_index()
     )
 
+    # --------------------------------------------------
+    # Segment derivation
+    # Built on the aggregated customer × product rows rather than on every
+    # invoice line — it is a label, not a grouping key: region and end_use
+    # already group the rows it would.
+    # --------------------------------------------------
+    grouped.insert(1, "segment", grouped["region"] + "_" + grouped["end_use"])
+
     grouped["recency_days"] = (ref_date - grouped["last_purchase_date"]).dt.days.fillna(0).astype(int)
     grouped = grouped.drop(columns=["last_purchase_date"])
 
@@ -249,7 +252,7 @@ def main():
     # Monetary : total spend across all products
     # --------------------------------------------------
     rfm = (
-        df.groupby("customer_id")
+        df.groupby("customer_id", sort=False)
         .agg(
             rfm_recency=("invoice_date",  lambda x: (ref_date - x.max()).days),
             rfm_frequency=("invoice_date", "nunique"),
@@ -273,7 +276,7 @@ def main():
     # --------------------------------------------------
     if has_price:
         unit_price_ref = (
-            df.groupby(["customer_id", "product_id", "region", "end_use"])["unit_price"]
+            df.groupby(["customer_id", "product_id", "region", "end_use"], sort=False)["unit_price"]
             .mean()
             .reset_index()
             .rename(columns={"unit_price": "mean_unit_price"})
@@ -282,7 +285,7 @@ def main():
             unit_price_ref, on=["customer_id", "product_id"], how="left"
         )
         grouped["price_band"] = (
-            grouped.groupby(["region", "end_use"])["mean_unit_price"]
+            grouped.groupby(["region", "end_use"], sort=False)["mean_unit_price"]
             .transform(assign_price_band)
             .astype(str)
             .fillna("Mid")
@@ -299,12 +302,22 @@ def main():
     if grouped.empty:
         raise ValueError("Market basket is empty after all processing steps.")
 
-    # --------------------------------------------------
-    # Save
-    # --------------------------------------------------
-    Path("/opt/ml/processing/output").mkdir(parents=True, exist_ok=True)
-    grouped.to_csv(OUTPUT_PATH, index=False)
+    return grouped
 
+
+# ─────────────────────────────────────────────────
+# MAIN
+# ─────────────────────────────────────────────────
+
+def print_config():
+    print("=" * 60)
+    print("IPRE — Market Basket Creation")
+    print(f"  MIN_ORDER_COUNT     : {MIN_ORDER_COUNT}")
+    print(f"  RECENCY_CUTOFF_DAYS : {RECENCY_CUTOFF_DAYS}")
+    print("=" * 60)
+
+
+def print_summary(grouped: pd.DataFrame):
     print("\n=== Market Basket Summary ===")
     print(f"  Rows          : {len(grouped)}")
     print(f"  Customers     : {grouped['customer_id'].nunique()}")
@@ -314,6 +327,28 @@ def main():
     print(f"  L2 categories : {grouped['l2_category'].nunique()}")
     print(f"  L3 categories : {grouped['l3_category'].nunique()}")
     print(f"  Price bands   : {grouped['price_band'].value_counts().to_dict()}")
+
+
+def main():
+    print_config()
+
+    # --------------------------------------------------
+    # Load raw inputs
+    # --------------------------------------------------
+    customers = pd.read_csv(CUSTOMERS_PATH)
+    products  = pd.read_csv(PRODUCTS_PATH)
+    invoices  = pd.read_csv(INVOICES_PATH)
+
+    grouped = build_market_basket(customers, products, invoices)
+
+    # --------------------------------------------------
+    # Save
+    # --------------------------------------------------
+    Path("/opt/ml/processing/output").mkdir(parents=True, exist_ok=True)
+    grouped.to_csv(OUTPUT_PATH, index=False)
+    grouped.to_parquet(PARQUET_PATH, engine="pyarrow", compression="snappy", index=False)
+
+    print_summary(grouped)
     print("\nMarket basket complete.")
 
 
@@ -38,14 +38,25 @@ Configurable via environment variables:
   W_RECENCY            : recency weight (default 0.15)
   MAX_LIFT_NORMALISE   : lift normalisation ceiling (default 5.0)
   L3_TIEBREAK_MARGIN   : score margin within which L3 affinity breaks ties (default 0.02)
+  RECOMMENDATIONS_S3_PREFIX : when set (e.g. s3://bucket/ranking), recommendations.parquet
+                         is streamed to a per-run key under it via multipart upload
+                         and only a pointer file is written locally (default: unset)
 """
 
+import json
 import os
+import shutil
 import sys
 import traceback
 import tarfile
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import boto3
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 from pathlib import Path
 
 # --------------------------------------------------
@@ -61,6 +72,18 @@ W_LIFT              = float(os.environ.get("W_LIFT",              "0.20"))
 W_RECENCY           = float(os.environ.get("W_RECENCY",           "0.15"))
 MAX_LIFT_NORMALISE  = float(os.environ.get("MAX_LIFT_NORMALISE",  "5.0"))
 L3_TIEBREAK_MARGIN  = float(os.environ.get("L3_TIEBREAK_MARGIN",  "0.02"))
+RECOMMENDATIONS_S3_PREFIX = os.environ.get("RECOMMENDATIONS_S3_PREFIX", "")
+
+OUTPUT_DIR        = Path("/opt/ml/processing/output")
+UPLOAD_PART_BYTES = 16 * 1024 * 1024   # S3 multipart parts must be >= 5 MB (except the last)
+UPLOAD_CHUNK_ROWS = 250_000            # Parquet row group size when streaming
+
+RECOMMENDATION_COLUMNS = [
+    "customer_id", "recommended_product", "cluster_id", "segment",
+    "l2_category", "l3_category", "trigger_product",
+    "support", "confidence", "lift", "score",
+    "recommended_qty", "reason",
+]
 
 # Validate weights sum to 1.0 — warn but don't crash, normalise instead
 _weight_sum = W_CONF + W_SUPP + W_LIFT + W_RECENCY
@@ -94,98 +117,97 @@ def extract_clustering_output(clustering_dir: str) -> Path:
             )
         model_tar = candidates[0]
 
+    # Only the cluster assignments are needed; the model pickles are skipped
     print(f"Extracting {model_tar} ...")
     with tarfile.open(model_tar, "r:gz") as tar:
-        tar.extractall(path=clustering_path)
+        for member in tar:
+            if member.isfile() and Path(member.name).name == "customer_clusters.csv":
+                with tar.extractfile(member) as src, open(csv_direct, "wb") as dst:
+                    shutil.copyfileobj(src, dst)
+                break
 
-    csv_files = list(clustering_path.rglob("customer_clusters.csv"))
-    if not csv_files:
-        raise FileNotFoundError(
-            f"customer_clusters.csv not found after extracting {model_tar}.\n"
-            f"Contents: {list(clustering_path.rglob('*'))}"
-        )
-    return csv_files[0].parent
+    if not csv_direct.exists():
+        raise FileNotFoundError(f"customer_clusters.csv not found in {model_tar}")
+    return clustering_path
 
 
 # ─────────────────────────────────────────────────
 # HELPERS
 # ─────────────────────────────────────────────────
 
-def build_quantity_lookup(basket: pd.DataFrame) -> dict:
+def build_quantity_lookup(basket: pd.DataFrame) -> pd.DataFrame:
     """
     Pre-compute median per-order quantity per (customer_id, product_id).
-    O(1) lookup during recommendation loop — avoids O(n*rules) DataFrame ops.
+    Returns columns customer_id, product_id, qty — joined onto candidate
+    rules by trigger product instead of looked up row by row.
     """
-    qty_map = {}
-    for (cust, prod), g in basket.groupby(["customer_id", "product_id"]):
-        per_order = g["total_quantity"] / g["purchase_frequency"].replace(0, 1)
-        qty_map[(cust, prod)] = int(max(1, round(per_order.median())))
-    return qty_map
+    per_order = basket["total_quantity"] / basket["purchase_frequency"].replace(0, 1)
+    median    = per_order.groupby([basket["customer_id"], basket["product_id"]], sort=False).median()
+    return (
+        np.maximum(1, np.round(median)).astype(int)
+        .rename("qty")
+        .reset_index()
+    )
 
 
-def build_customer_l3_affinity(basket: pd.DataFrame) -> dict:
+def build_customer_l3_affinity(basket: pd.DataFrame) -> pd.DataFrame:
     """
     For each customer, compute which L3 categories they buy most frequently.
-    Returns dict: customer_id → {l3_category: proportion_of_purchases}
+    Returns columns customer_id, l3_category, proportion (of purchases).
 
-    Used for L3-aware tiebreaking and category-aware fallback.
+    Used for L3-aware tiebreaking.
     """
     if "l3_category" not in basket.columns:
-        return {}
+        return pd.DataFrame(columns=["customer_id", "l3_category", "proportion"])
 
     l3_freq = (
-        basket.groupby(["customer_id", "l3_category"])["purchase_frequency"]
+        basket.groupby(["customer_id", "l3_category"], sort=False)["purchase_frequency"]
         .sum()
         .reset_index()
     )
-    l3_freq["total"] = l3_freq.groupby("customer_id")["purchase_frequency"].transform("sum")
+    l3_freq["total"] = l3_freq.groupby("customer_id", sort=False)["purchase_frequency"].transform("sum")
     l3_freq["proportion"] = l3_freq["purchase_frequency"] / l3_freq["total"].replace(0, 1)
 
-    affinity = {}
-    for cust, grp in l3_freq.groupby("customer_id"):
-        affinity[cust] = dict(zip(grp["l3_category"], grp["proportion"]))
-    return affinity
+    return l3_freq[["customer_id", "l3_category", "proportion"]]
 
 
-def build_l2_affinity(basket: pd.DataFrame) -> dict:
+def build_l2_affinity(basket: pd.DataFrame) -> pd.DataFrame:
     """
     Per customer, proportion of total_quantity in each l2_category.
+    Returns columns customer_id, l2_category, affinity.
     Used to score fallback candidates by category relevance.
     """
     l2_freq = (
-        basket.groupby(["customer_id", "l2_category"])["total_quantity"]
+        basket.groupby(["customer_id", "l2_category"], sort=False)["total_quantity"]
         .sum()
         .reset_index()
     )
-    l2_freq["total"] = l2_freq.groupby("customer_id")["total_quantity"].transform("sum")
-    l2_freq["proportion"] = l2_freq["total_quantity"] / l2_freq["total"].replace(0, 1)
+    l2_freq["total"] = l2_freq.groupby("customer_id", sort=False)["total_quantity"].transform("sum")
+    l2_freq["affinity"] = l2_freq["total_quantity"] / l2_freq["total"].replace(0, 1)
 
-    affinity = {}
-    for cust, grp in l2_freq.groupby("customer_id"):
-        affinity[cust] = dict(zip(grp["l2_category"], grp["proportion"]))
-    return affinity
+    return l2_freq[["customer_id", "l2_category", "affinity"]]
 
 
-def normalise_lift(lift: float) -> float:
+def normalise_lift(lift: np.ndarray) -> np.ndarray:
     """
     Normalise lift to [0,1] contribution to score.
     lift=1 → 0.0 (no signal above base rate)
     lift=MAX_LIFT_NORMALISE → 1.0 (maximum signal)
     lift < 1 → 0.0 (negative association, shouldn't appear after filtering)
     """
-    return float(np.clip((lift - 1.0) / (MAX_LIFT_NORMALISE - 1.0), 0.0, 1.0))
+    return np.clip((lift - 1.0) / (MAX_LIFT_NORMALISE - 1.0), 0.0, 1.0)
 
 
-def score_rule(confidence: float, support: float, lift: float, recency_score: float) -> float:
+def score_rule(confidence: np.ndarray, support: np.ndarray, lift: np.ndarray, recency_score: np.ndarray) -> np.ndarray:
     """
-    Composite recommendation score.
+    Composite recommendation score, element-wise over candidate arrays.
     All components are bounded [0,1] before weighting.
     """
     return (
-        W_CONF    * float(np.clip(confidence, 0, 1)) +
-        W_SUPP    * float(np.clip(support,    0, 1)) +
+        W_CONF    * np.clip(confidence, 0, 1) +
+        W_SUPP    * np.clip(support,    0, 1) +
         W_LIFT    * normalise_lift(lift) +
-        W_RECENCY * float(np.clip(recency_score, 0, 1))
+        W_RECENCY * np.clip(recency_score, 0, 1)
     )
 
 
@@ -196,13 +218,12 @@ def score_rule(confidence: float, support: float, lift: float, recency_score: fl
 def category_aware_fallback(
     df: pd.DataFrame,
     basket: pd.DataFrame,
-    products: pd.DataFrame,
-    uncovered_customers: list,
-    bought_map: dict,
-    l2_affinity: dict,
+    customers: list,
+    bought_pairs: pd.DataFrame,
+    l2_affinity: pd.DataFrame,
     in_stock_ids: set,
-    existing_recs: dict,
-) -> list:
+    existing_recs: pd.DataFrame,
+) -> pd.DataFrame:
     """
     For customers with no association-based recommendations, generate
     fallback recommendations ranked by category affinity.
@@ -215,9 +236,10 @@ def category_aware_fallback(
     This ensures the fallback is personalised to each customer's category
     mix rather than just returning the most popular products in the segment.
 
-    Still filters: already purchased, out-of-stock, already recommended.
+    Still filters: already purchased, out-of-stock, already recommended
+    (existing_recs rows). All customers are handled in one candidate table.
     """
-    print(f"Applying category-aware fallback for {len(uncovered_customers)} customers...")
+    print(f"Applying category-aware fallback for {len(customers)} customers...")
 
     # Segment-level product popularity as secondary sort signal
     # (used when two products have equal affinity score)
@@ -227,8 +249,10 @@ def category_aware_fallback(
         .reset_index()
         .rename(columns={"purchase_frequency": "seg_popularity"})
     )
+    seg_popularity["pool_pos"] = np.arange(len(seg_popularity))
+    seg_popularity = seg_popularity[seg_popularity["product_id"].isin(in_stock_ids)]
 
-    # Product → L2 category lookup
+    # Product → L2 / L3 category lookup
     prod_l2 = {}
     prod_l3 = {}
     if "l2_category" in basket.columns:
@@ -238,97 +262,71 @@ def category_aware_fallback(
         l3_ref = basket[["product_id", "l3_category"]].drop_duplicates("product_id")
         prod_l3 = dict(zip(l3_ref["product_id"], l3_ref["l3_category"]))
 
-    rows = []
-
-    for cust in uncovered_customers:
-        cust_rows = df[df["customer_id"] == cust]
-        if cust_rows.empty:
-            continue
-
-        segment = cust_rows["segment"].iloc[0]
-        cluster = cust_rows["cluster_id"].iloc[0]
-        bought  = bought_map.get(cust, set())
-        already = existing_recs.get(cust, set())
-        cust_l2 = l2_affinity.get(cust, {})
-
-        # Already-recommended products from association path
-        exclude = bought | already
-
-        # Candidate pool: segment products not yet recommended/bought,
-        # in stock, not already purchased
-        seg_pool = seg_popularity[seg_popularity["segment"] == segment].copy()
-        seg_pool = seg_pool[
-            seg_pool["product_id"].isin(in_stock_ids) &
-            ~seg_pool["product_id"].isin(exclude)
-        ]
-
-        if seg_pool.empty:
-            continue
-
-        # Compute category affinity score per candidate product
-        seg_pool["affinity"] = seg_pool["product_id"].map(
-            lambda pid: cust_l2.get(prod_l2.get(pid, ""), 0.0)
-        )
-
-        # Sort: primary = affinity (desc), secondary = segment popularity (desc)
-        seg_pool = seg_pool.sort_values(
-            ["affinity", "seg_popularity"], ascending=[False, False]
-        )
-
-        slots_needed = TOP_K - len(already)
-        candidates   = seg_pool.head(slots_needed)
-
-        for _, p in candidates.iterrows():
-            l2 = prod_l2.get(p["product_id"], "Unknown")
-            l3 = prod_l3.get(p["product_id"], "Unknown")
-            aff_str = f"{cust_l2.get(l2, 0.0):.2f}"
-
-            rows.append((
-                cust,
-                p["product_id"],
-                cluster,
-                segment,
-                l2,
-                l3,
-                "fallback",          # trigger_product
-                0.0,                 # support
-                0.0,                 # confidence
-                0.0,                 # lift
-                0.1 + p["affinity"], # score — base 0.1 + affinity for ordering
-                1,                   # recommended_qty placeholder
-                f"Category-affinity fallback: {l2} affinity={aff_str}",
-            ))
-
-    return rows
+    # Customers without basket rows get no fallback
+    targets = pd.DataFrame({"customer_id": customers, "target_pos": np.arange(len(customers))})
+    targets = targets.merge(
+        df.drop_duplicates("customer_id")[["customer_id", "cluster_id", "segment"]],
+        on="customer_id",
+    )
+    already_count = existing_recs.groupby("customer_id", sort=False).size()
+    targets["slots"] = TOP_K - targets["customer_id"].map(already_count).fillna(0).astype(int)
+
+    # Candidate pool: segment products, in stock, not yet bought or recommended
+    pool = targets.merge(seg_popularity, on="segment")
+    exclude = pd.MultiIndex.from_frame(pd.concat([
+        bought_pairs,
+        existing_recs.rename(columns={"recommended_product": "product_id"}),
+    ]))
+    pool = pool[~pd.MultiIndex.from_arrays([pool["customer_id"], pool["product_id"]]).isin(exclude)]
+
+    # Category affinity score per candidate product
+    pool = pool.assign(l2_category=pool["product_id"].map(prod_l2))
+    pool = pool.merge(l2_affinity, on=["customer_id", "l2_category"], how="left", sort=False)
+    pool["affinity"] = pool["affinity"].fillna(0.0)
+
+    # Sort: primary = affinity (desc), secondary = segment popularity (desc)
+    pool = pool.sort_values(
+        ["target_pos", "affinity", "seg_popularity", "pool_pos"],
+        ascending=[True, False, False, True],
+        kind="stable",
+    )
+    pool = pool[pool.groupby("target_pos").cumcount() < pool["slots"]]
+
+    l2 = pool["product_id"].map(prod_l2).where(pool["product_id"].isin(prod_l2.keys()), "Unknown")
+    l3 = pool["product_id"].map(prod_l3).where(pool["product_id"].isin(prod_l3.keys()), "Unknown")
+
+    return pd.DataFrame({
+        "customer_id":         pool["customer_id"],
+        "recommended_product": pool["product_id"],
+        "cluster_id":          pool["cluster_id"],
+        "segment":             pool["segment"],
+        "l2_category":         l2,
+        "l3_category":         l3,
+        "trigger_product":     "fallback",
+        "support":             0.0,
+        "confidence":          0.0,
+        "lift":                0.0,
+        "score":               0.1 + pool["affinity"],   # base 0.1 + affinity for ordering
+        "recommended_qty":     1,                        # placeholder
+        "reason": [
+            f"Category-affinity fallback: {cat} affinity={aff:.2f}"
+            for cat, aff in zip(l2, pool["affinity"])
+        ],
+    }, columns=RECOMMENDATION_COLUMNS).reset_index(drop=True)
 
 
 # ─────────────────────────────────────────────────
-# MAIN
+# RANKING
 # ─────────────────────────────────────────────────
 
-def main():
-    print("=" * 60)
-    print("IPRE — Ranking")
-    print(f"  MIN_SUPPORT        : {MIN_SUPPORT}")
-    print(f"  MIN_CONFIDENCE     : {MIN_CONFIDENCE}")
-    print(f"  MIN_LIFT           : {MIN_LIFT}")
-    print(f"  TOP_K              : {TOP_K}")
-    print(f"  Weights (C/S/L/R)  : {W_CONF}/{W_SUPP}/{W_LIFT}/{W_RECENCY}")
-    print(f"  MAX_LIFT_NORMALISE : {MAX_LIFT_NORMALISE}")
-    print(f"  L3_TIEBREAK_MARGIN : {L3_TIEBREAK_MARGIN}")
-    print("=" * 60)
-
-    # --------------------------------------------------
-    # Load inputs
-    # --------------------------------------------------
-    clustering_dir = extract_clustering_output("/opt/ml/processing/input/clustering")
-    clusters_csv   = clustering_dir / "customer_clusters.csv"
-
-    basket   = pd.read_csv("/opt/ml/processing/input/market_basket/market_basket.csv")
-    clusters = pd.read_csv(clusters_csv)
-    assoc    = pd.read_csv("/opt/ml/processing/input/associations/associations.csv")
-    print(f"  [STEP] Files loaded. basket cols: {basket.columns.tolist()}", flush=True)
+def rank_recommendations(basket: pd.DataFrame, clusters: pd.DataFrame, assoc: pd.DataFrame) -> pd.DataFrame:
+    """
+    Score, rank and top up recommendations for every customer in the
+    market basket. Returns up to TOP_K ranked rows per customer.
 
+    Called by main() for the standalone step and by run_mining.py, which
+    passes in the association rules it has just mined.
+    """
     basket["customer_id"]   = basket["customer_id"].astype(str)
     basket["product_id"]    = basket["product_id"].astype(str)
     clusters["customer_id"] = clusters["customer_id"].astype(str)
@@ -336,7 +334,7 @@ def main():
     # --------------------------------------------------
     # Product metadata lookup — built from market_basket which has
     # all product fields (l2, l3, brand, in_stock) merged in from products.csv
-    # These dicts must be defined here in main() before the recommendation loop.
+    # These dicts must be defined here in main() before candidate scoring.
     # --------------------------------------------------
     prod_l2 = {}
     prod_l3 = {}
@@ -383,116 +381,115 @@ def main():
     l3_affinity   = build_customer_l3_affinity(basket)
     print("  [STEP] Building l2_affinity...", flush=True)
     l2_affinity   = build_l2_affinity(basket)
-    print("  [STEP] Building cust_products...", flush=True)
-    cust_products = df.groupby("customer_id")["product_id"].apply(set)
-    bought_map    = cust_products.to_dict()
+    print("  [STEP] Building bought_pairs...", flush=True)
+    bought_pairs  = df[["customer_id", "product_id"]].drop_duplicates()
+    customers     = pd.Index(df["customer_id"].unique()).sort_values()
 
     # --------------------------------------------------
-    # MAIN RECOMMENDATION LOOP
+    # Per-customer context — cluster and segment come from the customer's
+    # first basket row; recency score is averaged across all their products
     # --------------------------------------------------
-    print("  [STEP] Starting main recommendation loop...", flush=True)
-    rows              = []
-    customers_with_recs = set()
-
-    for cust, bought in cust_products.items():
-
-        cust_rows = df[df["customer_id"] == cust]
-
-        if cust_rows["cluster_id"].nunique() > 1:
-            print(f"  WARNING: customer {cust} maps to multiple clusters — using first")
-
-        cluster = cust_rows["cluster_id"].iloc[0]
-        segment = cust_rows["segment"].iloc[0]
-
-        rules = assoc[
-            (assoc["cluster_id"] == cluster) &
-            (assoc["segment"]    == segment)
-        ]
-
-        # Customer-level recency score — averaged across all their products
-        recency_score = 1.0 / (1.0 + cust_rows["recency_days"].mean())
-
-        # Customer's top L3 categories for tiebreaking
-        cust_l3 = l3_affinity.get(cust, {})
-
-        rows_before = len(rows)
-
-        for _, r in rules.iterrows():
-
-            # Skip products already purchased
-            if r["product_b"] in bought:
-                continue
-
-            # Skip products where trigger was never purchased by this customer
-            if r["product_a"] not in bought:
-                continue
-
-            # Skip out-of-stock products
-            if r["product_b"] not in in_stock_ids:
-                continue
-
-            # Apply thresholds
-            support_col = "weighted_support" if "weighted_support" in r.index else "support"
-            if r["support"] < MIN_SUPPORT:
-                continue
-            if r["confidence"] < MIN_CONFIDENCE:
-                continue
-            if r.get("lift", 1.0) < MIN_LIFT:
-                continue
-
-            lift_val = r.get("lift", 1.0)
-            supp_val = r.get(support_col, r["support"])
-
-            raw_score = score_rule(r["confidence"], supp_val, lift_val, recency_score)
-
-            # L3 affinity bonus — if recommended product is in customer's
-            # top L3 category, add a small bonus for tiebreaking
-            # This implements PRD 5.4 "Relevant L3 products" prioritisation
-            l3_bonus = 0.0
-            rec_l3_for_bonus = prod_l3.get(r["product_b"], "")
-            if rec_l3_for_bonus and rec_l3_for_bonus in cust_l3:
-                l3_bonus = cust_l3[rec_l3_for_bonus] * L3_TIEBREAK_MARGIN
-
-            final_score = raw_score + l3_bonus
-
-            qty = qty_lookup.get((cust, r["product_a"]), 1)
-
-            # l2/l3 for the recommended product come from the product
-            # metadata lookup — association rules don't carry category columns
-            rec_l2 = prod_l2.get(r["product_b"], "Unknown")
-            rec_l3 = prod_l3.get(r["product_b"], "Unknown")
-
-            rows.append((
-                cust,
-                r["product_b"],
-                cluster,
-                segment,
-                rec_l2,
-                rec_l3,
-                r["product_a"],
-                r["support"],
-                r["confidence"],
-                lift_val,
-                final_score,
-                qty,
-                f"{r['product_a']} → {r['product_b']} "
-                f"(support={r['support']:.3f}, confidence={r['confidence']:.3f}, lift={lift_val:.2f})",
-            ))
-
-        if len(rows) > rows_before:
-            customers_with_recs.add(cust)
+    multi_cluster = df.groupby("customer_id")["cluster_id"].nunique()
+    for cust in multi_cluster[multi_cluster > 1].index:
+        print(f"  WARNING: customer {cust} maps to multiple clusters — using first")
+
+    cust_ctx = df.drop_duplicates("customer_id")[["customer_id", "cluster_id", "segment"]]
+    cust_ctx = cust_ctx.merge(
+        df.groupby("customer_id", sort=False)["recency_days"].mean().rename("mean_recency").reset_index(),
+        on="customer_id",
+    )
+    cust_ctx["recency_score"] = 1.0 / (1.0 + cust_ctx["mean_recency"])
+    cust_ctx["cust_pos"]      = cust_ctx["customer_id"].map(
+        pd.Series(np.arange(len(customers)), index=customers)
+    )
 
     # --------------------------------------------------
-    # FORMAT ASSOCIATION-BASED RECOMMENDATIONS
+    # MAIN RECOMMENDATION SCORING
+    # Rules are filtered by their own thresholds first, then joined to
+    # every customer who bought the trigger product in the same
+    # cluster + segment. Scores are computed over the whole candidate
+    # table at once instead of row by row.
     # --------------------------------------------------
-    col_names = [
-        "customer_id", "recommended_product", "cluster_id", "segment",
-        "l2_category", "l3_category", "trigger_product",
-        "support", "confidence", "lift", "score",
-        "recommended_qty", "reason",
+    print("  [STEP] Scoring candidate rules...", flush=True)
+    lift_col    = "lift" if "lift" in assoc.columns else None
+    support_col = "weighted_support" if "weighted_support" in assoc.columns else "support"
+
+    rules = assoc.assign(
+        rule_pos=np.arange(len(assoc)),
+        lift_val=assoc[lift_col] if lift_col else 1.0,
+    )
+    # Negated comparisons keep the row-by-row semantics: NaN never fails a threshold
+    rules = rules[
+        rules["product_b"].isin(in_stock_ids) &
+        ~(rules["support"]    < MIN_SUPPORT) &
+        ~(rules["confidence"] < MIN_CONFIDENCE) &
+        ~(rules["lift_val"]   < MIN_LIFT)
     ]
 
-    out = pd.DataFrame(rows, columns=col_names)
+    cand = (
+        bought_pairs.rename(columns={"product_id": "product_a"})
+        .merge(cust_ctx, on="customer_id")
+        .merge(rules, on=["cluster_id", "segment", "product_a"])
+    )
+
+    # Skip products already purchased
+    already_bought = pd.MultiIndex.from_frame(bought_pairs)
+    cand = cand[~pd.MultiIndex.from_arrays([cand["customer_id"], cand["product_b"]]).isin(already_bought)]
+
+    # Same order the per-customer loop produced: customer, then rule order
+    cand = cand.sort_values(["cust_pos", "rule_pos"], kind="stable")
+
+    raw_score = score_rule(
+        cand["confidence"].to_numpy(),
+        cand[support_col].to_numpy(),
+        cand["lift_val"].to_numpy(),
+        cand["recency_score"].to_numpy(),
+    )
+
+    # L3 affinity bonus — if recommended product is in one of the customer's
+    # L3 categories, add a small bonus for tiebreaking
+    # This implements PRD 5.4 "Relevant L3 products" prioritisation
+    cand["l3_category"] = cand["product_b"].map(prod_l3)
+    cand = cand.merge(l3_affinity, on=["customer_id", "l3_category"], how="left", sort=False)
+    l3_bonus = cand["proportion"].fillna(0.0).to_numpy() * L3_TIEBREAK_MARGIN
+
+    cand = cand.merge(
+        qty_lookup.rename(columns={"product_id": "product_a"}),
+        on=["customer_id", "product_a"], how="left", sort=False,
+    )
+
+    # l2/l3 for the recommended product come from the product
+    # metadata lookup — association rules don't carry category columns
+    known_l2 = cand["product_b"].isin(prod_l2.keys())
+    known_l3 = cand["product_b"].isin(prod_l3.keys())
+
+    rows = pd.DataFrame({
+        "customer_id":         cand["customer_id"],
+        "recommended_product": cand["product_b"],
+        "cluster_id":          cand["cluster_id"],
+        "segment":             cand["segment"],
+        "l2_category":         cand["product_b"].map(prod_l2).where(known_l2, "Unknown"),
+        "l3_category":         cand["l3_category"].where(known_l3, "Unknown"),
+        "trigger_product":     cand["product_a"],
+        "support":             cand["support"],
+        "confidence":          cand["confidence"],
+        "lift":                cand["lift_val"],
+        "score":               raw_score + l3_bonus,
+        "recommended_qty":     cand["qty"].fillna(1).astype(int),
+        "reason": [
+            f"{a} → {b} (support={sp:.3f}, confidence={cf:.3f}, lift={lf:.2f})"
+            for a, b, sp, cf, lf in zip(
+                cand["product_a"], cand["product_b"],
+                cand["support"], cand["confidence"], cand["lift_val"],
+            )
+        ],
+    })
+    customers_with_recs = set(rows["customer_id"])
+
+    # --------------------------------------------------
+    # FORMAT ASSOCIATION-BASED RECOMMENDATIONS
+    # --------------------------------------------------
+    out = rows[RECOMMENDATION_COLUMNS].reset_index(drop=True)
 
     # Rank within each customer — deduplicate product_b keeping highest score
     if not out.empty:
@@ -505,24 +502,17 @@ def main():
     # CATEGORY-AWARE FALLBACK
     # Covers customers with zero qualifying association rules.
     # --------------------------------------------------
-    uncovered = [c for c in cust_products.index if c not in customers_with_recs]
+    uncovered = [c for c in customers if c not in customers_with_recs]
 
     if uncovered:
         print(f"\n{len(uncovered)} customers need fallback recommendations")
 
-        # Build set of already-recommended products per customer
-        existing_recs = {}
-        if not out.empty:
-            for cust, grp in out.groupby("customer_id"):
-                existing_recs[cust] = set(grp["recommended_product"])
-
-        fallback_rows = category_aware_fallback(
-            df, basket, basket,
-            uncovered, bought_map,
-            l2_affinity, in_stock_ids, existing_recs
+        fallback_df = category_aware_fallback(
+            df, basket,
+            uncovered, bought_pairs,
+            l2_affinity, in_stock_ids,
+            out[["customer_id", "recommended_product"]],
         )
-
-        fallback_df = pd.DataFrame(fallback_rows, columns=col_names)
         out = pd.concat([out, fallback_df], ignore_index=True)
     else:
         print("\nAll customers covered by association rules — no fallback needed")
@@ -536,16 +526,12 @@ def main():
 
     if needs_topup:
         print(f"{len(needs_topup)} customers have fewer than {TOP_K} recs — topping up")
-        existing_recs_topup = {
-            cust: set(grp["recommended_product"])
-            for cust, grp in out.groupby("customer_id")
-        }
-        topup_rows = category_aware_fallback(
-            df, basket, basket,
-            needs_topup, bought_map,
-            l2_affinity, in_stock_ids, existing_recs_topup
+        topup_df = category_aware_fallback(
+            df, basket,
+            needs_topup, bought_pairs,
+            l2_affinity, in_stock_ids,
+            out[["customer_id", "recommended_product"]],
         )
-        topup_df = pd.DataFrame(topup_rows, columns=col_names)
         out = pd.concat([out, topup_df], ignore_index=True)
 
     # --------------------------------------------------
@@ -557,7 +543,7 @@ def main():
     )
 
     out["rank"] = (
-        out.groupby("customer_id")["score"]
+        out.groupby("customer_id", sort=False)["score"]
         .rank(ascending=False, method="first")
         .astype(int)
     )
@@ -565,12 +551,6 @@ def main():
     out = out[out["rank"] <= TOP_K]
     out = out.sort_values(["customer_id", "rank"])
 
-    # --------------------------------------------------
-    # Save
-    # --------------------------------------------------
-    Path("/opt/ml/processing/output").mkdir(parents=True, exist_ok=True)
-    out.to_csv("/opt/ml/processing/output/recommendations.csv", index=False)
-
     assoc_count    = out[out["trigger_product"] != "fallback"]["customer_id"].nunique()
     fallback_count = out[out["trigger_product"] == "fallback"]["customer_id"].nunique()
 
@@ -581,6 +561,151 @@ def main():
     print(f"  Via fallback (any slot)  : {fallback_count}")
     print(f"  Score range              : {out['score'].min():.4f} – {out['score'].max():.4f}")
     print(f"  Products recommended     : {out['recommended_product'].nunique()}")
+
+    return out
+
+
+# ─────────────────────────────────────────────────
+# MAIN
+# ─────────────────────────────────────────────────
+
+def print_config():
+    print("=" * 60)
+    print("IPRE — Ranking")
+    print(f"  MIN_SUPPORT        : {MIN_SUPPORT}")
+    print(f"  MIN_CONFIDENCE     : {MIN_CONFIDENCE}")
+    print(f"  MIN_LIFT           : {MIN_LIFT}")
+    print(f"  TOP_K              : {TOP_K}")
+    print(f"  Weights (C/S/L/R)  : {W_CONF}/{W_SUPP}/{W_LIFT}/{W_RECENCY}")
+    print(f"  MAX_LIFT_NORMALISE : {MAX_LIFT_NORMALISE}")
+    print(f"  L3_TIEBREAK_MARGIN : {L3_TIEBREAK_MARGIN}")
+    print(f"  OUTPUT             : {RECOMMENDATIONS_S3_PREFIX or 'local ProcessingOutput'}")
+    print("=" * 60)
+
+
+class _MultipartWriter:
+    """
+    Write-only file object over an S3 multipart upload.
+
+    Bytes are buffered to UPLOAD_PART_BYTES and each full part is handed to
+    a thread pool, so the next row group is encoded while earlier parts are
+    still uploading. At most `max_workers` parts are held in memory.
+    close() completes the upload; abort() discards it.
+    """
+
+    def __init__(self, bucket: str, key: str, max_workers: int = 4):
+        self._s3          = boto3.client("s3")
+        self._bucket      = bucket
+        self._key         = key
+        self._upload_id   = self._s3.create_multipart_upload(Bucket=bucket, Key=key)["UploadId"]
+        self._pool        = ThreadPoolExecutor(max_workers=max_workers)
+        self._max_workers = max_workers
+        self._parts       = []
+        self._buf         = bytearray()
+        self._size        = 0
+        self.closed       = False
+
+    def _upload(self, number: int, body: bytes) -> dict:
+        resp = self._s3.upload_part(
+            Bucket=self._bucket, Key=self._key, UploadId=self._upload_id,
+            PartNumber=number, Body=body,
+        )
+        return {"PartNumber": number, "ETag": resp["ETag"]}
+
+    def _submit_part(self):
+        if len(self._parts) >= self._max_workers:
+            self._parts[-self._max_workers].result()
+        self._parts.append(self._pool.submit(self._upload, len(self._parts) + 1, bytes(self._buf)))
+        self._buf = bytearray()
+
+    def write(self, data) -> int:
+        self._buf  += data
+        self._size += len(data)
+        if len(self._buf) >= UPLOAD_PART_BYTES:
+            self._submit_part()
+        return len(data)
+
+    def tell(self) -> int:
+        return self._size
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self.closed:
+            return
+        if self._buf or not self._parts:
+            self._submit_part()
+        parts = [f.result() for f in self._parts]
+        self._pool.shutdown()
+        self._s3.complete_multipart_upload(
+            Bucket=self._bucket, Key=self._key, UploadId=self._upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+        self.closed = True
+
+    def abort(self):
+        self._pool.shutdown(cancel_futures=True)
+        self._s3.abort_multipart_upload(Bucket=self._bucket, Key=self._key, UploadId=self._upload_id)
+        self.closed = True
+
+
+def save_recommendations(out: pd.DataFrame) -> None:
+    """
+    Write recommendations.parquet for FeedbackCalibration.
+
+    Without RECOMMENDATIONS_S3_PREFIX the file goes to the ProcessingOutput
+    dir as before. With it, the Parquet bytes are streamed to S3 row group
+    by row group over a multipart upload — no full copy on local disk, and
+    the upload overlaps encoding instead of starting when the job ends.
+    The key carries a per-run id so a cached MineAndRank never points at
+    another run's output; that URI is recorded in recommendations.json,
+    the only file left in the ProcessingOutput.
+    """
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    if not RECOMMENDATIONS_S3_PREFIX:
+        out.to_parquet(OUTPUT_DIR / "recommendations.parquet", engine="pyarrow", compression="snappy", index=False)
+        return
+
+    run_id = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}-{uuid.uuid4().hex[:8]}"
+    s3_uri = f"{RECOMMENDATIONS_S3_PREFIX.rstrip('/')}/{run_id}/recommendations.parquet"
+    bucket, key = s3_uri.replace("s3://", "", 1).split("/", 1)
+
+    table = pa.Table.from_pandas(out, preserve_index=False)
+    sink  = _MultipartWriter(bucket, key)
+    try:
+        with pq.ParquetWriter(sink, table.schema, compression="snappy") as writer:
+            writer.write_table(table, row_group_size=UPLOAD_CHUNK_ROWS)
+        sink.close()
+    except BaseException:
+        sink.abort()
+        raise
+
+    with open(OUTPUT_DIR / "recommendations.json", "w") as f:
+        json.dump({"s3_uri": s3_uri, "rows": len(out)}, f)
+    print(f"  Streamed {len(out)} recommendations to {s3_uri}")
+
+
+def main():
+    print_config()
+
+    # --------------------------------------------------
+    # Load inputs
+    # --------------------------------------------------
+    clustering_dir = extract_clustering_output("/opt/ml/processing/input/clustering")
+    clusters_csv   = clustering_dir / "customer_clusters.csv"
+
+    basket   = pd.read_parquet("/opt/ml/processing/input/market_basket/market_basket.parquet")
+    clusters = pd.read_csv(clusters_csv)
+    assoc    = pd.read_parquet("/opt/ml/processing/input/associations/associations.parquet")
+    print(f"  [STEP] Files loaded. basket cols: {basket.columns.tolist()}", flush=True)
+
+    out = rank_recommendations(basket, clusters, assoc)
+
+    # --------------------------------------------------
+    # Save
+    # --------------------------------------------------
+    save_recommendations(out)
     print("\nRanking complete.")
 
 
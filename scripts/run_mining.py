@@ -0,0 +1,78 @@
+"""
+run_mining.py — Steps 4 + 5: Association Mining and Ranking in one job
+
+Runs associations.py and ranking.py back to back in a single Processing
+container. The association rules are handed to ranking as a DataFrame in
+memory, so the job pays one container launch instead of two and
+associations.parquet is never written to S3 and read back.
+
+Both scripts are imported from this file's own directory — pipeline.py
+ships the whole scripts/ folder as the processor's source_dir. Each
+module reads its own configuration from the environment at import, so
+the step's env is the union of the two steps' env vars.
+
+The clustering model.tar.gz is not a ProcessingInput: pipeline.py passes
+its S3 URI as MODEL_S3_URI and the tarball is streamed and extracted with
+a background prefetch thread (associations.fetch_clustering_output).
+Without MODEL_S3_URI the local clustering input directory is used.
+
+Inputs:
+  /opt/ml/processing/input/invoices/invoice.csv
+  market_basket.parquet (inside the clustering model.tar.gz)
+  MODEL_S3_URI or /opt/ml/processing/input/clustering/  (model.tar.gz)
+
+Output:
+  /opt/ml/processing/output/recommendations.parquet  (consumed by feedback.py), or
+  with RECOMMENDATIONS_S3_PREFIX set, the Parquet file streamed to S3 and a
+  recommendations.json pointer in its place (see ranking.save_recommendations)
+"""
+
+import os
+import sys
+import traceback
+from pathlib import Path
+
+import pandas as pd
+
+MODEL_S3_URI = os.environ.get("MODEL_S3_URI", "")
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import associations  # noqa: E402
+import ranking       # noqa: E402
+
+
+def main():
+    associations.print_config()
+    ranking.print_config()
+
+    # --------------------------------------------------
+    # Load inputs — the clustering tarball is extracted once for both stages
+    # --------------------------------------------------
+    if MODEL_S3_URI:
+        clustering_dir = associations.fetch_clustering_output(MODEL_S3_URI, "/opt/ml/processing/input/clustering")
+    else:
+        clustering_dir = associations.extract_clustering_output("/opt/ml/processing/input/clustering")
+    clusters       = pd.read_csv(clustering_dir / "customer_clusters.csv")
+
+    invoices = associations.read_invoices("/opt/ml/processing/input/invoices/invoice.csv")
+    basket   = pd.read_parquet(clustering_dir / "market_basket.parquet")
+
+    # Each stage normalises its own copy of the cluster assignments
+    assoc = associations.mine_associations(invoices, clusters.copy())
+    print("\nAssociation mining complete.")
+
+    out = ranking.rank_recommendations(basket, clusters.copy(), assoc)
+    ranking.save_recommendations(out)
+    print("\nRanking complete.")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception as e:
+        print("\n" + "="*60, flush=True)
+        print("MINING FAILED — FULL TRACEBACK:", flush=True)
+        print("="*60, flush=True)
+        traceback.print_exc(file=sys.stdout)
+        sys.stdout.flush()
+        raise
@@ -27,12 +27,18 @@ matrix that covers the full PRD requirement set:
     Silhouette score logged per segment for monitoring.
 
 SageMaker Training Job path contract:
-  Input channel 'market_basket' : /opt/ml/input/data/market_basket/
+  Input channels 'customers', 'products', 'invoices'
+                                : /opt/ml/input/data/<channel>/
+    The market basket is built in this container (market_basket.py is
+    shipped alongside via source_dir). A pre-built 'market_basket' channel
+    is used instead when present — handy for standalone debugging runs.
   Model artifacts               : /opt/ml/model/   → model.tar.gz
-  customer_clusters.csv also written to /opt/ml/model/ so it travels
-  with model.tar.gz and is accessible to downstream Processing Jobs.
+  customer_clusters.csv and market_basket.parquet also written to
+  /opt/ml/model/ so they travel with model.tar.gz and are accessible to
+  downstream Processing Jobs.
 
 Configurable via SageMaker hyperparameters (set by pipeline.py):
+  MIN_ORDER_COUNT, RECENCY_CUTOFF_DAYS : market basket filters (see market_basket.py)
   MAX_K              : maximum number of clusters per segment (default 8)
   MIN_CLUSTER_CUSTOMERS : minimum segment size to attempt clustering (default 6)
   ELBOW_THRESHOLD    : % inertia drop below which we stop adding clusters (default 10)
@@ -40,9 +46,14 @@ Configurable via SageMaker hyperparameters (set by pipeline.py):
                        options: l2_qty, brand, functionality, rfm
                        default: "l2_qty,brand,functionality,rfm"
   RANDOM_STATE       : KMeans random seed (default 42)
-  N_INIT             : KMeans n_init (default 15)
+  N_INIT             : KMeans n_init (default 1 — k-means++ seeding makes
+                       further restarts near-redundant)
+  N_JOBS             : segments clustered in parallel (default -1 = one
+                       worker process per CPU)
 """
 
+import contextlib
+import io
 import json
 import os
 import pickle
@@ -51,7 +62,8 @@ from pathlib import Path
 
 import numpy as np
 import pandas as pd
-from sklearn.cluster import KMeans
+from joblib import Parallel, delayed
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from sklearn.metrics import silhouette_score
 from sklearn.preprocessing import StandardScaler
 
@@ -61,6 +73,11 @@ warnings.filterwarnings("ignore", category=FutureWarning)
 # SageMaker Training Job paths
 # --------------------------------------------------
 INPUT_DIR = Path(os.environ.get("SM_CHANNEL_MARKET_BASKET", "/opt/ml/input/data/market_basket"))
+RAW_INPUTS = {                                 # channel → file name inside it
+    "customers": "customer.csv",
+    "products":  "product.csv",
+    "invoices":  "invoice.csv",
+}
 MODEL_DIR = Path(os.environ.get("SM_MODEL_DIR", "/opt/ml/model"))
 
 # --------------------------------------------------
@@ -72,7 +89,11 @@ MIN_CLUSTER_CUSTOMERS  = int(os.environ.get("SM_HP_MIN_CLUSTER_CUSTOMERS",   "6"
 ELBOW_THRESHOLD        = float(os.environ.get("SM_HP_ELBOW_THRESHOLD",       "10.0"))
 FEATURE_GROUPS         = os.environ.get("SM_HP_FEATURE_GROUPS",              "l2_qty,brand,functionality,rfm").split(",")
 RANDOM_STATE           = int(os.environ.get("SM_HP_RANDOM_STATE",            "42"))
-N_INIT                 = int(os.environ.get("SM_HP_N_INIT",                  "15"))
+N_INIT                 = int(os.environ.get("SM_HP_N_INIT",                  "1"))
+N_JOBS                 = int(os.environ.get("SM_HP_N_JOBS",                  "-1"))
+
+# Segments larger than this are clustered with MiniBatchKMeans
+MINIBATCH_MIN_CUSTOMERS = 100_000
 
 
 # ─────────────────────────────────────────────────
@@ -160,11 +181,14 @@ def build_feature_matrix(sdf: pd.DataFrame, feature_groups: list) -> tuple:
     customer_ids = merged["customer_id"].tolist()
     X = merged.drop(columns=["customer_id"])
 
-    # Drop zero-variance columns
-    zero_var = X.columns[X.std() == 0]
-    if len(zero_var):
-        print(f"    Dropping {len(zero_var)} zero-variance columns")
-        X = X.drop(columns=zero_var)
+    # Drop zero-variance columns — one NumPy reduction over the whole
+    # block instead of a pandas std() per column; a column has zero
+    # variance exactly when its max equals its min
+    values   = X.to_numpy(dtype=np.float64)
+    zero_var = np.nanmax(values, axis=0) == np.nanmin(values, axis=0)
+    if zero_var.any():
+        print(f"    Dropping {int(zero_var.sum())} zero-variance columns")
+        X = X.loc[:, ~zero_var]
 
     # Fill any NaN introduced by merges
     X = X.fillna(0)
@@ -176,7 +200,22 @@ def build_feature_matrix(sdf: pd.DataFrame, feature_groups: list) -> tuple:
 # K SELECTION — ELBOW METHOD
 # ─────────────────────────────────────────────────
 
-def elbow_k(X_scaled: np.ndarray, max_k: int, elbow_threshold: float, random_state: int, n_init: int) -> int:
+def make_kmeans(k: int, n: int, random_state: int, n_init: int):
+    """
+    KMeans estimator suited to the segment size and k.
+
+    Elkan's variant uses the triangle inequality to skip most
+    point-to-centroid distance computations on our dense scaled features;
+    it only pays off once there are a few centroids, so small k stays on
+    Lloyd. Segments above MINIBATCH_MIN_CUSTOMERS use MiniBatchKMeans.
+    """
+    if n > MINIBATCH_MIN_CUSTOMERS:
+        return MiniBatchKMeans(n_clusters=k, init="k-means++", random_state=random_state, n_init=n_init)
+    algorithm = "elkan" if k >= 4 else "lloyd"
+    return KMeans(n_clusters=k, init="k-means++", random_state=random_state, n_init=n_init, algorithm=algorithm)
+
+
+def elbow_k(X_scaled: np.ndarray, max_k: int, elbow_threshold: float, random_state: int, n_init: int) -> tuple:
     """
     Data-driven k selection using the elbow method.
 
@@ -186,26 +225,32 @@ def elbow_k(X_scaled: np.ndarray, max_k: int, elbow_threshold: float, random_sta
     returns. If no elbow is found, return max_k.
 
     With fewer than 4 data points, defaults to k=1.
+
+    Returns (k, model): the model already fitted at the chosen k with the
+    same seed, so the caller need not fit it again, or None when k was
+    chosen without fitting.
     """
     n = X_scaled.shape[0]
 
     if n < 4:
-        return 1
+        return 1, None
     if n < 6:
-        return 2
+        return 2, None
 
     effective_max_k = min(max_k, n - 1)   # can't have more clusters than samples
 
     if effective_max_k < 2:
-        return 1
+        return 1, None
 
     inertias = []
+    models   = []
     k_range  = range(2, effective_max_k + 1)
 
     for k in k_range:
-        km = KMeans(n_clusters=k, random_state=random_state, n_init=n_init)
+        km = make_kmeans(k, n, random_state, n_init)
         km.fit(X_scaled)
         inertias.append(km.inertia_)
+        models.append(km)
 
     # Find elbow — first k where % drop is below threshold
     for i in range(1, len(inertias)):
@@ -215,11 +260,176 @@ def elbow_k(X_scaled: np.ndarray, max_k: int, elbow_threshold: float, random_sta
         if pct_drop < elbow_threshold:
             chosen_k = list(k_range)[i]
             print(f"    Elbow at k={chosen_k} (drop={pct_drop:.1f}% < threshold={elbow_threshold}%)")
-            return chosen_k
+            return chosen_k, models[i]
 
     chosen_k = list(k_range)[-1]
     print(f"    No clear elbow — using max k={chosen_k}")
-    return chosen_k
+    return chosen_k, models[-1]
+
+
+# ─────────────────────────────────────────────────
+# MARKET BASKET
+# ─────────────────────────────────────────────────
+
+def find_csv(channel_dir: Path, name: str) -> Path:
+    """
+    SageMaker may place the file directly in the channel dir
+    or in a subdirectory depending on the S3 URI structure.
+    """
+    candidates = list(channel_dir.rglob(name))
+    if not candidates:
+        raise FileNotFoundError(f"{name} not found under {channel_dir}")
+    return candidates[0]
+
+
+def load_market_basket() -> pd.DataFrame:
+    """
+    Market basket for clustering.
+
+    The pipeline passes the raw customers / products / invoices channels
+    and the basket is built here with market_basket.build_market_basket —
+    no separate Processing job and no CSV round-trip through S3. A
+    pre-built market_basket channel (standalone runs, debugging) is used
+    as-is when present.
+    """
+    if INPUT_DIR.exists():
+        basket_path = find_csv(INPUT_DIR, "market_basket.csv")
+        print(f"Loading: {basket_path}")
+        return pd.read_csv(basket_path)
+
+    import market_basket
+
+    market_basket.print_config()
+    raw = {
+        channel: pd.read_csv(find_csv(Path(os.environ.get(f"SM_CHANNEL_{channel.upper()}", f"/opt/ml/input/data/{channel}")), name))
+        for channel, name in RAW_INPUTS.items()
+    }
+    basket = market_basket.build_market_basket(raw["customers"], raw["products"], raw["invoices"])
+    market_basket.print_summary(basket)
+    return basket
+
+
+# ─────────────────────────────────────────────────
+# PER-SEGMENT CLUSTERING
+# ─────────────────────────────────────────────────
+
+def cluster_segment(segment: str, sdf: pd.DataFrame) -> tuple:
+    """
+    Cluster one segment and save its model artifacts into MODEL_DIR.
+
+    Runs in a joblib worker, so everything it prints is captured and
+    returned instead of interleaving with other segments.
+    Returns (log, cluster_rows, registry_entry, diagnostic); the last two
+    are None when the segment was skipped.
+    """
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        rows, registry_entry, diagnostic = _cluster_segment(segment, sdf)
+    return log.getvalue(), rows, registry_entry, diagnostic
+
+
+def _cluster_segment(segment: str, sdf: pd.DataFrame) -> tuple:
+    """Body of cluster_segment(); returns (cluster_rows, registry_entry, diagnostic)."""
+    print(f"\n{'─'*50}")
+    print(f"Segment: {segment}  ({sdf['customer_id'].nunique()} customers)")
+
+    n_customers = sdf["customer_id"].nunique()
+
+    if n_customers < MIN_CLUSTER_CUSTOMERS:
+        print(f"  SKIP — fewer than {MIN_CLUSTER_CUSTOMERS} customers")
+        # Still assign all customers to a single cluster so they
+        # receive recommendations via the fallback path.
+        cluster_id = f"{segment}_0"
+        rows = [
+            {"customer_id": cid, "cluster_id": cluster_id, "segment": segment}
+            for cid in sdf["customer_id"].unique()
+        ]
+        return rows, None, None
+
+    # Build feature matrix
+    try:
+        customer_ids, X = build_feature_matrix(sdf, FEATURE_GROUPS)
+    except Exception as e:
+        print(f"  ERROR building features: {e} — skipping segment")
+        return [], None, None
+
+    if X.empty or X.shape[1] == 0:
+        print(f"  WARNING: Empty feature matrix — skipping")
+        return [], None, None
+
+    n = len(customer_ids)
+
+    # Scale features — StandardScaler makes all features
+    # contribute equally regardless of their original scale.
+    scaler   = StandardScaler()
+    X_scaled = scaler.fit_transform(X)
+
+    # Data-driven k selection via elbow method
+    k, kmeans = elbow_k(X_scaled, MAX_K, ELBOW_THRESHOLD, RANDOM_STATE, N_INIT)
+    print(f"  Customers={n}  k={k}  Features={X.shape[1]}")
+
+    # Final KMeans with chosen k — reuse the elbow fit when there is one
+    if kmeans is None:
+        kmeans = make_kmeans(k, n, RANDOM_STATE, N_INIT)
+        kmeans.fit(X_scaled)
+    labels = kmeans.labels_
+
+    # Silhouette score — quality metric for this clustering
+    # Range: [-1, 1]. Values > 0.5 = good, 0.2-0.5 = acceptable, < 0.2 = poor
+    if k > 1 and n > k:
+        try:
+            sil = round(silhouette_score(X_scaled, labels), 4)
+        except Exception:
+            sil = None
+    else:
+        sil = None
+    print(f"  Inertia={round(kmeans.inertia_, 2)}  Silhouette={sil}")
+
+    # Globally unique cluster IDs — raw 0..k-1 labels repeat across
+    # segments and cause ambiguous joins in downstream steps.
+    safe_seg       = segment.replace(" ", "_").replace("/", "-")
+    prefixed_labels = [f"{segment}_{lbl}" for lbl in labels]
+
+    # --------------------------------------------------
+    # Save model artifacts into MODEL_DIR
+    # All artifacts land in model.tar.gz which is the single
+    # artifact referenced by downstream Processing Jobs via
+    # ModelArtifacts.S3ModelArtifacts.
+    # --------------------------------------------------
+    model_path  = MODEL_DIR / f"{safe_seg}_kmeans.pkl"
+    scaler_path = MODEL_DIR / f"{safe_seg}_scaler.pkl"
+    cols_path   = MODEL_DIR / f"{safe_seg}_columns.json"
+
+    with open(model_path,  "wb") as f: pickle.dump(kmeans,  f)
+    with open(scaler_path, "wb") as f: pickle.dump(scaler,  f)
+    with open(cols_path,   "w")  as f: json.dump(X.columns.tolist(), f)
+
+    registry_entry = {
+        "segment":       segment,
+        "n_customers":   n,
+        "k":             k,
+        "inertia":       round(kmeans.inertia_, 4),
+        "silhouette":    sil,
+        "feature_cols":  X.columns.tolist(),
+        "feature_groups": FEATURE_GROUPS,
+        "model_file":    model_path.name,
+        "scaler_file":   scaler_path.name,
+        "cols_file":     cols_path.name,
+    }
+
+    diagnostic = {
+        "segment":    segment,
+        "n_customers": n,
+        "k":          k,
+        "inertia":    round(kmeans.inertia_, 4),
+        "silhouette": sil,
+    }
+
+    rows = [
+        {"customer_id": cid, "cluster_id": lbl, "segment": segment}
+        for cid, lbl in zip(customer_ids, prefixed_labels)
+    ]
+    return rows, registry_entry, diagnostic
 
 
 # ─────────────────────────────────────────────────
@@ -235,20 +445,15 @@ def main():
     print(f"  FEATURE_GROUPS        : {FEATURE_GROUPS}")
     print(f"  RANDOM_STATE          : {RANDOM_STATE}")
     print(f"  N_INIT                : {N_INIT}")
+    print(f"  N_JOBS                : {N_JOBS}")
     print("=" * 60)
 
-    # --------------------------------------------------
-    # Load market basket
-    # SageMaker may place the file directly in the channel dir
-    # or in a subdirectory depending on the S3 URI structure.
-    # --------------------------------------------------
-    candidates = list(INPUT_DIR.rglob("market_basket.csv"))
-    if not candidates:
-        raise FileNotFoundError(f"market_basket.csv not found under {INPUT_DIR}")
-    basket_path = candidates[0]
+    df = load_market_basket()
+
+    # Written into MODEL_DIR so it travels with model.tar.gz to MineAndRank
+    MODEL_DIR.mkdir(parents=True, exist_ok=True)
+    df.to_parquet(MODEL_DIR / "market_basket.parquet", engine="pyarrow", compression="snappy", index=False)
 
-    print(f"Loading: {basket_path}")
-    df = pd.read_csv(basket_path)
     df["customer_id"] = df["customer_id"].astype(str)
 
     if "segment" not in df.columns:
@@ -256,117 +461,25 @@ def main():
 
     print(f"Rows={len(df)}  Segments={df['segment'].nunique()}  Customers={df['customer_id'].nunique()}")
 
-    MODEL_DIR.mkdir(parents=True, exist_ok=True)
-
     cluster_outputs = []
     model_registry  = {}
     diagnostics     = []
 
     # --------------------------------------------------
     # Train one KMeans per segment
+    # Segments are independent, so they are clustered in parallel worker
+    # processes; each returns its log and results, which are replayed
+    # here in segment order so the output matches a sequential run.
     # --------------------------------------------------
-    for segment, sdf in df.groupby("segment"):
-        print(f"\n{'─'*50}")
-        print(f"Segment: {segment}  ({sdf['customer_id'].nunique()} customers)")
-
-        n_customers = sdf["customer_id"].nunique()
-
-        if n_customers < MIN_CLUSTER_CUSTOMERS:
-            print(f"  SKIP — fewer than {MIN_CLUSTER_CUSTOMERS} customers")
-            # Still assign all customers to a single cluster so they
-            # receive recommendations via the fallback path.
-            cluster_id = f"{segment}_0"
-            for cid in sdf["customer_id"].unique():
-                cluster_outputs.append({
-                    "customer_id": cid,
-                    "cluster_id":  cluster_id,
-                    "segment":     segment,
-                })
-            continue
-
-        # Build feature matrix
-        try:
-            customer_ids, X = build_feature_matrix(sdf, FEATURE_GROUPS)
-        except Exception as e:
-            print(f"  ERROR building features: {e} — skipping segment")
-            continue
-
-        if X.empty or X.shape[1] == 0:
-            print(f"  WARNING: Empty feature matrix — skipping")
-            continue
-
-        n = len(customer_ids)
-
-        # Scale features — StandardScaler makes all features
-        # contribute equally regardless of their original scale.
-        scaler   = StandardScaler()
-        X_scaled = scaler.fit_transform(X)
-
-        # Data-driven k selection via elbow method
-        k = elbow_k(X_scaled, MAX_K, ELBOW_THRESHOLD, RANDOM_STATE, N_INIT)
-        print(f"  Customers={n}  k={k}  Features={X.shape[1]}")
-
-        # Final KMeans with chosen k
-        kmeans = KMeans(n_clusters=k, random_state=RANDOM_STATE, n_init=N_INIT)
-        labels = kmeans.fit_predict(X_scaled)
-
-        # Silhouette score — quality metric for this clustering
-        # Range: [-1, 1]. Values > 0.5 = good, 0.2-0.5 = acceptable, < 0.2 = poor
-        if k > 1 and n > k:
-            try:
-                sil = round(silhouette_score(X_scaled, labels), 4)
-            except Exception:
-                sil = None
-        else:
-            sil = None
-        print(f"  Inertia={round(kmeans.inertia_, 2)}  Silhouette={sil}")
-
-        # Globally unique cluster IDs — raw 0..k-1 labels repeat across
-        # segments and cause ambiguous joins in downstream steps.
-        safe_seg       = segment.replace(" ", "_").replace("/", "-")
-        prefixed_labels = [f"{segment}_{lbl}" for lbl in labels]
-
-        # --------------------------------------------------
-        # Save model artifacts into MODEL_DIR
-        # All artifacts land in model.tar.gz which is the single
-        # artifact referenced by downstream Processing Jobs via
-        # ModelArtifacts.S3ModelArtifacts.
-        # --------------------------------------------------
-        model_path  = MODEL_DIR / f"{safe_seg}_kmeans.pkl"
-        scaler_path = MODEL_DIR / f"{safe_seg}_scaler.pkl"
-        cols_path   = MODEL_DIR / f"{safe_seg}_columns.json"
-
-        with open(model_path,  "wb") as f: pickle.dump(kmeans,  f)
-        with open(scaler_path, "wb") as f: pickle.dump(scaler,  f)
-        with open(cols_path,   "w")  as f: json.dump(X.columns.tolist(), f)
-
-        model_registry[segment] = {
-            "segment":       segment,
-            "n_customers":   n,
-            "k":             k,
-            "inertia":       round(kmeans.inertia_, 4),
-            "silhouette":    sil,
-            "feature_cols":  X.columns.tolist(),
-            "feature_groups": FEATURE_GROUPS,
-            "model_file":    model_path.name,
-            "scaler_file":   scaler_path.name,
-            "cols_file":     cols_path.name,
-        }
-
-        diagnostics.append({
-            "segment":    segment,
-            "n_customers": n,
-            "k":          k,
-            "inertia":    round(kmeans.inertia_, 4),
-            "silhouette": sil,
-        })
-
-        for cid, lbl in zip(customer_ids, prefixed_labels):
-            cluster_outputs.append({
-                "customer_id": cid,
-                "cluster_id":  lbl,
-                "segment":     segment,
-            })
+    results = Parallel(n_jobs=N_JOBS)(
+        delayed(cluster_segment)(segment, sdf) for segment, sdf in df.groupby("segment")
+    )
+    for log, rows, registry_entry, diagnostic in results:
+        print(log, end="")
+        cluster_outputs.extend(rows)
+        if registry_entry is not None:
+            model_registry[registry_entry["segment"]] = registry_entry
+            diagnostics.append(diagnostic)
 
     if not cluster_outputs:
         raise ValueError(
@@ -1,20 +1,42 @@
+import io
+from concurrent.futures import ThreadPoolExecutor
+
 import pandas as pd
 import boto3
+from botocore.config import Config
 
 BUCKET = "ipre-poc"
 TOP_K = 5
 MIN_SUPPORT = 0.05
 MIN_CONFIDENCE = 0.05
 
-s3 = boto3.client("s3")
+# Ranged-GET fan-out for large files — one S3 stream is bandwidth-capped
+S3_CHUNK_BYTES = 8 * 1024 * 1024
+S3_WORKERS     = 16
+
+s3 = boto3.client("s3", config=Config(max_pool_connections=2 * S3_WORKERS, retries={"mode": "adaptive"}))
 
 
 # --------------------------------------------------
 # Helpers
 # --------------------------------------------------
+def get_s3_bytes(key):
+    """Download an object as concurrent ranged GETs, reassembled in order."""
+    size   = s3.head_object(Bucket=BUCKET, Key=key)["ContentLength"]
+    ranges = [(start, min(start + S3_CHUNK_BYTES, size) - 1) for start in range(0, size, S3_CHUNK_BYTES)]
+    if len(ranges) <= 1:
+        return s3.get_object(Bucket=BUCKET, Key=key)["Body"].read()
+
+    def fetch(byte_range):
+        start, end = byte_range
+        return s3.get_object(Bucket=BUCKET, Key=key, Range=f"bytes={start}-{end}")["Body"].read()
+
+    with ThreadPoolExecutor(max_workers=S3_WORKERS) as pool:
+        return b"".join(pool.map(fetch, ranges))
+
+
 def read_csv_s3(key):
-    obj = s3.get_object(Bucket=BUCKET, Key=key)
-    return pd.read_csv(obj["Body"])
+    return pd.read_csv(io.BytesIO(get_s3_bytes(key)), engine="pyarrow")
 
 
 def fail(msg):